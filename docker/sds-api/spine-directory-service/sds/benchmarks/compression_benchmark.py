@@ -0,0 +1,58 @@
+"""
+Measures how well `/Device` bundles built from the mock `sds_as_response.json` data set compress with each response
+compression encoding and level, and the CPU time compressing them takes.
+
+Run from the sds directory with `python -m benchmarks.compression_benchmark`.
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.fhir_mapper_benchmark import map_devices
+from request.compression import ENCODINGS, CompressionTransform, create_compressor
+from utilities import json_serializer
+
+MOCK_AS_DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "lookup", "mock_data", "sds_as_response.json")
+
+
+def _cpu_time_per_call(func, number: int, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(number):
+            func()
+        timings.append(time.process_time() - start)
+    return min(timings) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[2, 20, 100],
+                        help="Device resources per bundle, cycling through the mock data set")
+    parser.add_argument("--number", type=int, default=20, help="bundles compressed per timing")
+    parser.add_argument("--repeat", type=int, default=3, help="timings taken, the best of which is reported")
+    args = parser.parse_args()
+
+    with open(MOCK_AS_DATA_PATH) as mock_as_data_file:
+        mock_as_data = json.load(mock_as_data_file)
+
+    for devices in args.devices:
+        ldap_results = [mock_as_data[index % len(mock_as_data)] for index in range(devices)]
+        bundle = map_devices(ldap_results)
+        for pretty in [True, False]:
+            body = json_serializer.dumps(bundle, pretty)
+            body = body.encode() if isinstance(body, str) else body
+            layout = "pretty" if pretty else "compact"
+            print(f"{devices:4d} devices {layout:<8} {'identity':<8}    {len(body):10d} bytes")
+            for encoding, (_, levels) in ENCODINGS.items():
+                for level in sorted({levels.start, CompressionTransform.levels[encoding], levels.stop - 1}):
+                    compressed = create_compressor(encoding, level).compress(body, True)
+                    cpu_time = _cpu_time_per_call(lambda: create_compressor(encoding, level).compress(body, True),
+                                                  args.number, args.repeat)
+                    print(f"{devices:4d} devices {layout:<8} {encoding:<8} {level:2d} {len(compressed):10d} bytes "
+                          f"{len(body) / len(compressed):6.1f}x {cpu_time * 1e3:8.3f} ms cpu")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measures the cost of mapping LDAP results to FHIR resources with `request.fhir_json_mapper`.
+
+Run from the sds directory with `python -m benchmarks.fhir_mapper_benchmark`.
+"""
+import argparse
+import timeit
+
+from request.fhir_json_mapper import build_bundle_resource, build_device_resource, build_endpoint_resources
+
+ENDPOINT_LDAP_ATTRIBUTES = {
+    "nhsIDCode": "YES",
+    "nhsMHSAckRequested": "always",
+    "nhsMHSActor": ["urn:oasis:names:tc:ebxml-msg:actor:toPartyMSH"],
+    "nhsMHSDuplicateElimination": "always",
+    "nhsMHSPartyKey": "YES-0000806",
+    "nhsMHSPersistDuration": "PT5M",
+    "nhsMHSRetries": "2",
+    "nhsMHSRetryInterval": "PT1M",
+    "nhsMHSSyncReplyMode": "MSHSignalsOnly",
+    "nhsMhsCPAId": "S20001A000182",
+    "nhsMhsFQDN": "192.168.128.11",
+    "nhsMhsSvcIA": "urn:nhs:names:services:psis:REPC_IN150016UK05",
+    "uniqueIdentifier": ["227319907548"]
+}
+
+DEVICE_LDAP_ATTRIBUTES = {
+    "nhsAsClient": ["RHM"],
+    "nhsAsSvcIA": ["urn:nhs:names:services:psis:REPC_IN150016UK05"] * 50,
+    "nhsIdCode": "RHM",
+    "nhsMhsManufacturerOrg": "LSP02",
+    "nhsMhsPartyKey": "RHM-801710",
+    "uniqueIdentifier": ["200000000359"]
+}
+
+
+def build_endpoint_ldap_results(results: int, addresses_per_result: int):
+    return [
+        {**ENDPOINT_LDAP_ATTRIBUTES,
+         "nhsMHSEndPoint": [f"https://192.168.128.11/{result}/{address}" for address in range(addresses_per_result)]}
+        for result in range(results)
+    ]
+
+
+def map_endpoints(ldap_results):
+    endpoints = []
+    for ldap_result in ldap_results:
+        endpoints += build_endpoint_resources(ldap_result)
+    return build_bundle_resource(endpoints, "http://localhost/Endpoint/", "http://localhost/Endpoint?organization=YES")
+
+
+def map_devices(ldap_results):
+    devices = [build_device_resource(ldap_result) for ldap_result in ldap_results]
+    return build_bundle_resource(devices, "http://localhost/Device/", "http://localhost/Device?organization=RHM")
+
+
+def _report(name: str, func, resources: int, number: int, repeat: int):
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{name:<40} {best * 1e3:10.3f} ms/bundle {best / resources * 1e6:10.3f} us/resource")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--results", type=int, default=20, help="LDAP results per bundle")
+    parser.add_argument("--addresses", type=int, default=10, help="endpoint addresses per LDAP result")
+    parser.add_argument("--number", type=int, default=200, help="bundles built per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings taken, the best of which is reported")
+    args = parser.parse_args()
+
+    endpoint_results = build_endpoint_ldap_results(args.results, args.addresses)
+    device_results = [DEVICE_LDAP_ATTRIBUTES] * args.results
+
+    _report(f"endpoints ({args.results}x{args.addresses})", lambda: map_endpoints(endpoint_results),
+            args.results * args.addresses, args.number, args.repeat)
+    _report(f"devices ({args.results})", lambda: map_devices(device_results),
+            args.results, args.number, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
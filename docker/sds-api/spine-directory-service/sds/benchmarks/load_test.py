@@ -0,0 +1,279 @@
+"""
+Measures the throughput and latency of the service end to end, by driving `/Endpoint` and `/Device` requests at a server
+started with `main.start_tornado_server` in a separate process.
+
+The server looks entries up in one of:
+
+* `mock`: `SDSMockClient`, reading the bundled mock data or a directory generated by `benchmarks.synthetic_directory`
+* `fake-ldap`: `SDSClient` searching an ldap3 mock server loaded with the bundled test entries or a generated directory
+* `ldap`: whatever `SDS_LDAP_*` config points at, such as a local LDAP server loaded with a generated directory
+
+Lookups are sampled from the directory with Zipf-skewed popularity and a fixed seed, so runs are reproducible. The
+results, including a latency histogram, are written as JSON for comparison between commits with `--baseline`.
+
+Run from the sds directory with `python -m benchmarks.load_test --output results.json`.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import socket
+import subprocess
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+from benchmarks import synthetic_directory
+from request.base_handler import IDENTIFIER_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
+    ORG_CODE_QUERY_PARAMETER_NAME, PARTY_KEY_FHIR_IDENTIFIER, SERVICE_ID_FHIR_IDENTIFIER
+
+MOCK_DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "lookup", "mock_data")
+
+BACKENDS = ["mock", "fake-ldap", "ldap"]
+
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99, "p999": 99.9}
+
+# the upper bound of the first histogram bucket, in milliseconds, each later bucket's bound being sqrt(2) times larger
+HISTOGRAM_FIRST_BOUND_MS = 0.1
+
+# a request to make: its path and query parameters
+Request = Tuple[str, List[Tuple[str, str]]]
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _serve(port: int, backend: str, directory: Optional[str], config_overrides: Dict[str, str]):
+    """Run the service on `port`, in the same way as `main.main` but with the given backend and config."""
+    import lookup.sds_client_factory
+    import main
+    from lookup import sds_connection_factory
+    from lookup.cache_warm_up import create_cache_warm_up
+    from lookup.intermediary_address_cache import create_intermediary_address_cache, sds_address_resolver
+    from lookup.sds_connection_pool import SDSConnectionPool
+    from request.response_cache import create_response_cache
+    from utilities import config, json_serializer, secrets
+
+    # requests are looked up in SDS rather than CPM unless the environment says otherwise
+    os.environ.setdefault("USE_CPM", "0")
+    config.setup_config("SDS")
+    secrets.setup_secret_config("SDS")
+    config.config["SERVER_PORT"] = str(port)
+    config.config.setdefault("SPINE_CORE_ODS_CODE", "YES")
+    if backend == "mock":
+        config.config["MOCK_LDAP_RESPONSE"] = "True"
+        if directory:
+            config.config["MOCK_LDAP_MHS_DATA_FILE"] = os.path.join(directory, synthetic_directory.MOCK_MHS_DATA_FILE)
+            config.config["MOCK_LDAP_AS_DATA_FILE"] = os.path.join(directory, synthetic_directory.MOCK_AS_DATA_FILE)
+    elif backend == "fake-ldap":
+        from lookup.tests import ldap_mocks
+        entries_path = os.path.join(directory, synthetic_directory.LDAP_ENTRIES_FILE) if directory \
+            else ldap_mocks.SERVER_ENTRIES_PATH
+        config.config["LDAP_SEARCH_BASE"] = ldap_mocks.NHS_SERVICES_BASE
+        sds_connection_factory.create_connection_pool = \
+            lambda: SDSConnectionPool(lambda: ldap_mocks.fake_ldap_connection(entries_path))
+    config.config.update(config_overrides)
+    json_serializer.configure()
+
+    sds_client = lookup.sds_client_factory.get_sds_client()
+    intermediary_address_cache = create_intermediary_address_cache(sds_address_resolver(sds_client))
+    main.start_tornado_server(sds_client, intermediary_address_cache, None, create_response_cache(),
+                              create_cache_warm_up(sds_client))
+
+
+def _read_mhs_entries(directory: Optional[str]) -> List[Dict]:
+    if not directory:
+        with open(os.path.join(MOCK_DATA_DIR, synthetic_directory.MOCK_MHS_DATA_FILE)) as mock_data_file:
+            # the bundled mock data is a Python literal rather than strict JSON, as read by `SDSMockClient`
+            return ast.literal_eval(mock_data_file.read())
+    with open(os.path.join(directory, synthetic_directory.MOCK_MHS_DATA_FILE)) as mock_data_file:
+        return json.load(mock_data_file)
+
+
+def build_requests(mhs_entries: List[Dict], count: int, skew: float, device_ratio: float, seed: int) -> List[Request]:
+    """Build `count` requests for the skewed sample of lookups, every `1 / device_ratio`th of them to `/Device`."""
+    requests = []
+    device_every = round(1 / device_ratio) if device_ratio > 0 else 0
+    queries = synthetic_directory.sample_endpoint_queries(mhs_entries, count, skew, seed)
+    for position, (ods_code, interaction_id, party_key) in enumerate(queries):
+        params = [(ORG_CODE_QUERY_PARAMETER_NAME, f"{ORG_CODE_FHIR_IDENTIFIER}|{ods_code}"),
+                  (IDENTIFIER_QUERY_PARAMETER_NAME, f"{SERVICE_ID_FHIR_IDENTIFIER}|{interaction_id}")]
+        if device_every and position % device_every == 0:
+            params.append((IDENTIFIER_QUERY_PARAMETER_NAME, f"{PARTY_KEY_FHIR_IDENTIFIER}|{party_key}"))
+            requests.append(("/Device", params))
+        else:
+            requests.append(("/Endpoint", params))
+    return requests
+
+
+async def _wait_until_ready(base_url: str, timeout: float):
+    client = AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.fetch(f"{base_url}/healthcheck", request_timeout=1)
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Server at {base_url} did not become ready within {timeout} seconds")
+            await asyncio.sleep(0.1)
+
+
+async def drive(base_url: str, requests: List[Request], concurrency: int,
+                duration: float = 0) -> List[Tuple[str, int, float]]:
+    """
+    Make `requests` with `concurrency` of them in flight at once, stopping early after `duration` seconds if given.
+    Returns the path, status code and latency in seconds of each request made.
+    """
+    client = AsyncHTTPClient(max_clients=concurrency)
+    pending = iter(requests)
+    results = []
+    deadline = time.monotonic() + duration if duration > 0 else math.inf
+
+    async def worker():
+        for path, params in pending:
+            if time.monotonic() > deadline:
+                return
+            request = HTTPRequest(f"{base_url}{path}?{urlencode(params)}", headers={"Accept": "application/fhir+json"})
+            start = time.perf_counter()
+            try:
+                response = await client.fetch(request)
+                code = response.code
+            except HTTPClientError as e:
+                code = e.code
+            except Exception:
+                code = 0
+            results.append((path, code, time.perf_counter() - start))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return results
+
+
+def _percentile(sorted_latencies: List[float], percentile: float) -> float:
+    rank = max(math.ceil(percentile / 100 * len(sorted_latencies)), 1)
+    return sorted_latencies[rank - 1]
+
+
+def _histogram(sorted_latencies_ms: List[float]) -> List[Dict]:
+    buckets: Dict[float, int] = {}
+    for latency in sorted_latencies_ms:
+        bucket = max(math.ceil(2 * math.log2(latency / HISTOGRAM_FIRST_BOUND_MS)), 0) if latency > 0 else 0
+        bound = round(HISTOGRAM_FIRST_BOUND_MS * math.sqrt(2) ** bucket, 3)
+        buckets[bound] = buckets.get(bound, 0) + 1
+    return [{"le_ms": bound, "count": count} for bound, count in buckets.items()]
+
+
+def summarise(results: List[Tuple[str, int, float]], elapsed: float) -> Dict:
+    """Summarise the results of a run: throughput, latency percentiles and a histogram, overall and for each path."""
+    def summary(path_results):
+        latencies_ms = sorted(latency * 1000 for _, _, latency in path_results)
+        codes: Dict[str, int] = {}
+        for _, code, _ in path_results:
+            codes[str(code)] = codes.get(str(code), 0) + 1
+        return {
+            "requests": len(path_results),
+            "errors": sum(count for code, count in codes.items() if not 200 <= int(code) < 500),
+            "status_codes": codes,
+            "throughput_per_second": round(len(path_results) / elapsed, 1) if elapsed else None,
+            "latency_ms": {
+                **{name: round(_percentile(latencies_ms, percentile), 3) for name, percentile in PERCENTILES.items()},
+                "mean": round(sum(latencies_ms) / len(latencies_ms), 3),
+                "max": round(latencies_ms[-1], 3)
+            } if latencies_ms else {},
+            "histogram": _histogram(latencies_ms)
+        }
+
+    paths = sorted({path for path, _, _ in results})
+    return {**summary(results), "paths": {path: summary([result for result in results if result[0] == path])
+                                          for path in paths}}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: Dict, baseline: Dict) -> List[str]:
+    """Describe the change in throughput and each latency percentile from `baseline` to `results`."""
+    lines = []
+    metrics = [("throughput_per_second", results.get("throughput_per_second"), baseline.get("throughput_per_second"))]
+    metrics += [(f"latency {name}", results["latency_ms"].get(name), baseline.get("latency_ms", {}).get(name))
+                for name in PERCENTILES]
+    for name, value, baseline_value in metrics:
+        if value is None or not baseline_value:
+            continue
+        lines.append(f"{name:<22} {baseline_value:>10} -> {value:>10} ({(value / baseline_value - 1) * 100:+.1f}%)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=BACKENDS, default="mock", help="where the server looks entries up")
+    parser.add_argument("--directory", help="a directory generated by benchmarks.synthetic_directory to look up, "
+                                            "rather than the bundled data")
+    parser.add_argument("--requests", type=int, default=10000, help="requests made, after the warm-up requests")
+    parser.add_argument("--warm-up-requests", type=int, default=500, help="requests made before measuring")
+    parser.add_argument("--duration", type=float, default=0, help="seconds after which to stop making requests early")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="Zipf exponent of lookup popularity, 0 looking every entry up equally often")
+    parser.add_argument("--device-ratio", type=float, default=0.2, help="fraction of requests made to /Device")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the sampling of lookups, for reproducible runs")
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=VALUE",
+                        help="a config value (without the SDS_ prefix) for the server, such as "
+                             "LDAP_CACHE_TTL_IN_SECONDS=60, may be repeated")
+    parser.add_argument("--startup-timeout", type=float, default=300, help="seconds to wait for the server to be ready")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare these results to")
+    args = parser.parse_args()
+
+    config_overrides = dict(value.split("=", 1) for value in args.config)
+    mhs_entries = _read_mhs_entries(args.directory)
+    requests = build_requests(mhs_entries, args.warm_up_requests + args.requests, args.skew, args.device_ratio,
+                              args.seed)
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=_serve, args=(port, args.backend, args.directory, config_overrides),
+                                     daemon=True)
+    server.start()
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(_wait_until_ready(base_url, args.startup_timeout))
+        loop.run_until_complete(drive(base_url, requests[:args.warm_up_requests], args.concurrency))
+        start = time.perf_counter()
+        results = loop.run_until_complete(drive(base_url, requests[args.warm_up_requests:], args.concurrency,
+                                                args.duration))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        "commit": _git_commit(),
+        "parameters": {**vars(args), "config": config_overrides, "directory_entries": len(mhs_entries)},
+        "elapsed_seconds": round(elapsed, 3),
+        **summarise(results, elapsed)
+    }
+    print(f"{report['requests']} requests in {report['elapsed_seconds']}s, {report['errors']} errors, "
+          f"{report['throughput_per_second']} requests/s, latency ms {report['latency_ms']}")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            print("\n".join(compare(report, json.load(baseline_file))))
+
+
+if __name__ == "__main__":
+    main()
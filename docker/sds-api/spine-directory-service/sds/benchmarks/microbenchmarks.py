@@ -0,0 +1,211 @@
+"""
+Times the request hot paths on realistic and worst-case inputs, and fails if any has regressed against stored baselines.
+
+Timings are normalised by the time taken by a fixed calibration workload measured in the same run, so baselines saved
+on one machine can be checked on another. A benchmark has regressed if its normalised time is more than `--threshold`
+slower than its baseline.
+
+Run from the sds directory with `python -m benchmarks.microbenchmarks`, adding `--check` to exit with an error on a
+regression or `--save-baselines` to replace the baselines with this run's timings.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+import tornado.httputil
+import tornado.web
+
+from benchmarks.fhir_mapper_benchmark import DEVICE_LDAP_ATTRIBUTES, ENDPOINT_LDAP_ATTRIBUTES
+from request.base_handler import BaseHandler, IDENTIFIER_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
+    ORG_CODE_QUERY_PARAMETER_NAME, PARTY_KEY_FHIR_IDENTIFIER, SERVICE_ID_FHIR_IDENTIFIER
+from request.content_type_validator import get_valid_accept_type
+from request.cpm import DeviceCpm, EndpointCpm
+from request.fhir_json_mapper import build_bundle_resource, build_device_resource, build_endpoint_resources
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "microbenchmark_baselines.json")
+CPM_TEST_DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "request", "tests", "test_data", "cpm")
+
+# the seconds each timing should take, enough to make the timer's resolution irrelevant
+MIN_TIMING_SECONDS = 0.05
+
+
+class _Connection(object):
+    """The part of an HTTP connection a request handler uses when it is created."""
+
+    def set_close_callback(self, callback):
+        pass
+
+
+def _handler(query_params: List[Tuple[str, str]]) -> BaseHandler:
+    uri = "/Endpoint?" + "&".join(f"{name}={value}" for name, value in query_params)
+    request = tornado.httputil.HTTPServerRequest(method="GET", uri=uri, connection=_Connection())
+    return BaseHandler(tornado.web.Application(), request, sds_client=None)
+
+
+def _read_cpm_data(file_name: str) -> List[Dict]:
+    with open(os.path.join(CPM_TEST_DATA_PATH, file_name)) as cpm_data_file:
+        return json.load(cpm_data_file)
+
+
+def _calibration():
+    # a fixed workload of the dict, list and string operations the benchmarked code is made of
+    values = {f"key{index}": [str(index)] * 3 for index in range(200)}
+    return sorted(",".join(value) for value in values.values())
+
+
+def build_benchmarks() -> Dict[str, Callable[[], object]]:
+    """The functions to time, by name, each taking a realistic or worst-case input prepared up front."""
+    endpoint = {**ENDPOINT_LDAP_ATTRIBUTES, "nhsMHSEndPoint": ["https://192.168.128.11/reliablemessaging"]}
+    endpoint_many_addresses = {**ENDPOINT_LDAP_ATTRIBUTES,
+                               "nhsMHSEndPoint": [f"https://192.168.128.11/{address}" for address in range(100)]}
+    device = {**DEVICE_LDAP_ATTRIBUTES, "nhsAsSvcIA": DEVICE_LDAP_ATTRIBUTES["nhsAsSvcIA"][:5]}
+    device_many_interactions = {**DEVICE_LDAP_ATTRIBUTES,
+                                "nhsAsSvcIA": [f"urn:nhs:names:services:psis:INTERACTION_{index}"
+                                               for index in range(1000)]}
+    endpoint_resources = build_endpoint_resources(endpoint) * 5
+    many_endpoint_resources = build_endpoint_resources(endpoint_many_addresses) * 10
+
+    devices = _read_cpm_data("returned_devices_multiple.json")
+    endpoints = _read_cpm_data("returned_endpoints_multiple.json")
+
+    org_code = (ORG_CODE_QUERY_PARAMETER_NAME, f"{ORG_CODE_FHIR_IDENTIFIER}|YES")
+    service_id = (IDENTIFIER_QUERY_PARAMETER_NAME,
+                  f"{SERVICE_ID_FHIR_IDENTIFIER}|urn:nhs:names:services:psis:REPC_IN150016UK05")
+    party_key = (IDENTIFIER_QUERY_PARAMETER_NAME, f"{PARTY_KEY_FHIR_IDENTIFIER}|YES-0000806")
+    handler = _handler([org_code, service_id, party_key])
+    # many identifiers, none of them the one looked for, so every one is checked
+    other_identifiers = [(IDENTIFIER_QUERY_PARAMETER_NAME, f"https://fhir.nhs.uk/Id/other{index}|{'x' * 100}")
+                         for index in range(200)]
+    many_identifiers_handler = _handler([org_code] + other_identifiers)
+
+    client_accept = tornado.httputil.HTTPHeaders({"Accept": "application/json, text/plain, */*"})
+    fhir_accept = tornado.httputil.HTTPHeaders({"Accept": "application/fhir+json"})
+    long_accept = tornado.httputil.HTTPHeaders(
+        {"Accept": ", ".join([f"application/vnd.example{index}+json" for index in range(200)] + ["application/json"])})
+
+    return {
+        "build_endpoint_resources/1 address": lambda: build_endpoint_resources(endpoint),
+        "build_endpoint_resources/100 addresses": lambda: build_endpoint_resources(endpoint_many_addresses),
+        "build_device_resource/5 interactions": lambda: build_device_resource(device),
+        "build_device_resource/1000 interactions": lambda: build_device_resource(device_many_interactions),
+        "build_bundle_resource/5 endpoints": lambda: build_bundle_resource(
+            endpoint_resources, "http://localhost/Endpoint/", "http://localhost/Endpoint?organization=YES"),
+        "build_bundle_resource/1000 endpoints": lambda: build_bundle_resource(
+            many_endpoint_resources, "http://localhost/Endpoint/", "http://localhost/Endpoint?organization=YES"),
+        "transform_to_ldap/2 devices": lambda: DeviceCpm(devices).transform_to_ldap(),
+        "transform_to_ldap/200 devices": lambda: DeviceCpm(devices * 100).transform_to_ldap(),
+        "transform_to_ldap/endpoints": lambda: EndpointCpm(endpoints).transform_to_ldap(),
+        "get_optional_query_param/3 params": lambda: handler.get_optional_query_param(
+            IDENTIFIER_QUERY_PARAMETER_NAME, PARTY_KEY_FHIR_IDENTIFIER),
+        "get_optional_query_param/200 unmatched": lambda: many_identifiers_handler.get_optional_query_param(
+            IDENTIFIER_QUERY_PARAMETER_NAME, PARTY_KEY_FHIR_IDENTIFIER),
+        "get_valid_accept_type/fhir": lambda: get_valid_accept_type(fhir_accept),
+        "get_valid_accept_type/http client": lambda: get_valid_accept_type(client_accept),
+        "get_valid_accept_type/200 types": lambda: get_valid_accept_type(long_accept),
+    }
+
+
+def time_per_call(func: Callable[[], object], repeat: int) -> float:
+    """The best of `repeat` timings of `func`, in seconds of CPU time per call."""
+    # CPU time rather than wall time, so time the process spends waiting for a CPU is not counted
+    timer = timeit.Timer(func, timer=time.process_time)
+    number, elapsed = timer.autorange()
+    # autorange finds a number of calls taking at least 0.2 seconds, which is scaled down to make repeats quicker
+    number = max(int(number * MIN_TIMING_SECONDS / elapsed), 1) if elapsed else number
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(benchmarks: Dict[str, Callable[[], object]], repeat: int) -> Dict:
+    """Time each of `benchmarks`, returning the calibration time and each one's time and normalised time."""
+    # the calibration workload is timed between every benchmark and the best of those timings used, so a machine which
+    # is briefly busier or slower does not skew every normalised time in the run
+    calibrations = [time_per_call(_calibration, repeat)]
+    timings = {}
+    for name, func in benchmarks.items():
+        timings[name] = time_per_call(func, repeat)
+        calibrations.append(time_per_call(_calibration, repeat))
+    calibration = min(calibrations)
+    results = {name: {"us_per_call": round(seconds * 1e6, 3), "relative": round(seconds / calibration, 4)}
+               for name, seconds in timings.items()}
+    return {"calibration_us": round(calibration * 1e6, 3), "benchmarks": results}
+
+
+def best_of(runs: List[Dict]) -> Dict:
+    """Combine several runs of the same benchmarks, keeping each one's fastest normalised time."""
+    best = min(runs, key=lambda run_results: run_results["calibration_us"])
+    benchmarks = {}
+    for run_results in runs:
+        for name, result in run_results["benchmarks"].items():
+            if name not in benchmarks or result["relative"] < benchmarks[name]["relative"]:
+                benchmarks[name] = result
+    return {"calibration_us": best["calibration_us"], "benchmarks": benchmarks}
+
+
+def find_regressions(results: Dict, baselines: Dict, threshold: float) -> Dict[str, float]:
+    """
+    Find each benchmark whose normalised time is more than `threshold` (a fraction) slower than its baseline, returning
+    the fraction it is slower by.
+    """
+    regressions = {}
+    for name, result in results["benchmarks"].items():
+        baseline = baselines["benchmarks"].get(name)
+        if baseline is not None and result["relative"] > baseline["relative"] * (1 + threshold):
+            regressions[name] = result["relative"] / baseline["relative"] - 1
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run the benchmarks whose names contain this")
+    parser.add_argument("--repeat", type=int, default=5, help="timings taken, the best of which is reported")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="fraction slower than its baseline at which a benchmark has regressed")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="file the baselines are stored in")
+    parser.add_argument("--check", action="store_true", help="exit with an error if any benchmark has regressed")
+    parser.add_argument("--save-baselines", action="store_true", help="replace the baselines with this run's timings")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="runs of every benchmark, or of each apparently regressed benchmark when checking, the "
+                             "fastest of which counts")
+    args = parser.parse_args()
+
+    benchmarks = {name: func for name, func in build_benchmarks().items() if args.filter in name}
+    runs = args.runs if args.save_baselines else 1
+    results = best_of([run(benchmarks, args.repeat) for _ in range(runs)])
+
+    baselines = {"benchmarks": {}}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as baselines_file:
+            baselines = json.load(baselines_file)
+    print(f"{'calibration':<42} {results['calibration_us']:10.3f} us")
+    for name, result in results["benchmarks"].items():
+        baseline = baselines["benchmarks"].get(name)
+        change = f"{(result['relative'] / baseline['relative'] - 1) * 100:+7.1f}%" if baseline else "    new"
+        print(f"{name:<42} {result['us_per_call']:10.3f} us {result['relative']:10.3f}x calibration {change}")
+
+    if args.save_baselines:
+        # baselines of benchmarks not run this time are kept
+        baselines = {"calibration_us": results["calibration_us"],
+                     "benchmarks": {**baselines["benchmarks"], **results["benchmarks"]}}
+        with open(args.baselines, "w") as baselines_file:
+            json.dump(baselines, baselines_file, indent=2)
+            baselines_file.write("\n")
+
+    regressions = find_regressions(results, baselines, args.threshold)
+    # timings are noisy enough on shared machines that a benchmark only counts as regressed if it is slower every time
+    for _ in range(args.runs - 1):
+        if not regressions:
+            break
+        results = best_of([results, run({name: benchmarks[name] for name in regressions}, args.repeat)])
+        regressions = find_regressions(results, baselines, args.threshold)
+    for name, slowdown in regressions.items():
+        print(f"REGRESSION: {name} is {slowdown * 100:.0f}% slower than its baseline")
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
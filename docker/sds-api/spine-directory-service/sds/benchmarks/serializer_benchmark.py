@@ -0,0 +1,60 @@
+"""
+Measures the size and CPU cost of serializing FHIR bundles with each of the serializers in `utilities.json_serializer`.
+
+Run from the sds directory with `python -m benchmarks.serializer_benchmark`.
+"""
+import argparse
+import time
+
+from benchmarks.fhir_mapper_benchmark import DEVICE_LDAP_ATTRIBUTES, build_endpoint_ldap_results, map_devices, \
+    map_endpoints
+from request.error_handler import Code, Issue, OperationOutcome, Severity, SpineCodings
+from utilities import json_serializer
+
+# the indent each response is pretty printed with
+INDENTS = {"Endpoint bundle": 2, "Device bundle": 2, "OperationOutcome": 4}
+
+
+def _cpu_time_per_call(func, number: int, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(number):
+            func()
+        timings.append(time.process_time() - start)
+    return min(timings) / number
+
+
+def _report(name: str, serializer_name: str, pretty: bool, serialized, cpu_time: float):
+    layout = "pretty" if pretty else "compact"
+    size = len(serialized.encode() if isinstance(serialized, str) else serialized)
+    print(f"{name:<18} {serializer_name:<8} {layout:<8} {size:10d} bytes {cpu_time * 1e6:10.1f} us cpu/response")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--results", type=int, default=20, help="LDAP results per bundle")
+    parser.add_argument("--addresses", type=int, default=10, help="endpoint addresses per LDAP result")
+    parser.add_argument("--number", type=int, default=200, help="responses serialized per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings taken, the best of which is reported")
+    args = parser.parse_args()
+
+    operation_outcome = OperationOutcome([Issue(Severity.error, Code.not_found, [SpineCodings.NO_RECORD_FOUND],
+                                                diagnostics="HTTP endpoint not found")], id="benchmark").to_dict()
+    responses = {
+        "Endpoint bundle": map_endpoints(build_endpoint_ldap_results(args.results, args.addresses)),
+        "Device bundle": map_devices([DEVICE_LDAP_ATTRIBUTES] * args.results),
+        "OperationOutcome": operation_outcome
+    }
+
+    for name, response in responses.items():
+        indent = INDENTS[name]
+        for serializer_name, serializer in json_serializer.SERIALIZERS.items():
+            for pretty in [True, False]:
+                response_indent = indent if pretty else None
+                cpu_time = _cpu_time_per_call(lambda: serializer(response, response_indent), args.number, args.repeat)
+                _report(name, serializer_name, pretty, serializer(response, response_indent), cpu_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Generates synthetic SDS directories of production-like size, for benchmarking lookups at scale.
+
+Each organisation has a number of MHS party keys and, for each party key, one nhsMhs entry per interaction it supports
+and one nhsAs entry listing every interaction. The directory is written both as mock data read by `SDSMockClient`
+(point `SDS_MOCK_LDAP_MHS_DATA_FILE` and `SDS_MOCK_LDAP_AS_DATA_FILE` at it) and as entries loaded into an ldap3 mock
+server with `entries_from_json` (pass it to `lookup.tests.ldap_mocks.fake_ldap_connection`).
+
+Run from the sds directory with `python -m benchmarks.synthetic_directory --output-dir <directory>`.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+MOCK_MHS_DATA_FILE = "sds_mhs_response.json"
+MOCK_AS_DATA_FILE = "sds_as_response.json"
+LDAP_ENTRIES_FILE = "ldap_entries.json"
+
+SERVICES_BASE = "ou=Services,o=nhs"
+
+# real interactions, so synthetic directories can be queried with the same requests as the bundled mock data
+KNOWN_INTERACTION_IDS = [
+    "urn:nhs:names:services:psis:REPC_IN150016UK05",
+    "urn:nhs:names:services:psis:MCCI_IN010000UK13",
+    "urn:nhs:names:services:psis:QUPA_IN040000UK32",
+    "urn:nhs:names:services:psis:COPC_IN000001UK01",
+    "urn:nhs:names:services:gpconnect:fhir:operation:gpc.getstructuredrecord-1",
+    "urn:nhs:names:services:gpconnect:documents:fhir:rest:search:documentreference-1",
+]
+
+# an /Endpoint query: the ods code, interaction id and party key of a lookup
+EndpointQuery = Tuple[str, str, Optional[str]]
+
+
+def _interaction_ids(count: int) -> List[str]:
+    synthetic = (f"urn:nhs:names:services:synthetic:INTERACTION_{index:05d}" for index in itertools.count())
+    return list(itertools.islice(itertools.chain(KNOWN_INTERACTION_IDS, synthetic), count))
+
+
+def _split_interaction_id(interaction_id: str) -> Tuple[str, str]:
+    service, _, name = interaction_id.rpartition(":")
+    return service, name
+
+
+def generate_directory(organisations: int, interactions_per_organisation: int, party_keys_per_organisation: int = 1,
+                       endpoints_per_mhs: int = 1, interaction_pool: int = 0, seed: int = 0
+                       ) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Generate the attributes of the nhsMhs and nhsAs entries of a synthetic directory.
+
+    :param organisations: The number of organisations, each with its own ODS code.
+    :param interactions_per_organisation: The number of interactions each of an organisation's party keys supports.
+    :param party_keys_per_organisation: The number of MHS party keys of each organisation.
+    :param endpoints_per_mhs: The number of values of each nhsMhs entry's multi-valued `nhsMHSEndPoint`.
+    :param interaction_pool: The number of distinct interactions to choose each party key's interactions from, at least
+    `interactions_per_organisation`. Defaults to `interactions_per_organisation`, so every party key supports the same
+    interactions.
+    :param seed: Seeds the choice of interactions, so the same arguments always generate the same directory.
+    :return: The nhsMhs and nhsAs entries.
+    """
+    pool = _interaction_ids(max(interaction_pool, interactions_per_organisation))
+    rng = random.Random(seed)
+    unique_identifiers = itertools.count(100000000000)
+    mhs_entries = []
+    as_entries = []
+    for organisation in range(organisations):
+        ods_code = f"S{organisation:06d}"
+        manufacturer = f"M{organisation % 100:05d}"
+        for party in range(party_keys_per_organisation):
+            party_key = f"{ods_code}-{party:07d}"
+            fqdn = f"mhs{party}.{ods_code.lower()}.synthetic.nhs.uk"
+            cpa_id_prefix = f"S{next(unique_identifiers)}"
+            interaction_ids = pool if len(pool) == interactions_per_organisation \
+                else sorted(rng.sample(pool, interactions_per_organisation))
+            for interaction_id in interaction_ids:
+                service, name = _split_interaction_id(interaction_id)
+                cpa_id = f"{cpa_id_prefix}{name}"
+                mhs_entries.append({
+                    "nhsIDCode": ods_code,
+                    "nhsMHSPartyKey": party_key,
+                    "nhsMhsSvcIA": interaction_id,
+                    "nhsMHsSN": service,
+                    "nhsMHsIN": name,
+                    "nhsMhsFQDN": fqdn,
+                    "nhsMHSEndPoint": [f"https://{fqdn}/{endpoint}/reliablemessaging"
+                                       for endpoint in range(endpoints_per_mhs)],
+                    "nhsMhsCPAId": cpa_id,
+                    "nhsMHSAckRequested": "always",
+                    "nhsMHSDuplicateElimination": "always",
+                    "nhsMHSPersistDuration": "PT5M",
+                    "nhsMHSRetries": "2",
+                    "nhsMHSRetryInterval": "PT1M",
+                    "nhsMHSSyncReplyMode": "MSHSignalsOnly",
+                    "uniqueIdentifier": [cpa_id]
+                })
+            as_entries.append({
+                "nhsIDCode": ods_code,
+                "nhsMHSPartyKey": party_key,
+                "nhsAsSvcIA": list(interaction_ids),
+                "nhsAsClient": [ods_code],
+                "nhsMhsManufacturerOrg": manufacturer,
+                "uniqueIdentifier": [str(next(unique_identifiers))]
+            })
+    return mhs_entries, as_entries
+
+
+def sample_endpoint_queries(mhs_entries: List[Dict], count: int, skew: float = 1.0, seed: int = 0
+                            ) -> List[EndpointQuery]:
+    """
+    Sample `count` lookups of the given nhsMhs entries, with Zipf distributed popularity: the entry of rank `r` is
+    looked up in proportion to `1 / r ** skew`, so a few organisations receive most of the traffic as in production.
+    A `skew` of 0 looks every entry up equally often. Which entries are most popular is shuffled by `seed`. Entries with
+    several interactions are looked up by the first.
+    """
+    rng = random.Random(seed)
+    ranked = list(range(len(mhs_entries)))
+    rng.shuffle(ranked)
+    weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(ranked))))
+    queries = []
+    for position in rng.choices(ranked, cum_weights=weights, k=count):
+        entry = mhs_entries[position]
+        interaction_ids = entry["nhsMhsSvcIA"]
+        interaction_id = interaction_ids[0] if isinstance(interaction_ids, list) else interaction_ids
+        queries.append((entry["nhsIDCode"], interaction_id, entry["nhsMHSPartyKey"]))
+    return queries
+
+
+def to_ldap_entries(mhs_entries: List[Dict], as_entries: List[Dict]) -> Dict:
+    """Convert entries to the JSON read by ldap3's `entries_from_json` to populate a mock server."""
+    ldap_entries = []
+    for object_class, entries in [("nhsMhs", mhs_entries), ("nhsAs", as_entries)]:
+        for entry in entries:
+            attributes = {**entry, "objectClass": ["top", object_class]}
+            ldap_entries.append({
+                "dn": f"uniqueIdentifier={entry['uniqueIdentifier'][0]},{SERVICES_BASE}",
+                "attributes": attributes,
+                "raw": {name: value if isinstance(value, list) else [value] for name, value in attributes.items()}
+            })
+    return {"entries": ldap_entries}
+
+
+def write_directory(output_dir: str, mhs_entries: List[Dict], as_entries: List[Dict]):
+    """Write the mock data and ldap3 entries files of a directory to `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name, contents in [(MOCK_MHS_DATA_FILE, mhs_entries), (MOCK_AS_DATA_FILE, as_entries),
+                                (LDAP_ENTRIES_FILE, to_ldap_entries(mhs_entries, as_entries))]:
+        with open(os.path.join(output_dir, file_name), "w") as output_file:
+            output_file.write(json.dumps(contents))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output-dir", required=True, help="directory the generated files are written to")
+    parser.add_argument("--organisations", type=int, default=10000, help="organisations in the directory")
+    parser.add_argument("--interactions", type=int, default=10, help="interactions supported by each party key")
+    parser.add_argument("--party-keys", type=int, default=1, help="MHS party keys of each organisation")
+    parser.add_argument("--endpoints", type=int, default=1, help="endpoint addresses of each nhsMhs entry")
+    parser.add_argument("--interaction-pool", type=int, default=0,
+                        help="distinct interactions each party key's interactions are chosen from")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the random choices, for reproducible directories")
+    args = parser.parse_args()
+
+    mhs_entries, as_entries = generate_directory(args.organisations, args.interactions, args.party_keys,
+                                                 args.endpoints, args.interaction_pool, args.seed)
+    write_directory(args.output_dir, mhs_entries, as_entries)
+    print(f"Wrote {len(mhs_entries)} nhsMhs and {len(as_entries)} nhsAs entries to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
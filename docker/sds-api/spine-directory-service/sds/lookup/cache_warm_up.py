@@ -0,0 +1,203 @@
+"""This module contains the warm-up of the SDS lookup cache at startup."""
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from lookup.sds_caching_client import AS_LOOKUP, MHS_LOOKUP, SDSCachingClient
+from utilities import config
+from utilities import integration_adaptors_logger as log
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+# the number of MHS lookups warmed up with a single batched lookup
+MHS_BATCH_SIZE = 50
+
+# a lookup to warm up, in the same form as the keys of `SDSCachingClient`: the lookup type ("mhs" or "as"), ods code,
+# interaction id, party key and manufacturing organization
+WarmUpQuery = Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str]]
+
+_QUERY_FIELDS = ["lookup", "org_code", "interaction_id", "party_key", "manufacturing_organization"]
+
+
+def read_queries(path: str) -> List[WarmUpQuery]:
+    """
+    Read the lookups to warm up from the JSON file at `path`, which holds a list of objects such as
+    `{"lookup": "mhs", "org_code": "X26", "interaction_id": "urn:nhs:names:services:psis:REPC_IN150016UK05",
+    "party_key": "X26-822926"}`. `lookup` defaults to "mhs" and any other missing field to null.
+    """
+    with open(path) as queries_file:
+        items = json.load(queries_file)
+
+    queries = []
+    for item in items:
+        lookup = item.get("lookup", MHS_LOOKUP)
+        if lookup not in (MHS_LOOKUP, AS_LOOKUP):
+            raise ValueError(f"Unknown lookup '{lookup}' in {path}")
+        queries.append((lookup,) + tuple(item.get(field) for field in _QUERY_FIELDS[1:]))
+    return queries
+
+
+def write_queries(path: str, queries: List[WarmUpQuery]):
+    """Write `queries` to the JSON file at `path` in the format read by `read_queries`, replacing it atomically."""
+    items = [{field: value for field, value in zip(_QUERY_FIELDS, query) if value is not None} for query in queries]
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as queries_file:
+        json.dump(items, queries_file)
+    os.replace(temporary_path, path)
+
+
+class CacheWarmUp(object):
+    """
+    Preloads the SDS lookup cache with a list of commonly requested lookups before the service reports itself ready,
+    so the first requests after a deploy are not all cache misses. The lookups come from a hand-maintained file and/or
+    a snapshot of the most recently used lookups which the previous instance saved periodically.
+
+    At most `concurrency` lookups are made at once so warming up does not overload LDAP, and once `timeout` seconds
+    have passed the service is reported ready whether or not warm-up has finished.
+    """
+
+    def __init__(self, sds_client: SDSCachingClient, queries_file: Optional[str] = None,
+                 snapshot_file: Optional[str] = None, concurrency: int = 10, timeout: float = 60,
+                 snapshot_interval: float = 300, snapshot_max_queries: int = 1000):
+        """
+        :param sds_client: The caching client to warm up.
+        :param queries_file: A file of lookups to warm up, in the format read by `read_queries`.
+        :param snapshot_file: A file to save the most recently used lookups to, and warm up from on startup.
+        :param concurrency: The maximum number of lookups made at once.
+        :param timeout: The number of seconds after which the service is ready even if warm-up has not finished.
+        :param snapshot_interval: The number of seconds between snapshots being saved, or 0 to never save them.
+        :param snapshot_max_queries: The maximum number of lookups saved in a snapshot.
+        """
+        if not sds_client:
+            raise ValueError('sds_client must not be null')
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        self.sds_client = sds_client
+        self.queries_file = queries_file
+        self.snapshot_file = snapshot_file
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_max_queries = snapshot_max_queries
+        self.ready = False
+        self.lookups = 0
+        self.empty = 0
+        self.failures = 0
+        self._snapshot_task: Optional[asyncio.Future] = None
+
+    def is_ready(self) -> bool:
+        return self.ready
+
+    async def run(self):
+        """Warm up the cache from the queries and snapshot files, then mark the service as ready."""
+        try:
+            queries = self._read_all_queries()
+            logger.info("Warming up the lookup cache with {queries} lookups", fparams={"queries": len(queries)})
+            await asyncio.wait_for(self._warm_up(queries), self.timeout)
+            logger.info("Warmed up the lookup cache. {stats}", fparams={"stats": self.stats()})
+        except asyncio.TimeoutError:
+            logger.warning("Lookup cache warm-up did not finish within {timeout} seconds. {stats}",
+                           fparams={"timeout": self.timeout, "stats": self.stats()})
+        except Exception:
+            logger.error("Lookup cache warm-up failed", exc_info=True)
+        finally:
+            self.ready = True
+
+    def save_snapshot(self):
+        """Save the most recently used lookups to the snapshot file. Failures are logged, not raised."""
+        if not self.snapshot_file:
+            return
+        try:
+            queries = self.sds_client.hot_keys(self.snapshot_max_queries)
+            write_queries(self.snapshot_file, queries)
+            logger.info("Saved {queries} lookups to {snapshot_file}",
+                        fparams={"queries": len(queries), "snapshot_file": self.snapshot_file})
+        except Exception:
+            logger.warning("Failed to save lookups to {snapshot_file}", fparams={"snapshot_file": self.snapshot_file},
+                           exc_info=True)
+
+    def start_saving_snapshots(self):
+        if self.snapshot_file and self.snapshot_interval > 0 and self._snapshot_task is None:
+            self._snapshot_task = asyncio.ensure_future(self._save_snapshots_periodically())
+
+    def stop_saving_snapshots(self):
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "lookups": self.lookups,
+            "empty": self.empty,
+            "failures": self.failures
+        }
+
+    def _read_all_queries(self) -> List[WarmUpQuery]:
+        queries: Dict[WarmUpQuery, None] = {}
+        if self.queries_file:
+            queries.update(dict.fromkeys(read_queries(self.queries_file)))
+        if self.snapshot_file and os.path.exists(self.snapshot_file):
+            try:
+                queries.update(dict.fromkeys(read_queries(self.snapshot_file)))
+            except Exception:
+                # a snapshot left half written or from an incompatible version is not worth failing warm-up over
+                logger.warning("Ignoring unreadable snapshot {snapshot_file}",
+                               fparams={"snapshot_file": self.snapshot_file}, exc_info=True)
+        return list(queries)
+
+    async def _warm_up(self, queries: List[WarmUpQuery]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def look_up(lookup, lookup_queries):
+            async with semaphore:
+                self.lookups += len(lookup_queries)
+                try:
+                    results = await lookup(lookup_queries)
+                    # nothing is cached for these, whether because they match no entries or because LDAP timed out
+                    self.empty += sum(1 for result in results if not result)
+                except Exception:
+                    self.failures += len(lookup_queries)
+                    logger.warning("Failed to warm up lookups {queries}", fparams={"queries": lookup_queries},
+                                   exc_info=True)
+
+        mhs_queries = [query[1:4] for query in queries if query[0] == MHS_LOOKUP]
+        as_queries = [query[1:] for query in queries if query[0] == AS_LOOKUP]
+        await asyncio.gather(
+            *[look_up(self.sds_client.get_mhs_details_batch, mhs_queries[start:start + MHS_BATCH_SIZE])
+              for start in range(0, len(mhs_queries), MHS_BATCH_SIZE)],
+            *[look_up(self._get_as_details, [query]) for query in as_queries])
+
+    async def _get_as_details(self, queries) -> List[List[Dict]]:
+        ods_code, interaction_id, party_key, manufacturing_organization = queries[0]
+        return [await self.sds_client.get_as_details(ods_code, interaction_id, manufacturing_organization, party_key)]
+
+    async def _save_snapshots_periodically(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            self.save_snapshot()
+
+
+def create_cache_warm_up(sds_client) -> Optional[CacheWarmUp]:
+    """
+    Create the cache warm-up from the `WARM_UP_*` config values, or return None if there is nothing to warm up, either
+    because no queries or snapshot file is configured or because lookups are not cached.
+    """
+    queries_file = config.get_config('WARM_UP_QUERIES_FILE', default=None)
+    snapshot_file = config.get_config('WARM_UP_SNAPSHOT_FILE', default=None)
+    if not queries_file and not snapshot_file:
+        return None
+    if not isinstance(sds_client, SDSCachingClient):
+        logger.warning("Not warming up lookups as the lookup cache is disabled, set SDS_LDAP_CACHE_TTL_IN_SECONDS")
+        return None
+
+    return CacheWarmUp(
+        sds_client,
+        queries_file=queries_file,
+        snapshot_file=snapshot_file,
+        concurrency=int(config.get_config('WARM_UP_CONCURRENCY', default='10')),
+        timeout=float(config.get_config('WARM_UP_TIMEOUT_IN_SECONDS', default='60')),
+        snapshot_interval=float(config.get_config('WARM_UP_SNAPSHOT_INTERVAL_IN_SECONDS', default='300')),
+        snapshot_max_queries=int(config.get_config('WARM_UP_SNAPSHOT_MAX_QUERIES', default='1000')))
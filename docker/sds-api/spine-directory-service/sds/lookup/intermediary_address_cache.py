@@ -0,0 +1,155 @@
+"""This module contains a long-lived cache of the Spine core forward reliable and forward express addresses."""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from utilities import config
+from utilities import integration_adaptors_logger as log
+from utilities.constants import INTERACTION_MAPPINGS
+from utilities.single_flight import SingleFlight
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+AddressResolver = Callable[..., Awaitable[Optional[str]]]
+
+
+class IntermediaryAddressCache(object):
+    """
+    Holds the address of the Spine core intermediary for each core spine service interaction (e.g. forward reliable),
+    which every reliable service lookup needs but which very rarely changes. Addresses are resolved on first use (or
+    up front by `warm_up`) and then refreshed in the background every `refresh_interval` seconds, so lookups are served
+    from memory instead of each costing a second query. If resolving an address fails, the last known address is
+    served instead.
+    """
+
+    def __init__(self, resolver: AddressResolver, refresh_interval: float = 300, max_age: float = 900,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param resolver: Resolves the address for a core spine service interaction, raising an error if there is not
+        exactly one. Any extra arguments passed to `get` are passed on to it.
+        :param refresh_interval: The number of seconds between background refreshes, or 0 to disable them.
+        :param max_age: The number of seconds after which an address is resolved again before being served.
+        :param clock: A monotonic clock returning seconds, overridable for testing.
+        """
+        if not resolver:
+            raise ValueError('resolver must not be null')
+
+        self.resolver = resolver
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._clock = clock
+        self._addresses: Dict[str, Tuple[str, float]] = {}
+        self._lookups = SingleFlight()
+        self._refresh_task: Optional[asyncio.Future] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def get(self, core_spine_interaction: str, *args) -> Optional[str]:
+        """
+        Return the address of the intermediary for `core_spine_interaction`, resolving it if it is not already held, or
+        None if none has ever been found.
+        """
+        entry = self._addresses.get(core_spine_interaction)
+        if entry is not None and self._clock() - entry[1] < self.max_age:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        try:
+            address = await self._lookups.do(core_spine_interaction,
+                                             lambda: self._resolve(core_spine_interaction, *args))
+            if address is None and entry is not None:
+                logger.warning("No intermediary address found for {interaction}, serving last known address",
+                               fparams={"interaction": core_spine_interaction})
+                return entry[0]
+            return address
+        except Exception:
+            if entry is None:
+                raise
+            logger.warning("Failed to resolve intermediary address for {interaction}, serving last known address",
+                           fparams={"interaction": core_spine_interaction}, exc_info=True)
+            return entry[0]
+
+    async def warm_up(self):
+        """Resolve the address of every known core spine service interaction. Failures are logged, not raised."""
+        await asyncio.gather(*[self.refresh(interaction) for interaction in INTERACTION_MAPPINGS])
+
+    async def refresh(self, core_spine_interaction: str):
+        """Resolve `core_spine_interaction` again, keeping the address already held if that fails."""
+        self.refreshes += 1
+        try:
+            if await self._lookups.do(core_spine_interaction, lambda: self._resolve(core_spine_interaction)) is None:
+                self.refresh_failures += 1
+        except Exception:
+            self.refresh_failures += 1
+            logger.warning("Failed to refresh intermediary address for {interaction}",
+                           fparams={"interaction": core_spine_interaction}, exc_info=True)
+
+    def start_refreshing(self):
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+
+    def stop_refreshing(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._addresses),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures
+        }
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await asyncio.gather(*[self.refresh(interaction) for interaction in list(self._addresses)])
+            logger.info("Refreshed intermediary addresses. {stats}", fparams={"stats": self.stats()})
+
+    async def _resolve(self, core_spine_interaction: str, *args) -> Optional[str]:
+        address = await self.resolver(core_spine_interaction, *args)
+        if not address:
+            # e.g. CPM finding no endpoint, which is not stored so it cannot replace a good address or be served as one
+            logger.warning("No intermediary address found for {interaction}",
+                           fparams={"interaction": core_spine_interaction})
+            return None
+
+        self._addresses[core_spine_interaction] = (address, self._clock())
+        return address
+
+
+def create_intermediary_address_cache(resolver: AddressResolver) -> IntermediaryAddressCache:
+    refresh_interval = float(config.get_config('INTERMEDIARY_ADDRESS_REFRESH_INTERVAL_IN_SECONDS', default='300'))
+    max_age = float(config.get_config('INTERMEDIARY_ADDRESS_MAX_AGE_IN_SECONDS', default='900'))
+    return IntermediaryAddressCache(resolver, refresh_interval, max_age)
+
+
+def sds_address_resolver(sds_client) -> AddressResolver:
+    """Returns a resolver which looks intermediary addresses up in SDS using `sds_client`."""
+
+    async def resolve(service_id: str) -> str:
+        spine_core_ods_code = config.get_config('SPINE_CORE_ODS_CODE')
+        logger.info("Looking up forward reliable/express routing and reliability information. {org_code}, {service_id}",
+                    fparams={"org_code": spine_core_ods_code, "service_id": service_id})
+        ldap_results = await sds_client.get_mhs_details(spine_core_ods_code, service_id)
+        logger.info("Obtained forward reliable/express routing and reliability information. {ldap_results}",
+                    fparams={"ldap_results": ldap_results})
+
+        if len(ldap_results) != 1:
+            raise ValueError("Expected 1 result for forward reliable/express routing and reliability "
+                             f"but got {str(len(ldap_results))}")
+
+        addresses = ldap_results[0]['nhsMHSEndPoint']
+
+        if len(addresses) != 1:
+            raise ValueError("Expected 1 address for forward reliable/express routing and reliability "
+                             f"but got {str(len(addresses))}")
+
+        return addresses[0]
+
+    return resolve
@@ -0,0 +1,230 @@
+"""This module contains an LDAP transport which performs SDS searches directly on the asyncio event loop."""
+
+import asyncio
+import ssl
+from typing import Dict, List, Optional, Tuple
+
+import ldap3
+import ldap3.core.exceptions as ldap_exceptions
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.operation.bind import bind_operation
+from ldap3.operation.search import search_operation, search_result_entry_response_to_dict_fast
+from ldap3.protocol.rfc4511 import LDAPMessage, MessageID, ProtocolOp
+from ldap3.strategy.base import BaseStrategy
+from ldap3.utils.asn1 import decode_message_fast, encode, ldap_result_to_dict_fast
+
+from utilities import integration_adaptors_logger as log
+from utilities.single_flight import SingleFlight
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+_RECEIVE_BUFFER_SIZE = 65536
+
+# LDAPMessage protocolOp choices, see RFC 4511 section 4.2 onwards
+_BIND_RESPONSE = 1
+_SEARCH_RESULT_ENTRY = 4
+_SEARCH_RESULT_DONE = 5
+_SEARCH_RESULT_REFERENCE = 19
+
+# message id 0 is reserved for unsolicited notifications from the server
+_UNSOLICITED_MESSAGE_ID = 0
+
+
+class _OutstandingRequest(object):
+
+    def __init__(self, future: asyncio.Future, attributes: List[str]):
+        self.future = future
+        self.attributes = attributes
+        self.entries: List[Dict] = []
+
+
+class AsyncLdapTransport(object):
+    """
+    A single LDAP connection driven by asyncio streams. Requests are BER encoded and responses decoded with ldap3's own
+    codecs, but the socket is read by a task on the event loop rather than by a thread blocked in `get_response`, so
+    any number of searches can be outstanding on the connection at once, each waiting on a future keyed by its message
+    id. The connection is opened and anonymously bound on first use and reopened on the next search if it is lost.
+    """
+
+    def __init__(self, server: ldap3.Server, connect_timeout: float = 5):
+        """
+        :param server: The LDAP server to connect to. Its schema, if it has been read, is used to format attribute
+        values the same way an ldap3 connection would.
+        :param connect_timeout: The number of seconds to wait for the connection to be opened and bound.
+        """
+        if not server:
+            raise ValueError('server must not be null')
+
+        self.server = server
+        self.connect_timeout = connect_timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Future] = None
+        self._last_message_id = 0
+        self._outstanding: Dict[int, _OutstandingRequest] = {}
+        self._single_flight = SingleFlight()
+
+    @property
+    def closed(self) -> bool:
+        return self._writer is None
+
+    @property
+    def outstanding(self) -> int:
+        """The number of requests sent which are still waiting for their response."""
+        return len(self._outstanding)
+
+    async def search(self, search_base: str, search_filter: str, attributes: List[str], timeout: float) -> List[Dict]:
+        """
+        Search the subtree below `search_base`.
+
+        :return: The entries found, each a dictionary containing the `dn` and `attributes` of the entry. Requested
+        attributes the entry does not have are returned as empty lists.
+        :raises LDAPResponseTimeoutError: if the search does not complete within `timeout` seconds.
+        """
+        if self.closed:
+            # concurrent searches arriving while the connection is down wait for a single reconnection between them
+            await self._single_flight.do('open', self._open)
+
+        request = search_operation(search_base, search_filter, ldap3.SUBTREE, ldap3.DEREF_ALWAYS, attributes,
+                                   0, 0, False, True, True, self.server.schema,
+                                   validator=self.server.custom_validator, check_names=True)
+        message_id, outstanding = await self._send('searchRequest', request, attributes)
+        logger.info("Sent LDAP search {message_id}", fparams={"message_id": message_id})
+
+        try:
+            result = await asyncio.wait_for(outstanding.future, timeout)
+        except asyncio.TimeoutError:
+            raise ldap_exceptions.LDAPResponseTimeoutError(f'no response from server within {timeout}s')
+        finally:
+            # any response still to arrive for an abandoned search is dropped by the reader
+            self._outstanding.pop(message_id, None)
+
+        if result['result'] != RESULT_SUCCESS:
+            logger.warning("LDAP search {message_id} completed with {result} {description}",
+                           fparams={"message_id": message_id, "result": result['result'],
+                                    "description": result['description']})
+        return outstanding.entries
+
+    def close(self):
+        """Close the connection, failing any requests still waiting for a response."""
+        if self._read_task:
+            self._read_task.cancel()
+        self._disconnect(ldap_exceptions.LDAPSocketReceiveError('connection closed'))
+
+    async def _open(self):
+        ssl_context = self._build_ssl_context(self.server.tls) if self.server.ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server.host, self.server.port, ssl=ssl_context), self.connect_timeout)
+        self._read_task = asyncio.ensure_future(self._read_responses(self._reader))
+        logger.info('Opened asyncio LDAP connection to {host} {port}',
+                    fparams={"host": self.server.host, "port": self.server.port})
+
+        message_id, outstanding = await self._send('bindRequest', bind_operation(3, ldap3.ANONYMOUS, '', None))
+        try:
+            result = await asyncio.wait_for(outstanding.future, self.connect_timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            raise ldap_exceptions.LDAPResponseTimeoutError(
+                f'no bind response from server within {self.connect_timeout}s')
+        finally:
+            self._outstanding.pop(message_id, None)
+
+        if result['result'] != RESULT_SUCCESS:
+            self.close()
+            raise ldap_exceptions.LDAPBindError(f"bind failed: {result['description']} {result['message']}")
+
+    async def _send(self, operation: str, request, attributes: List[str] = None) -> Tuple[int, _OutstandingRequest]:
+        self._last_message_id += 1
+        message_id = self._last_message_id
+
+        message = LDAPMessage()
+        message['messageID'] = MessageID(message_id)
+        message['protocolOp'] = ProtocolOp().setComponentByName(operation, request)
+
+        outstanding = _OutstandingRequest(asyncio.get_event_loop().create_future(), attributes or [])
+        self._outstanding[message_id] = outstanding
+        try:
+            self._writer.write(encode(message))
+            await self._writer.drain()
+        except Exception:
+            self._outstanding.pop(message_id, None)
+            raise
+        return message_id, outstanding
+
+    async def _read_responses(self, reader: asyncio.StreamReader):
+        buffer = bytearray()
+        error = ldap_exceptions.LDAPSocketReceiveError('connection closed by server')
+        try:
+            while True:
+                data = await reader.read(_RECEIVE_BUFFER_SIZE)
+                if not data:
+                    logger.warning('LDAP server closed the connection')
+                    break
+                buffer += data
+
+                while True:
+                    length = BaseStrategy.compute_ldap_message_size(buffer)
+                    if length == -1 or len(buffer) < length:
+                        break
+                    self._dispatch(decode_message_fast(bytes(buffer[:length])))
+                    del buffer[:length]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error('Failed to read from LDAP connection', exc_info=True)
+            error = ldap_exceptions.LDAPSocketReceiveError(f'error receiving data: {e}')
+        finally:
+            if self._reader is reader:
+                self._disconnect(error)
+
+    def _dispatch(self, message: dict):
+        message_id = message['messageID']
+        if message_id == _UNSOLICITED_MESSAGE_ID:
+            logger.warning('Received unsolicited notification from LDAP server')
+            return
+
+        outstanding = self._outstanding.get(message_id)
+        if outstanding is None or outstanding.future.done():
+            logger.info("Dropping LDAP response for abandoned request {message_id}", fparams={"message_id": message_id})
+            return
+
+        operation = message['protocolOp']
+        if operation == _SEARCH_RESULT_ENTRY:
+            outstanding.entries.append(self._decode_entry(message['payload'], outstanding.attributes))
+        elif operation in (_SEARCH_RESULT_DONE, _BIND_RESPONSE):
+            outstanding.future.set_result(ldap_result_to_dict_fast(message['payload']))
+        elif operation != _SEARCH_RESULT_REFERENCE:
+            outstanding.future.set_exception(ldap_exceptions.LDAPUnknownResponseError(f'unknown response {operation}'))
+
+    def _decode_entry(self, payload, attributes: List[str]) -> Dict:
+        entry = search_result_entry_response_to_dict_fast(payload, self.server.schema, self.server.custom_formatter,
+                                                          True)
+        # matches the RETURN_EMPTY_ATTRIBUTES behaviour of an ldap3 connection
+        for attribute in attributes:
+            if attribute not in entry['attributes']:
+                entry['attributes'][attribute] = []
+        return {'dn': entry['dn'], 'attributes': entry['attributes']}
+
+    def _disconnect(self, error: Exception):
+        writer = self._writer
+        self._reader = self._writer = self._read_task = None
+        if writer:
+            writer.close()
+
+        outstanding, self._outstanding = self._outstanding, {}
+        for request in outstanding.values():
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    @staticmethod
+    def _build_ssl_context(tls: ldap3.Tls) -> ssl.SSLContext:
+        # mirrors the context ldap3.Tls.wrap_socket builds for a synchronous connection
+        ssl_context = ssl.SSLContext(tls.version or ssl.PROTOCOL_TLS_CLIENT)
+        ssl_context.check_hostname = False
+        if tls.ca_certs_file or tls.ca_certs_path or tls.ca_certs_data:
+            ssl_context.load_verify_locations(tls.ca_certs_file, tls.ca_certs_path, tls.ca_certs_data)
+        if tls.certificate_file:
+            ssl_context.load_cert_chain(tls.certificate_file, keyfile=tls.private_key_file,
+                                        password=tls.private_key_password)
+        ssl_context.verify_mode = tls.validate
+        return ssl_context
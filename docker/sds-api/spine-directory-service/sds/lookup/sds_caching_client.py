@@ -0,0 +1,177 @@
+"""This module contains a client which caches the results of SDS lookups in memory."""
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from lookup.sds_client import MhsQuery
+from utilities import integration_adaptors_logger as log
+from utilities.ttl_cache import TTLCache
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+MHS_LOOKUP = "mhs"
+AS_LOOKUP = "as"
+
+# Age in seconds of the oldest stale result served to the current request, or None if every result was fresh.
+stale_result_age: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('stale_result_age', default=None)
+
+
+def _normalise(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    value = value.strip()
+    return value or None
+
+
+class SDSCachingClient(object):
+    """
+    Wraps an SDS client (`SDSClient` or `SDSMockClient`) and serves repeated lookups for the same query from an
+    in-memory TTL cache instead of going back to LDAP.
+
+    When `max_staleness` is set, an expired result is still served for up to that many seconds past its TTL while a
+    refreshed result is fetched in the background, so callers are not held up while LDAP is slow. A background refresh
+    which fails, or which returns nothing where results were previously found (which is what a timed out LDAP query
+    looks like), leaves the last known good result in place.
+
+    Empty results are not cached, as a lookup whose LDAP search timed out returns nothing just as a lookup of an entry
+    which does not exist does, and caching it would answer that lookup with nothing for the whole TTL.
+    """
+
+    def __init__(self, sds_client, ttl: float, max_entries: int, max_staleness: float = 0):
+        """
+        :param sds_client: The client used to look up values missing from the cache.
+        :param ttl: The number of seconds a lookup result is served from the cache.
+        :param max_entries: The maximum number of lookup results held in the cache.
+        :param max_staleness: The number of seconds past its TTL an expired result may be served while it is refreshed.
+        """
+        if not sds_client:
+            raise ValueError('sds_client must not be null')
+
+        self.sds_client = sds_client
+        self.cache = TTLCache(ttl, max_entries)
+        self.max_staleness = max_staleness
+        self.stale_hits = 0
+        self._refreshing: Dict[Hashable, asyncio.Future] = {}
+
+    async def get_mhs_details(self, ods_code: str, interaction_id: str = None, party_key: str = None) -> List[Dict]:
+        # the normalised query is looked up, so every query sharing a cache entry would have been answered the same
+        ods_code, interaction_id, party_key = map(_normalise, (ods_code, interaction_id, party_key))
+        key = self._build_key(MHS_LOOKUP, ods_code, interaction_id, party_key)
+        result = await self._lookup(key, lambda: self.sds_client.get_mhs_details(ods_code, interaction_id, party_key))
+        return self._copy_result(result)
+
+    async def get_mhs_details_batch(self, queries: List[MhsQuery]) -> List[List[Dict]]:
+        """
+        Returns the mhs details for each of the given (ods_code, interaction_id, party_key) queries, in the same order.
+        Queries missing from the cache are looked up together with a single batched lookup.
+        """
+        queries = [tuple(map(_normalise, query)) for query in queries]
+        keys = [self._build_key(MHS_LOOKUP, *query) for query in queries]
+        results: Dict[Tuple, List[Dict]] = {}
+        missing: Dict[Tuple, MhsQuery] = {}
+        for key, query in zip(keys, queries):
+            if key in results or key in missing:
+                continue
+            result = self._get_cached(key, lambda query=query: self.sds_client.get_mhs_details(*query))
+            if result is None:
+                missing[key] = query
+            else:
+                results[key] = result
+
+        if missing:
+            looked_up = await self.sds_client.get_mhs_details_batch(list(missing.values()))
+            for key, result in zip(missing, looked_up):
+                # a single timed out search leaves every query in it without results, none of which are cached
+                self._put(key, result)
+                results[key] = result
+
+        return [self._copy_result(results[key]) for key in keys]
+
+    async def get_as_details(self, ods_code: str, interaction_id: str, manufacturing_organization: str = None,
+                             party_key: str = None) -> List[Dict]:
+        ods_code, interaction_id, manufacturing_organization, party_key = \
+            map(_normalise, (ods_code, interaction_id, manufacturing_organization, party_key))
+        key = self._build_key(AS_LOOKUP, ods_code, interaction_id, party_key, manufacturing_organization)
+        result = await self._lookup(key, lambda: self.sds_client.get_as_details(ods_code, interaction_id,
+                                                                                manufacturing_organization, party_key))
+        return self._copy_result(result)
+
+    def hot_keys(self, limit: int) -> List[Tuple]:
+        """Return the keys of up to `limit` cached lookups, the most recently used first."""
+        return list(reversed(self.cache.keys()))[:limit]
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        stats["stale_hits"] = self.stale_hits
+        return stats
+
+    async def _lookup(self, key: Tuple, fetch: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        result = self._get_cached(key, fetch)
+        if result is not None:
+            return result
+
+        result = await fetch()
+        self._put(key, result)
+        return result
+
+    def _get_cached(self, key: Tuple, fetch: Callable[[], Awaitable[List[Dict]]]) -> Optional[List[Dict]]:
+        """Return the cached result for `key`, refreshing it with `fetch` if stale, or None if it must be looked up."""
+        result = self.cache.get(key)
+        if result is not None:
+            logger.info("Serving lookup result from cache for {key}", fparams={"key": key})
+            return result
+
+        stale = self.cache.peek(key) if self.max_staleness > 0 else None
+        if stale is not None:
+            result, age = stale
+            if age < self.cache.ttl + self.max_staleness:
+                self.stale_hits += 1
+                logger.info("Serving stale lookup result from cache for {key} {age}",
+                            fparams={"key": key, "age": round(age, 3)})
+                self._mark_stale(age)
+                self._refresh_in_background(key, fetch)
+                return result
+
+        return None
+
+    def _refresh_in_background(self, key: Tuple, fetch: Callable[[], Awaitable[List[Dict]]]):
+        if key not in self._refreshing:
+            self._refreshing[key] = asyncio.ensure_future(self._refresh(key, fetch))
+
+    async def _refresh(self, key: Tuple, fetch: Callable[[], Awaitable[List[Dict]]]):
+        try:
+            result = await fetch()
+            if not result:
+                logger.warning("Background refresh of {key} found no results, keeping last known result",
+                               fparams={"key": key})
+            else:
+                self.cache.put(key, result)
+        except Exception:
+            logger.warning("Background refresh of {key} failed, keeping last known result", fparams={"key": key},
+                           exc_info=True)
+        finally:
+            self._refreshing.pop(key, None)
+
+    def _put(self, key: Tuple, result: List[Dict]):
+        if result:
+            self.cache.put(key, result)
+        else:
+            logger.info("Not caching empty lookup result for {key}", fparams={"key": key})
+
+    @staticmethod
+    def _mark_stale(age: float):
+        current_age = stale_result_age.get()
+        if current_age is None or age > current_age:
+            stale_result_age.set(age)
+
+    @staticmethod
+    def _build_key(lookup: str, ods_code: Optional[str], interaction_id: Optional[str], party_key: Optional[str],
+                   manufacturing_organization: Optional[str] = None) -> Tuple:
+        return (lookup, _normalise(ods_code), _normalise(interaction_id), _normalise(party_key),
+                _normalise(manufacturing_organization))
+
+    @staticmethod
+    def _copy_result(result: List[Dict]) -> List[Dict]:
+        # request handlers rewrite attributes of the results they are given (e.g. forward reliable endpoints) so every
+        # caller gets its own copy of each entry rather than a reference to the cached one
+        return [entry.copy() for entry in result]
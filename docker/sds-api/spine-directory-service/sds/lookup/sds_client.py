@@ -9,9 +9,12 @@ import ldap3
 import ldap3.core.exceptions as ldap_exceptions
 from ldap3.utils.ciDict import CaseInsensitiveDict
 
+from lookup.sds_async_transport import AsyncLdapTransport
+from lookup.sds_connection_pool import SDSConnectionPool
 from lookup.sds_exception import SDSException
-from utilities import config
+from utilities import config, executors
 from utilities import integration_adaptors_logger as log
+from utilities.single_flight import SingleFlight
 from utilities.string_utilities import str2bool
 
 logger = log.IntegrationAdaptorsLogger(__name__)
@@ -21,6 +24,13 @@ AS_OBJECT_CLASS = "nhsAs"
 MHS_PARTY_KEY = 'nhsMHSPartyKey'
 MHS_ASID = 'uniqueIdentifier'
 
+# the OID of the simple paged results control, see RFC 2696
+PAGED_RESULTS_CONTROL = '1.2.840.113556.1.4.319'
+# the operational attribute holding when an entry was last modified, as an LDAP generalized time
+MODIFY_TIMESTAMP = 'modifyTimestamp'
+# the key each entry read by `get_all_mhs_details` and `get_all_as_details` has its distinguished name under
+ENTRY_DN = 'dn'
+
 MHS_ATTRIBUTES = [
     'nhsIDCode', 'nhsMhsCPAId', 'nhsMHSEndPoint', 'nhsMhsFQDN',
     'nhsMHsIN', 'nhsMHSPartyKey', 'nhsMHsSN', 'nhsMhsSvcIA',
@@ -33,29 +43,70 @@ AS_ATTRIBUTES = [
 ]
 
 
-def _validate_mhs_request_params(ods_code, interaction_id, party_key):
+# the ods code, interaction id and party key of an MHS lookup
+MhsQuery = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def validate_mhs_request_params(ods_code, interaction_id, party_key):
     if (ods_code and not interaction_id and not party_key) or (not ods_code and (not interaction_id or not party_key)):
         raise SDSException("org_code and at least one of 'interaction_id' or 'party_key' must be provided or both 'interaction_id' and 'party_key'")
 
 
+def _build_mhs_query_parts(ods_code: Optional[str], interaction_id: Optional[str], party_key: Optional[str]) \
+        -> List[Tuple[str, Optional[str]]]:
+    return [
+        ("nhsIDCode", ods_code),
+        ("objectClass", MHS_OBJECT_CLASS),
+        ("nhsMhsSvcIA", interaction_id),
+        ("nhsMHSPartyKey", party_key)
+    ]
+
+
+def _with_dn(single_result: Dict) -> Dict:
+    attributes = single_result['attributes']
+    attributes[ENTRY_DN] = single_result['dn']
+    return attributes
+
+
+def _attribute_matches(attributes: Dict, name: str, value: Optional[str]) -> bool:
+    if value is None:
+        return True
+    # attribute names and the values of these attributes are matched case insensitively by LDAP
+    values = next((values for key, values in attributes.items() if key.lower() == name.lower()), [])
+    if not isinstance(values, list):
+        values = [values]
+    return any(str(attribute_value).lower() == value.lower() for attribute_value in values)
+
+
+def _matches_mhs_query(attributes: Dict, query: MhsQuery) -> bool:
+    ods_code, interaction_id, party_key = query
+    return _attribute_matches(attributes, "nhsIDCode", ods_code) \
+        and _attribute_matches(attributes, "nhsMhsSvcIA", interaction_id) \
+        and _attribute_matches(attributes, "nhsMHSPartyKey", party_key)
+
+
 class SDSClient(object):
     """A client that can be used to query SDS."""
 
-    def __init__(self, sds_connection: ldap3.Connection, search_base: str, timeout: int = 3):
+    # the most MHS lookups combined into one LDAP search by `get_mhs_details_batch`
+    max_batch_size = 50
+
+    def __init__(self, sds_connection_pool: SDSConnectionPool, search_base: str, timeout: int = 3):
         """
-        :param sds_connection: takes an ldap connection to the sds server
+        :param sds_connection_pool: takes a pool of ldap connections to the sds server
         :param search_base: The LDAP location to use as the base of SDS searches. e.g. ou=services,o=nhs.
         :param timeout The amount of time to wait for an LDAP query to complete.
         """
-        if not sds_connection:
-            raise ValueError('sds_connection must not be null')
+        if not sds_connection_pool:
+            raise ValueError('sds_connection_pool must not be null')
 
         if not search_base:
             raise ValueError('search_base must be specified')
 
-        self.connection = sds_connection
+        self.connection_pool = sds_connection_pool
         self.timeout = timeout
         self.search_base = search_base
+        self._single_flight = SingleFlight()
 
     @staticmethod
     def _build_search_filter(query_parts):
@@ -69,18 +120,53 @@ class SDSClient(object):
 
         :return: Dictionary of the attributes of the mhs associated with the given parameters
         """
-        _validate_mhs_request_params(ods_code, interaction_id, party_key)
+        validate_mhs_request_params(ods_code, interaction_id, party_key)
 
-        query_parts = [
-            ("nhsIDCode", ods_code),
-            ("objectClass", "nhsMhs"),
-            ("nhsMhsSvcIA", interaction_id),
-            ("nhsMHSPartyKey", party_key)
-        ]
+        query_parts = _build_mhs_query_parts(ods_code, interaction_id, party_key)
         result = await self._get_ldap_data(query_parts, MHS_ATTRIBUTES)
 
         return result
 
+    async def get_mhs_details_batch(self, queries: List[MhsQuery]) -> List[List[Dict]]:
+        """
+        Returns the mhs details for each of the given (ods_code, interaction_id, party_key) queries, in the same order.
+
+        Rather than searching once per query, up to `max_batch_size` distinct queries are combined into a single
+        `(&(objectClass=nhsMhs)(|(&...)(&...)))` search and the entries found are matched back to the queries they
+        satisfy, so a batch of lookups costs a handful of LDAP round trips.
+
+        :return: A list of the attributes of the mhs associated with each query
+        """
+        for query in queries:
+            validate_mhs_request_params(*query)
+
+        distinct_queries = list(dict.fromkeys(queries))
+        chunks = [distinct_queries[start:start + self.max_batch_size]
+                  for start in range(0, len(distinct_queries), self.max_batch_size)]
+        chunk_results = await asyncio.gather(*[self._get_mhs_data_batch(chunk) for chunk in chunks])
+
+        results = {}
+        for chunk_result in chunk_results:
+            results.update(chunk_result)
+        return [[single_result.copy() for single_result in results[query]] for query in queries]
+
+    async def _get_mhs_data_batch(self, queries: List[MhsQuery]) -> Dict[MhsQuery, List]:
+        if len(queries) == 1:
+            # searched the same way as `get_mhs_details` so it can share a search with an identical single lookup
+            return {queries[0]: await self._get_ldap_data(_build_mhs_query_parts(*queries[0]), MHS_ATTRIBUTES)}
+
+        query_filters = [self._build_search_filter([query_part for query_part in _build_mhs_query_parts(*query)
+                                                    if query_part[0] != "objectClass"])
+                         for query in queries]
+        search_filter = f"(&(objectClass={MHS_OBJECT_CLASS})(|{''.join(query_filters)}))"
+        attributes_result = await self._single_flight.do((search_filter, tuple(MHS_ATTRIBUTES)),
+                                                         lambda: self._search(search_filter, MHS_ATTRIBUTES))
+        logger.info("Combined {queries} MHS lookups into one LDAP search which found {entries} entries",
+                    fparams={"queries": len(queries), "entries": len(attributes_result)})
+
+        return {query: [single_result for single_result in attributes_result
+                        if _matches_mhs_query(single_result, query)]
+                for query in queries}
 
     async def get_as_details(self, ods_code: str, interaction_id: str, manufacturing_organization: str = None, party_key: str = None) -> List[Dict]:
         """
@@ -106,34 +192,174 @@ class SDSClient(object):
         result = await self._get_ldap_data(query_parts, AS_ATTRIBUTES)
         return result
 
+    async def get_all_mhs_details(self, page_size: int = 500, timeout: float = 60,
+                                  modified_since: Optional[str] = None) -> List[Dict]:
+        """
+        Returns the details of every mhs below the search base, searched for `page_size` entries at a time. Each entry
+        also has its `modifyTimestamp` and its distinguished name under `ENTRY_DN`.
+
+        :param modified_since: An LDAP generalized time (e.g. 20200101120000Z). If given, only the mhs modified since
+        then are returned.
+        :raises LDAPResponseTimeoutError: if a page is not returned within `timeout` seconds.
+        """
+        return await self._search_all(MHS_OBJECT_CLASS, MHS_ATTRIBUTES, page_size, timeout, modified_since)
+
+    async def get_all_as_details(self, page_size: int = 500, timeout: float = 60,
+                                 modified_since: Optional[str] = None) -> List[Dict]:
+        """
+        Returns the details of every device below the search base, searched for `page_size` entries at a time. Each
+        entry also has its `modifyTimestamp` and its distinguished name under `ENTRY_DN`.
+
+        :param modified_since: An LDAP generalized time (e.g. 20200101120000Z). If given, only the devices modified
+        since then are returned.
+        :raises LDAPResponseTimeoutError: if a page is not returned within `timeout` seconds.
+        """
+        return await self._search_all(AS_OBJECT_CLASS, AS_ATTRIBUTES, page_size, timeout, modified_since)
+
+    @staticmethod
+    def _build_search_all_filter(object_class: str, modified_since: Optional[str]) -> str:
+        if modified_since is None:
+            return f"(objectClass={object_class})"
+        return f"(&(objectClass={object_class})({MODIFY_TIMESTAMP}>={modified_since}))"
+
+    async def _search_all(self, object_class: str, attributes: List[str], page_size: int, timeout: float,
+                          modified_since: Optional[str] = None) -> List:
+        search_filter = self._build_search_all_filter(object_class, modified_since)
+        attributes = attributes + [MODIFY_TIMESTAMP]
+        attributes_result = []
+        cookie = None
+        async with self.connection_pool.connection() as connection:
+            while True:
+                message_id = connection.search(search_base=self.search_base,
+                                               search_filter=search_filter,
+                                               attributes=attributes,
+                                               paged_size=page_size,
+                                               paged_cookie=cookie)
+                # unlike a lookup, a timed out page is raised as the directory read so far is incomplete
+                response, result = await executors.get_executor(executors.LDAP).run(
+                    connection.get_response, message_id, timeout)
+                attributes_result += [_with_dn(single_result) for single_result in response
+                                      if single_result.get('type') == 'searchResEntry']
+                cookie = result.get('controls', {}).get(PAGED_RESULTS_CONTROL, {}).get('value', {}).get('cookie')
+                if not cookie:
+                    break
+        logger.info("Found {entries} LDAP entries for {search_filter}",
+                    fparams={"entries": len(attributes_result), "search_filter": search_filter})
+        return attributes_result
+
     async def _get_ldap_data(self, query_parts: List[Tuple[str, Optional[str]]], attributes: List[str]) -> List:
         search_filter = self._build_search_filter(query_parts)
 
-        self.connection.bind()
-        message_id = self.connection.search(search_base=self.search_base,
-                                            search_filter=search_filter,
-                                            attributes=attributes)
-        logger.info("Received LDAP query {message_id} - for query: {search_filter}",
-                    fparams={"message_id": message_id, "search_filter": search_filter})
+        # identical lookups arriving while a search is still running share its result rather than issuing their own
+        attributes_result = await self._single_flight.do((search_filter, tuple(attributes)),
+                                                         lambda: self._search(search_filter, attributes))
+        return [single_result.copy() for single_result in attributes_result]
 
-        response = await self._get_query_result(message_id)
+    async def _search(self, search_filter: str, attributes: List[str]) -> List:
+        async with self.connection_pool.connection() as connection:
+            message_id = connection.search(search_base=self.search_base,
+                                           search_filter=search_filter,
+                                           attributes=attributes)
+            logger.info("Received LDAP query {message_id} - for query: {search_filter}",
+                        fparams={"message_id": message_id, "search_filter": search_filter})
+
+            response = await self._get_query_result(connection, message_id)
         logger.info("Found LDAP details for {message_id}", fparams={"message_id": message_id})
 
         attributes_result = [single_result['attributes'] for single_result in response]
         return attributes_result
 
-    async def _get_query_result(self, message_id: int) -> List:
-        loop = asyncio.get_event_loop()
+    async def _get_query_result(self, connection: ldap3.Connection, message_id: int) -> List:
         response = []
         try:
-            response, result = await loop.run_in_executor(None, self.connection.get_response, message_id, self.timeout)
+            # waits on the ldap executor so LDAP calls cannot take the threads needed by other backends (e.g. CPM)
+            response, result = await executors.get_executor(executors.LDAP).run(
+                connection.get_response, message_id, self.timeout)
         except ldap_exceptions.LDAPResponseTimeoutError:
             logger.error("LDAP query timed out for {message_id}", fparams={"message_id": message_id})
 
         return response
 
 
+class SDSAsyncTransportClient(SDSClient):
+    """
+    A client that queries SDS over a native asyncio LDAP transport, so waiting for a search result does not tie up a
+    thread and any number of searches can be outstanding at once.
+    """
+
+    def __init__(self, transport: AsyncLdapTransport, search_base: str, timeout: int = 3):
+        """
+        :param transport: The asyncio LDAP transport connected to the sds server
+        :param search_base: The LDAP location to use as the base of SDS searches. e.g. ou=services,o=nhs.
+        :param timeout The amount of time to wait for an LDAP query to complete.
+        """
+        if not transport:
+            raise ValueError('transport must not be null')
+
+        if not search_base:
+            raise ValueError('search_base must be specified')
+
+        self.transport = transport
+        self.timeout = timeout
+        self.search_base = search_base
+        self._single_flight = SingleFlight()
+
+    async def _search(self, search_filter: str, attributes: List[str]) -> List:
+        logger.info("Received LDAP query for query: {search_filter}", fparams={"search_filter": search_filter})
+        response = []
+        try:
+            response = await self.transport.search(self.search_base, search_filter, attributes, self.timeout)
+        except ldap_exceptions.LDAPResponseTimeoutError:
+            logger.error("LDAP query timed out for {search_filter}", fparams={"search_filter": search_filter})
+
+        return [single_result['attributes'] for single_result in response]
+
+    async def _search_all(self, object_class: str, attributes: List[str], page_size: int, timeout: float,
+                          modified_since: Optional[str] = None) -> List:
+        # the transport does not send paged results controls, so the whole subtree is read with one search. A server
+        # enforcing a size limit smaller than the subtree truncates it, in which case the ldap3 transport is needed
+        search_filter = self._build_search_all_filter(object_class, modified_since)
+        response = await self.transport.search(self.search_base, search_filter, attributes + [MODIFY_TIMESTAMP],
+                                               timeout)
+        logger.info("Found {entries} LDAP entries for {search_filter}",
+                    fparams={"entries": len(response), "search_filter": search_filter})
+        return [_with_dn(single_result) for single_result in response]
+
+
+# the attributes of the mock data indexed by `SDSMockClient`, in the order of the arguments to each lookup
+MOCK_MHS_INDEXED_ATTRIBUTES = ['nhsIDCode', 'nhsMhsSvcIA', 'nhsMHSPartyKey']
+MOCK_AS_INDEXED_ATTRIBUTES = ['nhsIDCode', 'nhsAsSvcIA', 'nhsMhsManufacturerOrg', 'nhsMHSPartyKey']
+
+# the positions of the mock entries having each value of each indexed attribute, in a dict so they stay in order
+MockIndex = Dict[str, Dict[str, Dict[int, None]]]
+
+
+def _build_mock_index(entries: List[Dict], attributes: List[str]) -> MockIndex:
+    index: MockIndex = {attribute: {} for attribute in attributes}
+    for position, entry in enumerate(entries):
+        for attribute in attributes:
+            values = entry.get(attribute, [])
+            for value in values if isinstance(values, list) else [values]:
+                index[attribute].setdefault(value, {})[position] = None
+    return index
+
+
+def _find_in_mock_index(entries: List[Dict], index: MockIndex, criteria: Dict[str, Optional[str]]) -> List[Dict]:
+    positions = [index[attribute].get(value, {}) for attribute, value in criteria.items() if value is not None]
+    if not positions:
+        return list(entries)
+
+    # only the entries with the least common of the values need checking for the others
+    candidates = min(positions, key=len)
+    return [entries[position] for position in candidates
+            if all(position in other for other in positions if other is not candidates)]
+
+
 class SDSMockClient:
+    """
+    Answers lookups from the mock data in `lookup/mock_data` rather than LDAP. In STRICT mode each lookup is answered
+    from hash indexes built over the mock data when it is read, so lookups take the same time however large it is.
+    """
 
     def __init__(self):
         self.pause_duration = int(config.get_config('MOCK_LDAP_PAUSE', default="0"))
@@ -141,9 +367,11 @@ class SDSMockClient:
         self.mock_mhs_data = None
         self.mock_as_data = None
         self._read_mock_data()
+        self._mhs_index = _build_mock_index(self.mock_mhs_data, MOCK_MHS_INDEXED_ATTRIBUTES)
+        self._as_index = _build_mock_index(self.mock_as_data, MOCK_AS_INDEXED_ATTRIBUTES)
 
     async def get_mhs_details(self, ods_code: str, interaction_id: str = None, party_key: str = None) -> List[Dict]:
-        _validate_mhs_request_params(ods_code, interaction_id, party_key)
+        validate_mhs_request_params(ods_code, interaction_id, party_key)
 
         if self.pause_duration != 0:
             logger.debug("Sleeping for %sms", self.pause_duration)
@@ -152,7 +380,8 @@ class SDSMockClient:
         logger.info(f"Returning MHS MOCK_LDAP response for ods_code={ods_code} interaction_id={interaction_id} party_key={party_key}")
 
         if self.mode == "STRICT":
-            return list(filter(lambda x: self._filter_mhs(x, ods_code, interaction_id, party_key), self.mock_mhs_data))
+            return _find_in_mock_index(self.mock_mhs_data, self._mhs_index,
+                                       dict(zip(MOCK_MHS_INDEXED_ATTRIBUTES, (ods_code, interaction_id, party_key))))
         elif self.mode == "RANDOM":
             return [random.choice(self.mock_mhs_data)]
         elif self.mode == "FIRST":
@@ -160,6 +389,18 @@ class SDSMockClient:
         else:
             raise ValueError
 
+    async def get_mhs_details_batch(self, queries: List[MhsQuery]) -> List[List[Dict]]:
+        return list(await asyncio.gather(*[self.get_mhs_details(*query) for query in queries]))
+
+    async def get_all_mhs_details(self, page_size: int = 500, timeout: float = 60,
+                                  modified_since: Optional[str] = None) -> List[Dict]:
+        # the mock data has no modify timestamps, so is only ever read in full
+        return [entry.copy() for entry in self.mock_mhs_data] if modified_since is None else []
+
+    async def get_all_as_details(self, page_size: int = 500, timeout: float = 60,
+                                 modified_since: Optional[str] = None) -> List[Dict]:
+        return [entry.copy() for entry in self.mock_as_data] if modified_since is None else []
+
     async def get_as_details(self, ods_code: str, interaction_id: str, manufacturing_organization: str = None, party_key: str = None) -> List[Dict]:
         if ods_code is None or interaction_id is None:
             raise ValueError
@@ -171,7 +412,8 @@ class SDSMockClient:
         logger.info(f"Returning AS MOCK_LDAP response for ods_code={ods_code} interaction_id={interaction_id} manufacturinging_organization={manufacturing_organization} party_key={party_key}")
 
         if self.mode == "STRICT":
-            return list(filter(lambda x: self._filter_as(x, ods_code, interaction_id, manufacturing_organization, party_key), self.mock_as_data))
+            return _find_in_mock_index(self.mock_as_data, self._as_index, dict(zip(
+                MOCK_AS_INDEXED_ATTRIBUTES, (ods_code, interaction_id, manufacturing_organization, party_key))))
         elif self.mode == "RANDOM":
             return [random.choice(self.mock_as_data)]
         elif self.mode == "FIRST":
@@ -179,19 +421,6 @@ class SDSMockClient:
         else:
             raise ValueError
 
-    @staticmethod
-    def _filter_mhs(entry: Dict, ods_code: str, interaction_id: str, party_key: str):
-        return (ods_code is None or entry['nhsIDCode'] == ods_code) \
-            and (interaction_id is None or interaction_id in entry['nhsMhsSvcIA']) \
-            and (party_key is None or entry['nhsMHSPartyKey'] == party_key)
-
-    @staticmethod
-    def _filter_as(entry: Dict, ods_code: str, interaction_id: str, manufacturing_organization: str, party_key: str):
-        return (ods_code is None or entry['nhsIDCode'] == ods_code) \
-            and (interaction_id is None or interaction_id in entry['nhsAsSvcIA']) \
-            and (party_key is None or entry['nhsMHSPartyKey'] == party_key) \
-            and (manufacturing_organization is None or entry['nhsMhsManufacturerOrg'] == manufacturing_organization)
-
     def _read_mock_data(self):
         def _copy_to_case_insensitive_dict(source_list: List[dict]) -> List[CaseInsensitiveDict]:
             target_list = []
@@ -203,11 +432,13 @@ class SDSMockClient:
             return target_list
 
         # Locally maybe required to change this to ./docker/sds-api/spine-directory-service/sds/lookup/mock_data/sds_mhs_response.json
-        with open('./lookup/mock_data/sds_mhs_response.json', 'r') as f:
+        mhs_data_file = config.get_config('MOCK_LDAP_MHS_DATA_FILE', default='./lookup/mock_data/sds_mhs_response.json')
+        with open(mhs_data_file, 'r') as f:
             data = f.read()
             self.mock_mhs_data = _copy_to_case_insensitive_dict(ast.literal_eval(data))
 
         # Locally maybe required to change this to ./docker/sds-api/spine-directory-service/sds/lookup/mock_data/sds_as_response.json
-        with open('./lookup/mock_data/sds_as_response.json', 'r') as f:
+        as_data_file = config.get_config('MOCK_LDAP_AS_DATA_FILE', default='./lookup/mock_data/sds_as_response.json')
+        with open(as_data_file, 'r') as f:
             data = f.read()
             self.mock_as_data = _copy_to_case_insensitive_dict(ast.literal_eval(data))
@@ -1,5 +1,7 @@
 from lookup import sds_connection_factory
-from lookup.sds_client import SDSClient, SDSMockClient
+from lookup.sds_caching_client import SDSCachingClient
+from lookup.sds_client import SDSAsyncTransportClient, SDSClient, SDSMockClient
+from lookup.sds_snapshot_client import SDSSnapshotClient
 from utilities import config
 from utilities import integration_adaptors_logger as log
 from utilities.string_utilities import str2bool
@@ -12,8 +14,56 @@ def get_sds_client():
     if use_mock:
         pause_duration = int(config.get_config('MOCK_LDAP_PAUSE', default="0"))
         logger.warning("!!! IMPORTANT !!! Using LDAP mock response with %sms delay", pause_duration)
-        return SDSMockClient()
+        sds_client = SDSMockClient()
+    elif config.get_config('LDAP_TRANSPORT', default="ldap3").lower() == "asyncio":
+        transport = sds_connection_factory.create_async_transport()
+        search_base = config.get_config("LDAP_SEARCH_BASE")
+        sds_client = SDSAsyncTransportClient(transport, search_base)
     else:
-        sds_connection = sds_connection_factory.create_connection()
+        sds_connection_pool = sds_connection_factory.create_connection_pool()
         search_base = config.get_config("LDAP_SEARCH_BASE")
-        return SDSClient(sds_connection, search_base)
+        sds_client = SDSClient(sds_connection_pool, search_base)
+
+    snapshot_client = _wrap_with_snapshot(sds_client)
+    if snapshot_client:
+        return snapshot_client
+    return _wrap_with_cache(sds_client)
+
+
+def get_ldap_client(sds_client):
+    """
+    Return the client behind any snapshot or cache `sds_client` answers lookups from, which always queries LDAP itself.
+    """
+    while isinstance(sds_client, (SDSSnapshotClient, SDSCachingClient)):
+        sds_client = sds_client.sds_client
+    return sds_client
+
+
+def _wrap_with_snapshot(sds_client):
+    refresh_interval = float(config.get_config('LDAP_SNAPSHOT_REFRESH_INTERVAL_IN_SECONDS', default="0"))
+    if refresh_interval <= 0:
+        return None
+
+    page_size = int(config.get_config('LDAP_SNAPSHOT_PAGE_SIZE', default="500"))
+    timeout = float(config.get_config('LDAP_SNAPSHOT_TIMEOUT_IN_SECONDS', default="60"))
+    reconcile_interval = float(config.get_config('LDAP_SNAPSHOT_RECONCILE_INTERVAL_IN_SECONDS', default="3600"))
+    snapshot_file = config.get_config('LDAP_SNAPSHOT_FILE', default=None)
+    logger.info("Answering lookups from a snapshot of the directory synced every {refresh_interval} seconds "
+                "and read in full every {reconcile_interval} seconds {page_size} entries at a time",
+                fparams={"refresh_interval": refresh_interval, "reconcile_interval": reconcile_interval,
+                         "page_size": page_size})
+    return SDSSnapshotClient(sds_client, refresh_interval, page_size, timeout, reconcile_interval, snapshot_file)
+
+
+def _wrap_with_cache(sds_client):
+    cache_ttl = float(config.get_config('LDAP_CACHE_TTL_IN_SECONDS', default="0"))
+    if cache_ttl <= 0:
+        return sds_client
+
+    cache_max_entries = int(config.get_config('LDAP_CACHE_MAX_ENTRIES', default="10000"))
+    cache_max_staleness = float(config.get_config('LDAP_CACHE_MAX_STALENESS_IN_SECONDS', default="0"))
+    logger.info("Caching LDAP lookup results for {cache_ttl} seconds in up to {cache_max_entries} entries "
+                "serving stale results for up to {cache_max_staleness} seconds",
+                fparams={"cache_ttl": cache_ttl, "cache_max_entries": cache_max_entries,
+                         "cache_max_staleness": cache_max_staleness})
+    return SDSCachingClient(sds_client, cache_ttl, cache_max_entries, cache_max_staleness)
@@ -1,8 +1,11 @@
+import functools
 import ssl
 
 import ldap3
 
 import definitions
+from lookup.sds_async_transport import AsyncLdapTransport
+from lookup.sds_connection_pool import SDSConnectionPool
 from utilities import certs, config, integration_adaptors_logger as log, secrets
 from utilities.string_utilities import str2bool
 
@@ -11,25 +14,24 @@ _LDAP_CONNECTION_TIMEOUT_IN_SECONDS = int(config.get_config('LDAP_CONNECTION_TIM
 logger = log.IntegrationAdaptorsLogger(__name__)
 
 
-def _build_sds_connection(ldap_address: str) -> ldap3.Connection:
+def _build_sds_server(ldap_address: str) -> ldap3.Server:
     """
-    Given an ldap service address this will return a ldap3 connection object
+    Given an ldap service address this will return a ldap3 server object
     """
     ldap3.set_config_parameter('RESTARTABLE_TRIES', _LDAP_CONNECTION_RETRIES)
     server = ldap3.Server(ldap_address, connect_timeout=_LDAP_CONNECTION_TIMEOUT_IN_SECONDS)
     logger.info('Configuring LDAP connection without TLS')
-    return _configure_ldap_connection(server)
+    return server
 
 
-def _build_sds_connection_tls(ldap_address: str, private_key: str, local_cert: str, ca_certs: str
-                              ) -> ldap3.Connection:
+def _build_sds_server_tls(ldap_address: str, private_key: str, local_cert: str, ca_certs: str) -> ldap3.Server:
     """
-    This will return a connection object for the given ip along with loading the given certification files
+    This will return a server object for the given ip along with loading the given certification files
     :param ldap_address: The URL of the LDAP server to connect to.
     :param private_key: A string containing the client private key.
     :param local_cert: A string containing the client certificate.
     :param ca_certs: A string containing certificate authority certificates
-    :return: Connection object using the given cert files
+    :return: Server object using the given cert files
     """
     certificates = certs.Certs.create_certs_files(definitions.ROOT_DIR, private_key=private_key, local_cert=local_cert,
                                                   ca_certs=ca_certs)
@@ -42,7 +44,7 @@ def _build_sds_connection_tls(ldap_address: str, private_key: str, local_cert: s
     server = ldap3.Server(ldap_address, port=636, use_ssl=True, tls=load_tls, connect_timeout=_LDAP_CONNECTION_TIMEOUT_IN_SECONDS)
     logger.info('Configuring LDAP connection using TLS')
 
-    return _configure_ldap_connection(server)
+    return server
 
 
 def _configure_ldap_connection(server) -> ldap3.Connection:
@@ -60,7 +62,7 @@ def _configure_ldap_connection(server) -> ldap3.Connection:
     return connection
 
 
-def create_connection() -> ldap3.Connection:
+def _build_server() -> ldap3.Server:
     ldap_url = config.get_config("LDAP_URL")
     disable_tls_flag = config.get_config("LDAP_DISABLE_TLS", None)
     use_tls = disable_tls_flag != "True"
@@ -71,11 +73,37 @@ def create_connection() -> ldap3.Connection:
         client_cert = secrets.get_secret_config('CLIENT_CERT')
         ca_certs = secrets.get_secret_config('CA_CERTS')
 
-        sds_connection = _build_sds_connection_tls(ldap_address=ldap_url,
-                                                   private_key=client_key,
-                                                   local_cert=client_cert,
-                                                   ca_certs=ca_certs)
-    else:
-        sds_connection = _build_sds_connection(ldap_address=ldap_url)
+        return _build_sds_server_tls(ldap_address=ldap_url,
+                                     private_key=client_key,
+                                     local_cert=client_cert,
+                                     ca_certs=ca_certs)
+    return _build_sds_server(ldap_address=ldap_url)
+
+
+def create_connection_pool() -> SDSConnectionPool:
+    server = _build_server()
+
+    min_connections = int(config.get_config('LDAP_POOL_MIN_CONNECTIONS', default='1'))
+    max_connections = int(config.get_config('LDAP_POOL_MAX_CONNECTIONS', default='10'))
+    acquire_timeout = float(config.get_config('LDAP_POOL_ACQUIRE_TIMEOUT_IN_SECONDS', default='5'))
+    idle_timeout = float(config.get_config('LDAP_POOL_IDLE_TIMEOUT_IN_SECONDS', default='300'))
+    logger.info('Configuring LDAP connection pool with {min_connections} {max_connections}',
+                fparams={"min_connections": min_connections, "max_connections": max_connections})
+
+    return SDSConnectionPool(functools.partial(_configure_ldap_connection, server),
+                             min_connections=min_connections,
+                             max_connections=max_connections,
+                             acquire_timeout=acquire_timeout,
+                             idle_timeout=idle_timeout)
+
+
+def create_async_transport() -> AsyncLdapTransport:
+    server = _build_server()
+
+    # the transport decodes responses itself, so the schema used to format attribute values the same way as an ldap3
+    # connection is read up front over a short lived synchronous connection
+    schema_connection = ldap3.Connection(server, auto_bind=True)
+    schema_connection.unbind()
+    logger.info('Configuring asyncio LDAP transport')
 
-    return sds_connection
+    return AsyncLdapTransport(server, connect_timeout=_LDAP_CONNECTION_TIMEOUT_IN_SECONDS)
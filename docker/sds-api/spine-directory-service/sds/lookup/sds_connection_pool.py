@@ -0,0 +1,196 @@
+"""This module contains a bounded pool of LDAP connections used by the SDS client."""
+
+import asyncio
+import collections
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Deque
+
+import ldap3
+import ldap3.core.exceptions as ldap_exceptions
+
+from lookup.sds_exception import SDSException
+from utilities import executors
+from utilities import integration_adaptors_logger as log
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+
+class _PooledConnection(object):
+
+    def __init__(self, connection: ldap3.Connection):
+        self.connection = connection
+        self.last_used = time.monotonic()
+        # a connection which has not been used yet may legitimately report itself as closed (lazy connections only
+        # open their socket on first use), so it is only health checked once it has served a request
+        self.used = False
+
+
+class SDSConnectionPool(object):
+    """
+    A bounded pool of LDAP connections. Each connection is bound once when it is created and is then checked out by a
+    single request at a time, so concurrent requests are spread over several sockets instead of sharing one.
+
+    Connections are opened when a request first needs one rather than up front, on the LDAP executor, as creating a
+    non-lazy connection binds to the server and would otherwise block the event loop.
+    """
+
+    def __init__(self, connection_factory: Callable[[], ldap3.Connection], min_connections: int = 1,
+                 max_connections: int = 10, acquire_timeout: float = 5, idle_timeout: float = 300):
+        """
+        :param connection_factory: A callable returning a new, configured (but not necessarily bound) LDAP connection.
+        :param min_connections: The number of connections never evicted for being idle.
+        :param max_connections: The maximum number of connections the pool will open at the same time.
+        :param acquire_timeout: The number of seconds to wait for a free connection before giving up.
+        :param idle_timeout: The number of seconds after which an unused connection above `min_connections` is closed.
+        """
+        if not connection_factory:
+            raise ValueError('connection_factory must not be null')
+
+        if min_connections < 0 or max_connections < 1 or min_connections > max_connections:
+            raise ValueError('min_connections and max_connections must satisfy 0 <= min_connections <= max_connections'
+                             ' and max_connections >= 1')
+
+        self.connection_factory = connection_factory
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+
+        self._idle: Deque[_PooledConnection] = collections.deque()
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+        self._size = 0
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        """The number of connections currently open, whether idle or checked out."""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """The number of open connections not currently checked out."""
+        return len(self._idle)
+
+    @property
+    def in_use(self) -> int:
+        """The number of connections currently checked out."""
+        return self._size - len(self._idle)
+
+    @property
+    def waiting(self) -> int:
+        """The number of callers waiting for a connection to become free."""
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Check a connection out of the pool for the duration of the `async with` block. Connections which raise an LDAP
+        error while checked out are closed rather than returned to the pool.
+        """
+        pooled = await self._acquire()
+        try:
+            yield pooled.connection
+        except ldap_exceptions.LDAPException:
+            self._discard(pooled)
+            raise
+        except BaseException:
+            self._release(pooled)
+            raise
+        else:
+            self._release(pooled)
+
+    def close(self):
+        """Close all idle connections. Connections currently checked out are closed when they are returned."""
+        self._closed = True
+        while self._idle:
+            self._discard(self._idle.pop())
+
+    async def _acquire(self) -> _PooledConnection:
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.acquire_timeout
+
+        while True:
+            if self._closed:
+                raise SDSException('LDAP connection pool has been closed')
+
+            self._evict_idle_connections()
+
+            while self._idle:
+                pooled = self._idle.pop()
+                if self._is_healthy(pooled):
+                    return pooled
+                logger.warning('Discarding unhealthy LDAP connection')
+                self._discard(pooled)
+
+            if self._size < self.max_connections:
+                self._size += 1
+                try:
+                    return await self._open_connection()
+                except Exception:
+                    self._size -= 1
+                    self._wake_next_waiter()
+                    raise
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                logger.error('Timed out waiting for a free LDAP connection. {pool_size} {waiting}',
+                             fparams={'pool_size': self._size, 'waiting': len(self._waiters)})
+                raise SDSException(f'Timed out after {self.acquire_timeout}s waiting for a free LDAP connection')
+            except BaseException:
+                # hand a wake up this caller will no longer act on to the next waiter
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next_waiter()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _release(self, pooled: _PooledConnection):
+        pooled.used = True
+        pooled.last_used = time.monotonic()
+        if self._closed:
+            self._discard(pooled)
+            return
+        self._idle.append(pooled)
+        self._wake_next_waiter()
+
+    def _discard(self, pooled: _PooledConnection):
+        self._size -= 1
+        try:
+            pooled.connection.unbind()
+        except Exception:
+            logger.warning('Failed to cleanly close LDAP connection', exc_info=True)
+        self._wake_next_waiter()
+
+    def _wake_next_waiter(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _open_connection(self) -> _PooledConnection:
+        connection = await executors.get_executor(executors.LDAP).run(self._create_bound_connection)
+        logger.info('Opened new LDAP connection. {pool_size}', fparams={'pool_size': self._size})
+        return _PooledConnection(connection)
+
+    def _create_bound_connection(self) -> ldap3.Connection:
+        connection = self.connection_factory()
+        if not connection.bound:
+            connection.bind()
+        return connection
+
+    def _evict_idle_connections(self):
+        now = time.monotonic()
+        # the deque is ordered from least to most recently used, so only its head can have been idle for too long
+        while self._idle and self._size > self.min_connections and now - self._idle[0].last_used > self.idle_timeout:
+            logger.info('Closing idle LDAP connection')
+            self._discard(self._idle.popleft())
+
+    @staticmethod
+    def _is_healthy(pooled: _PooledConnection) -> bool:
+        return not pooled.used or not pooled.connection.closed
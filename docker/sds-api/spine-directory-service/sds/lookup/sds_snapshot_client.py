@@ -0,0 +1,366 @@
+"""This module contains a client which answers SDS lookups from an in-memory snapshot of the whole directory."""
+import asyncio
+import datetime
+import itertools
+import os
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from lookup.sds_client import ENTRY_DN, MODIFY_TIMESTAMP, MhsQuery, validate_mhs_request_params
+from lookup.sds_exception import SDSException
+from lookup.snapshot_file import MappedDirectorySnapshot, serialize_snapshot, write_snapshot_file
+from utilities import config, executors
+from utilities import integration_adaptors_logger as log
+from utilities.string_utilities import str2bool
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+MHS_INDEXED_ATTRIBUTES = ['nhsIDCode', 'nhsMhsSvcIA', 'nhsMHSPartyKey']
+AS_INDEXED_ATTRIBUTES = ['nhsIDCode', 'nhsAsSvcIA', 'nhsMHSPartyKey', 'nhsMhsManufacturerOrg']
+
+# the attribute naming each entry, which identifies the entry a changed entry replaces. This is its distinguished
+# name, as no attribute of an entry (not even its `uniqueIdentifier`) is guaranteed to be unique among entries
+KEY_ATTRIBUTE = ENTRY_DN
+
+
+def _normalised_values(entry: Dict, attribute: str) -> FrozenSet[str]:
+    # attribute names and the values of the indexed attributes are matched case insensitively by LDAP
+    values = next((values for key, values in entry.items() if key.lower() == attribute.lower()), [])
+    if not isinstance(values, list):
+        values = [values]
+    return frozenset(str(value).lower() for value in values)
+
+
+def _to_generalized_time(value) -> Optional[str]:
+    """
+    Format a `modifyTimestamp`, which ldap3 decodes to a datetime when it knows the schema, as an LDAP generalized time.
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.strftime('%Y%m%d%H%M%SZ')
+    return str(value) if value else None
+
+
+class DirectoryIndex(object):
+    """
+    The entries of one object class in the directory, keyed by their distinguished name and with a hash index on each
+    of `attributes` so entries matching given values of them are found without scanning every entry.
+
+    Entries are added, replaced and removed without awaiting anything, so lookups on the event loop never see an index
+    part way through a change.
+    """
+
+    def __init__(self, entries: List[Dict], attributes: List[str]):
+        """
+        :param entries: The attributes of each entry.
+        :param attributes: The attributes to index, and which `find` can be given values of.
+        """
+        self._entries: Dict[str, Dict] = {}
+        self._entry_values: Dict[str, Dict[str, FrozenSet[str]]] = {}
+        # each index maps a value to the keys of the entries having it, in a dict so they stay in insertion order
+        self._indexes: Dict[str, Dict[str, Dict[str, None]]] = {attribute: {} for attribute in attributes}
+        self._unkeyed = itertools.count()
+        for entry in entries:
+            self.put(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self) -> List[str]:
+        return list(self._entries)
+
+    def put(self, entry: Dict):
+        """
+        Add `entry`, replacing the entry with the same distinguished name if there is one. Entries without one (such as
+        those of the mock data) never replace another entry.
+        """
+        key = ",".join(sorted(_normalised_values(entry, KEY_ATTRIBUTE))) or f"#unkeyed-{next(self._unkeyed)}"
+        self.remove(key)
+
+        entry_values = {attribute: _normalised_values(entry, attribute) for attribute in self._indexes}
+        self._entries[key] = entry
+        self._entry_values[key] = entry_values
+        for attribute, values in entry_values.items():
+            for value in values:
+                self._indexes[attribute].setdefault(value, {})[key] = None
+
+    def remove(self, key: str):
+        """Remove the entry with `key`, if there is one."""
+        entry_values = self._entry_values.pop(key, None)
+        if entry_values is None:
+            return
+        del self._entries[key]
+        for attribute, values in entry_values.items():
+            for value in values:
+                keys = self._indexes[attribute][value]
+                del keys[key]
+                if not keys:
+                    del self._indexes[attribute][value]
+
+    def values(self) -> List[Dict]:
+        return list(self._entries.values())
+
+    def table(self) -> Tuple[List[Dict], Dict[str, Dict[str, List[int]]]]:
+        """Return the entries and, for each index, the positions among them of the entries having each value."""
+        positions = {key: position for position, key in enumerate(self._entries)}
+        return list(self._entries.values()), {
+            attribute: {value: [positions[key] for key in keys] for value, keys in index.items()}
+            for attribute, index in self._indexes.items()
+        }
+
+    def find(self, criteria: Dict[str, Optional[str]]) -> List[Dict]:
+        """
+        Return a copy of each entry having every value in `criteria`, a mapping of attribute to value in which None
+        values match anything.
+        """
+        criteria = {attribute: value.lower() for attribute, value in criteria.items() if value is not None}
+        if not criteria:
+            return [entry.copy() for entry in self._entries.values()]
+
+        # only the entries with the least common of the values need checking for the others
+        candidates = min((self._indexes[attribute].get(value, {}) for attribute, value in criteria.items()), key=len)
+        return [self._entries[key].copy() for key in candidates
+                if all(value in self._entry_values[key][attribute] for attribute, value in criteria.items())]
+
+
+class DirectorySnapshot(object):
+    """The indexed nhsMhs and nhsAs entries of the directory."""
+
+    def __init__(self, mhs_entries: List[Dict], as_entries: List[Dict], created: float):
+        self.mhs = DirectoryIndex([], MHS_INDEXED_ATTRIBUTES)
+        self.accredited_systems = DirectoryIndex([], AS_INDEXED_ATTRIBUTES)
+        self.created = created
+        self.synced = created
+        # the latest modify timestamp of any entry, from which the next incremental sync searches
+        self.high_water_mark: Optional[str] = None
+        self.apply(mhs_entries, as_entries)
+
+    @classmethod
+    def from_mapped(cls, mapped: MappedDirectorySnapshot) -> 'DirectorySnapshot':
+        """Copy a snapshot mapped from a snapshot file into memory, so it can be changed."""
+        snapshot = cls(mapped.mhs.values(), mapped.accredited_systems.values(), mapped.created)
+        snapshot.synced = mapped.synced
+        snapshot.high_water_mark = mapped.high_water_mark
+        return snapshot
+
+    def apply(self, mhs_entries: List[Dict], as_entries: List[Dict]):
+        """Add or replace each of the given entries, advancing the high water mark past them."""
+        for index, entries in [(self.mhs, mhs_entries), (self.accredited_systems, as_entries)]:
+            for entry in entries:
+                modified = _to_generalized_time(entry.pop(MODIFY_TIMESTAMP, None))
+                if modified is not None and (self.high_water_mark is None or modified > self.high_water_mark):
+                    self.high_water_mark = modified
+                index.put(entry)
+
+
+class SDSSnapshotClient(object):
+    """
+    Wraps an SDS client (`SDSClient`, `SDSAsyncTransportClient` or `SDSMockClient`), holding every nhsMhs and nhsAs
+    entry under the search base in memory and answering lookups from hash indexes over them, so the time taken to
+    answer a lookup does not depend on LDAP at all.
+
+    Every `refresh_interval` seconds the snapshot is synced incrementally: only the entries whose `modifyTimestamp` is
+    at or after the latest one already seen are read, and applied to the indexes in place. Deleted entries do not show
+    up in such a search, so every `reconcile_interval` seconds (or when the directory has no modify timestamps) the
+    whole directory is read again instead and a complete new snapshot swapped in. A refresh which fails, or which finds
+    nothing where entries were previously found, leaves the last snapshot in place. Until the first snapshot has been
+    read, lookups are passed through to the wrapped client.
+
+    If given a `snapshot_file`, each new or changed snapshot is also written to it in the compact format of
+    `lookup.snapshot_file`, and on startup lookups are answered from the memory mapped file until the first sync, so a
+    restarted service (and every worker process of it, which share the mapped pages) serves the last snapshot at once
+    rather than waiting on LDAP. The first sync then only reads the entries modified since the file was written.
+    """
+
+    def __init__(self, sds_client, refresh_interval: float = 300, page_size: int = 500, timeout: float = 60,
+                 reconcile_interval: float = 3600, snapshot_file: Optional[str] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param sds_client: The client used to read the directory.
+        :param refresh_interval: The number of seconds between syncs of the snapshot, or 0 to never sync.
+        :param page_size: The number of entries read from LDAP at a time.
+        :param timeout: The number of seconds to wait for each page of entries.
+        :param reconcile_interval: The number of seconds after which the whole directory is read again rather than only
+        the entries modified since the last sync.
+        :param snapshot_file: A file to write each snapshot to, and map the last snapshot from on startup.
+        :param clock: A monotonic clock returning seconds, overridable for testing.
+        """
+        if not sds_client:
+            raise ValueError('sds_client must not be null')
+
+        self.sds_client = sds_client
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+        self.timeout = timeout
+        self.reconcile_interval = reconcile_interval
+        self.snapshot_file = snapshot_file
+        self._clock = clock
+        self._snapshot: Optional[Union[DirectorySnapshot, MappedDirectorySnapshot]] = None
+        self._writing_snapshot_file = False
+        self._refresh_task: Optional[asyncio.Future] = None
+        # the same DISABLE_MANUFACTURER_ORG_SEARCH_PARAM flag as `SDSClient.get_as_details` uses
+        self._search_manufacturer_org = \
+            not str2bool(config.get_config('DISABLE_MANUFACTURER_ORG_SEARCH_PARAM', default=str(False)))
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.syncs = 0
+        self.synced_entries = 0
+        self.snapshot_file_writes = 0
+
+    async def get_mhs_details(self, ods_code: str, interaction_id: str = None, party_key: str = None) -> List[Dict]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return await self.sds_client.get_mhs_details(ods_code, interaction_id, party_key)
+
+        validate_mhs_request_params(ods_code, interaction_id, party_key)
+        return snapshot.mhs.find({"nhsIDCode": ods_code, "nhsMhsSvcIA": interaction_id, "nhsMHSPartyKey": party_key})
+
+    async def get_mhs_details_batch(self, queries: List[MhsQuery]) -> List[List[Dict]]:
+        if self._snapshot is None:
+            return await self.sds_client.get_mhs_details_batch(queries)
+        return [await self.get_mhs_details(*query) for query in queries]
+
+    async def get_as_details(self, ods_code: str, interaction_id: str, manufacturing_organization: str = None,
+                             party_key: str = None) -> List[Dict]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return await self.sds_client.get_as_details(ods_code, interaction_id, manufacturing_organization, party_key)
+
+        if not ods_code or not interaction_id:
+            raise SDSException("org_code and interaction_id must be provided")
+        return snapshot.accredited_systems.find({
+            "nhsIDCode": ods_code,
+            "nhsAsSvcIA": interaction_id,
+            "nhsMHSPartyKey": party_key,
+            "nhsMhsManufacturerOrg": manufacturing_organization if self._search_manufacturer_org else None
+        })
+
+    def load_snapshot_file(self) -> bool:
+        """
+        Answer lookups from the snapshot file until the next sync, if it exists and no snapshot has been read yet.
+        Returns whether it was loaded; an unreadable file is logged, not raised.
+        """
+        if not self.snapshot_file or self._snapshot is not None or not os.path.exists(self.snapshot_file):
+            return False
+        try:
+            self._snapshot = MappedDirectorySnapshot(self.snapshot_file, self._clock)
+        except Exception:
+            logger.warning("Ignoring unreadable snapshot file {snapshot_file}",
+                           fparams={"snapshot_file": self.snapshot_file}, exc_info=True)
+            return False
+        logger.info("Mapped the snapshot of the directory from {snapshot_file}. {stats}",
+                    fparams={"snapshot_file": self.snapshot_file, "stats": self.stats()})
+        return True
+
+    async def refresh(self):
+        """
+        Read a new snapshot of the directory, keeping the current one if that fails. Failures are logged, not raised.
+        """
+        self.refreshes += 1
+        try:
+            mhs_entries, as_entries = await asyncio.gather(
+                self.sds_client.get_all_mhs_details(self.page_size, self.timeout),
+                self.sds_client.get_all_as_details(self.page_size, self.timeout))
+        except Exception:
+            self.refresh_failures += 1
+            logger.warning("Failed to read a snapshot of the directory, keeping the last snapshot", exc_info=True)
+            return
+
+        current = self._snapshot
+        if current is not None and len(current.mhs) + len(current.accredited_systems) > 0 \
+                and not mhs_entries and not as_entries:
+            self.refresh_failures += 1
+            logger.warning("Directory snapshot found no entries, keeping the last snapshot")
+            return
+
+        self._snapshot = DirectorySnapshot(mhs_entries, as_entries, self._clock())
+        logger.info("Read a snapshot of the directory. {stats}", fparams={"stats": self.stats()})
+        await self._write_snapshot_file(self._snapshot)
+
+    async def sync(self):
+        """
+        Apply the entries modified since the last sync to the snapshot, or read a whole new snapshot if it is due to be
+        reconciled. Failures are logged, not raised.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.high_water_mark is None \
+                or self._clock() - snapshot.created >= self.reconcile_interval:
+            await self.refresh()
+            return
+
+        self.syncs += 1
+        try:
+            mhs_entries, as_entries = await asyncio.gather(
+                self.sds_client.get_all_mhs_details(self.page_size, self.timeout, snapshot.high_water_mark),
+                self.sds_client.get_all_as_details(self.page_size, self.timeout, snapshot.high_water_mark))
+        except Exception:
+            self.refresh_failures += 1
+            logger.warning("Failed to sync the snapshot of the directory, keeping the last snapshot", exc_info=True)
+            return
+
+        if snapshot is not self._snapshot:
+            return
+        if mhs_entries or as_entries:
+            if isinstance(snapshot, MappedDirectorySnapshot):
+                snapshot = self._snapshot = DirectorySnapshot.from_mapped(snapshot)
+            snapshot.apply(mhs_entries, as_entries)
+        snapshot.synced = self._clock()
+        self.synced_entries += len(mhs_entries) + len(as_entries)
+        logger.info("Synced {entries} modified entries into the snapshot of the directory. {stats}",
+                    fparams={"entries": len(mhs_entries) + len(as_entries), "stats": self.stats()})
+        if mhs_entries or as_entries:
+            await self._write_snapshot_file(snapshot)
+
+    def start_refreshing(self):
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+
+    def stop_refreshing(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "mhs_entries": len(snapshot.mhs) if snapshot else 0,
+            "as_entries": len(snapshot.accredited_systems) if snapshot else 0,
+            "age": round(self._clock() - snapshot.synced, 3) if snapshot else None,
+            "high_water_mark": snapshot.high_water_mark if snapshot else None,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "syncs": self.syncs,
+            "synced_entries": self.synced_entries,
+            "snapshot_file_writes": self.snapshot_file_writes
+        }
+
+    async def _write_snapshot_file(self, snapshot: DirectorySnapshot):
+        """
+        Write `snapshot` to the snapshot file, unless a write is already in progress. Failures are logged, not raised.
+        """
+        if not self.snapshot_file or self._writing_snapshot_file:
+            return
+        self._writing_snapshot_file = True
+        try:
+            # the tables are taken on the event loop, so they are not changed by a sync while being serialized
+            tables = [snapshot.mhs.table(), snapshot.accredited_systems.table()]
+            created = time.time() - (self._clock() - snapshot.created)
+            await executors.get_executor(executors.FILES).run(self._serialize_and_write, tables, created,
+                                                              snapshot.high_water_mark)
+            self.snapshot_file_writes += 1
+        except Exception:
+            logger.warning("Failed to write the snapshot of the directory to {snapshot_file}",
+                           fparams={"snapshot_file": self.snapshot_file}, exc_info=True)
+        finally:
+            self._writing_snapshot_file = False
+
+    def _serialize_and_write(self, tables, created: float, high_water_mark: Optional[str]):
+        write_snapshot_file(self.snapshot_file, serialize_snapshot(tables, created, high_water_mark))
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.sync()
@@ -0,0 +1,304 @@
+"""
+This module contains the compact binary file a directory snapshot is persisted to, and the read-only view of it which
+answers lookups straight from the memory mapped file.
+
+All integers are little endian. The file is laid out as:
+
+* a header: the magic number, the wall clock time the snapshot was read, the string id of its high water mark (or -1),
+  the number of strings and the positions of the string offsets, string data and tables
+* the string table: every distinct string in the snapshot stored once as UTF-8, found by a uint32 offset table
+* a table for each of the nhsMhs and nhsAs entries, holding
+  * the entries, each a run of uint32s: its number of attributes, then for each attribute its name string id, whether
+    it is multi-valued, its number of values and the string id and type of each value, found by a uint32 offset table
+  * a hash index on each indexed attribute: an open addressing table of buckets, each the string id of a normalised
+    value (plus one, zero marking an empty bucket) and the start and length of its sorted list of entry ids
+"""
+import bisect
+import datetime
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from ldap3.utils.ciDict import CaseInsensitiveDict
+
+MAGIC = b"SDSSNAP\x01"
+
+_HEADER = struct.Struct("<8sdiIQQQ")
+_TABLE = struct.Struct("<IQQIQ")
+_INDEX = struct.Struct("<IIQQ")
+_BUCKET = struct.Struct("<III")
+
+# the types a value can be restored to, LDAP attribute values being formatted by ldap3 according to the schema
+_STR, _INT, _BOOL, _DATETIME = range(4)
+
+_NO_STRING = -1
+
+
+def _value_hash(value: str) -> int:
+    return zlib.crc32(value.encode())
+
+
+def _encode_value(value: Any) -> Tuple[str, int]:
+    if isinstance(value, bool):
+        return str(value), _BOOL
+    if isinstance(value, int):
+        return str(value), _INT
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(), _DATETIME
+    if isinstance(value, str):
+        return value, _STR
+    # anything else (e.g. the bytes of a binary attribute) would not be restored as the value it was
+    raise ValueError(f"Cannot store a value of type {type(value).__name__} in a snapshot file")
+
+
+def _decode_value(value: str, value_type: int) -> Any:
+    if value_type == _INT:
+        return int(value)
+    if value_type == _BOOL:
+        return value == "True"
+    if value_type == _DATETIME:
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+class _StringTable(object):
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.ids)
+        return string_id
+
+
+def _pad(data: bytearray):
+    data.extend(b"\0" * (-len(data) % 8))
+
+
+def _write_uint32s(data: bytearray, values: List[int]):
+    data.extend(struct.pack(f"<{len(values)}I", *values))
+
+
+def serialize_snapshot(tables: List[Tuple[List[Dict], Dict[str, Dict[str, List[int]]]]], created: float,
+                       high_water_mark: Optional[str]) -> bytes:
+    """
+    Serialize a directory snapshot in the snapshot file format.
+
+    :param tables: For each object class, its entries and, for each indexed attribute, a mapping of each normalised
+    value to the positions of the entries having it.
+    :param created: The wall clock time the snapshot was read.
+    :param high_water_mark: The latest modify timestamp of any entry in the snapshot.
+    :raises ValueError: if an entry has a value which is not a string, integer, boolean or datetime.
+    """
+    strings = _StringTable()
+    high_water_mark_id = strings.intern(high_water_mark) if high_water_mark is not None else _NO_STRING
+
+    encoded_tables = []
+    for entries, indexes in tables:
+        entry_data: List[int] = []
+        entry_offsets: List[int] = []
+        for entry in entries:
+            entry_offsets.append(len(entry_data))
+            entry_data.append(len(entry))
+            for name, values in entry.items():
+                is_list = isinstance(values, list)
+                values = values if is_list else [values]
+                entry_data.extend([strings.intern(name), int(is_list), len(values)])
+                for value in values:
+                    encoded, value_type = _encode_value(value)
+                    entry_data.extend([strings.intern(encoded), value_type])
+
+        encoded_indexes = []
+        for attribute, positions_by_value in indexes.items():
+            # at most half full so probe sequences stay short
+            bucket_count = max(2 * len(positions_by_value), 1)
+            buckets = [(0, 0, 0)] * bucket_count
+            postings: List[int] = []
+            for value, positions in positions_by_value.items():
+                bucket = _value_hash(value) % bucket_count
+                while buckets[bucket][0] != 0:
+                    bucket = (bucket + 1) % bucket_count
+                buckets[bucket] = (strings.intern(value) + 1, len(postings), len(positions))
+                postings.extend(sorted(positions))
+            encoded_indexes.append((strings.intern(attribute), bucket_count, buckets, postings))
+        encoded_tables.append((entry_offsets, entry_data, encoded_indexes))
+
+    string_data = bytearray()
+    string_offsets = []
+    for value in strings.ids:
+        string_offsets.append(len(string_data))
+        string_data.extend(value.encode())
+    string_offsets.append(len(string_data))
+
+    data = bytearray(_HEADER.size)
+    strings_offsets_position = len(data)
+    _write_uint32s(data, string_offsets)
+    strings_data_position = len(data)
+    data.extend(string_data)
+    _pad(data)
+
+    table_records = []
+    for entry_offsets, entry_data, encoded_indexes in encoded_tables:
+        entry_offsets_position = len(data)
+        _write_uint32s(data, entry_offsets)
+        entry_data_position = len(data)
+        _write_uint32s(data, entry_data)
+        _pad(data)
+
+        index_records = []
+        for attribute_id, bucket_count, buckets, postings in encoded_indexes:
+            buckets_position = len(data)
+            for bucket in buckets:
+                data.extend(_BUCKET.pack(*bucket))
+            postings_position = len(data)
+            _write_uint32s(data, postings)
+            _pad(data)
+            index_records.append(_INDEX.pack(attribute_id, bucket_count, buckets_position, postings_position))
+
+        indexes_position = len(data)
+        for index_record in index_records:
+            data.extend(index_record)
+        table_records.append(_TABLE.pack(len(entry_offsets), entry_offsets_position, entry_data_position,
+                                         len(index_records), indexes_position))
+
+    tables_position = len(data)
+    for table_record in table_records:
+        data.extend(table_record)
+
+    _HEADER.pack_into(data, 0, MAGIC, created, high_water_mark_id, len(strings.ids), strings_offsets_position,
+                      strings_data_position, tables_position)
+    return bytes(data)
+
+
+def write_snapshot_file(path: str, data: bytes):
+    """Write `data` to the file at `path`, replacing it atomically so readers never map a partly written file."""
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as snapshot_file:
+        snapshot_file.write(data)
+    os.replace(temporary_path, path)
+
+
+class _MappedStrings(object):
+
+    def __init__(self, buffer: memoryview, count: int, offsets_position: int, data_position: int):
+        self._offsets = buffer[offsets_position:offsets_position + 4 * (count + 1)].cast("I")
+        self._data = buffer[data_position:]
+        self._decoded: Dict[int, str] = {}
+
+    def get(self, string_id: int) -> str:
+        value = self._decoded.get(string_id)
+        if value is None:
+            start, end = self._offsets[string_id], self._offsets[string_id + 1]
+            value = self._decoded[string_id] = bytes(self._data[start:end]).decode()
+        return value
+
+    def equals(self, string_id: int, encoded: bytes) -> bool:
+        start, end = self._offsets[string_id], self._offsets[string_id + 1]
+        return end - start == len(encoded) and self._data[start:end] == encoded
+
+
+class MappedDirectoryIndex(object):
+    """The entries of one object class in a snapshot file, and the hash index on each of their indexed attributes."""
+
+    def __init__(self, buffer: memoryview, strings: _MappedStrings, table_position: int):
+        entry_count, entry_offsets_position, entry_data_position, index_count, indexes_position = \
+            _TABLE.unpack_from(buffer, table_position)
+        self._buffer = buffer
+        self._strings = strings
+        self._entry_offsets = buffer[entry_offsets_position:entry_offsets_position + 4 * entry_count].cast("I")
+        entry_data_length = (len(buffer) - entry_data_position) // 4 * 4
+        self._entry_data = buffer[entry_data_position:].cast("B")[:entry_data_length].cast("I")
+        self._indexes: Dict[str, Tuple[int, int, memoryview]] = {}
+        for position in range(indexes_position, indexes_position + index_count * _INDEX.size, _INDEX.size):
+            attribute_id, bucket_count, buckets_position, postings_position = _INDEX.unpack_from(buffer, position)
+            postings = buffer[postings_position:].cast("B")[:(len(buffer) - postings_position) // 4 * 4].cast("I")
+            self._indexes[strings.get(attribute_id)] = (bucket_count, buckets_position, postings)
+
+    def __len__(self) -> int:
+        return len(self._entry_offsets)
+
+    def values(self) -> List[Dict]:
+        return [self._decode_entry(entry_id) for entry_id in range(len(self))]
+
+    def find(self, criteria: Dict[str, Optional[str]]) -> List[Dict]:
+        """
+        Return each entry having every value in `criteria`, a mapping of attribute to value in which None values match
+        anything.
+        """
+        postings = [self._postings(attribute, value.lower())
+                    for attribute, value in criteria.items() if value is not None]
+        if not postings:
+            return self.values()
+
+        # only the entries with the least common of the values need checking for the others, which are sorted
+        candidates = min(postings, key=len)
+        return [self._decode_entry(entry_id) for entry_id in candidates
+                if all(self._contains(other, entry_id) for other in postings if other is not candidates)]
+
+    def _postings(self, attribute: str, value: str) -> memoryview:
+        bucket_count, buckets_position, postings = self._indexes[attribute]
+        encoded = value.encode()
+        bucket = _value_hash(value) % bucket_count
+        while True:
+            value_id, start, length = _BUCKET.unpack_from(self._buffer, buckets_position + bucket * _BUCKET.size)
+            if value_id == 0:
+                return postings[0:0]
+            if self._strings.equals(value_id - 1, encoded):
+                return postings[start:start + length]
+            bucket = (bucket + 1) % bucket_count
+
+    @staticmethod
+    def _contains(postings: memoryview, entry_id: int) -> bool:
+        position = bisect.bisect_left(postings, entry_id)
+        return position < len(postings) and postings[position] == entry_id
+
+    def _decode_entry(self, entry_id: int) -> Dict:
+        entry = CaseInsensitiveDict()
+        position = self._entry_offsets[entry_id]
+        attribute_count = self._entry_data[position]
+        position += 1
+        for _ in range(attribute_count):
+            name_id, is_list, value_count = self._entry_data[position:position + 3]
+            position += 3
+            values = [_decode_value(self._strings.get(self._entry_data[position + 2 * value]),
+                                    self._entry_data[position + 2 * value + 1]) for value in range(value_count)]
+            position += 2 * value_count
+            entry[self._strings.get(name_id)] = values if is_list else values[0]
+        return entry
+
+
+class MappedDirectorySnapshot(object):
+    """
+    A read-only directory snapshot answering lookups from a memory mapped snapshot file. Only the entries found by a
+    lookup are decoded, so mapping even a large snapshot takes a few milliseconds, and the pages of the file are shared
+    between every process mapping it.
+    """
+
+    def __init__(self, path: str, clock=time.monotonic):
+        """
+        :param path: The snapshot file.
+        :param clock: The monotonic clock `created` is given in terms of.
+        :raises ValueError: if the file is not a snapshot file.
+        """
+        with open(path, "rb") as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if len(buffer) < _HEADER.size:
+            raise ValueError(f"{path} is not a directory snapshot file")
+        magic, created, high_water_mark_id, string_count, strings_offsets_position, strings_data_position, \
+            tables_position = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a directory snapshot file")
+
+        strings = _MappedStrings(buffer, string_count, strings_offsets_position, strings_data_position)
+        self.mhs = MappedDirectoryIndex(buffer, strings, tables_position)
+        self.accredited_systems = MappedDirectoryIndex(buffer, strings, tables_position + _TABLE.size)
+        self.high_water_mark = strings.get(high_water_mark_id) if high_water_mark_id != _NO_STRING else None
+        # how long ago the snapshot was read, in terms of the monotonic clock used to decide when to reconcile it
+        self.created = clock() - max(time.time() - created, 0)
+        self.synced = self.created
@@ -3,6 +3,7 @@ from pathlib import Path
 import ldap3
 
 import lookup.sds_client as sds_client
+from lookup.sds_connection_pool import SDSConnectionPool
 from definitions import ROOT_DIR
 
 MHS_TEST_DATA_PATH = Path(ROOT_DIR) / 'lookup' / 'tests' / 'data'
@@ -13,7 +14,7 @@ SERVER_ENTRIES_PATH = str(MHS_TEST_DATA_PATH / 'my_real_server_entries.json')
 NHS_SERVICES_BASE = "ou=services,o=nhs"
 
 
-def fake_ldap_connection() -> ldap3.Connection:
+def fake_ldap_connection(entries_path: str = SERVER_ENTRIES_PATH) -> ldap3.Connection:
     fake_server = ldap3.Server.from_definition('my_fake_server',
                                                SERVER_INFO_PATH,
                                                SCHEMA_PATH)
@@ -22,12 +23,12 @@ def fake_ldap_connection() -> ldap3.Connection:
     fake_connection = ldap3.Connection(fake_server, client_strategy=ldap3.MOCK_ASYNC)
 
     # Populate the DIT of the fake server
-    fake_connection.strategy.entries_from_json(SERVER_ENTRIES_PATH)
+    fake_connection.strategy.entries_from_json(entries_path)
 
     fake_connection.bind()
 
     return fake_connection
 
 
-def mocked_sds_client():
-    return sds_client.SDSClient(fake_ldap_connection(), NHS_SERVICES_BASE)
+def mocked_sds_client(entries_path: str = SERVER_ENTRIES_PATH):
+    return sds_client.SDSClient(SDSConnectionPool(lambda: fake_ldap_connection(entries_path)), NHS_SERVICES_BASE)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from lookup.cache_warm_up import CacheWarmUp, create_cache_warm_up, read_queries, write_queries
+from lookup.sds_caching_client import SDSCachingClient
+from utilities import test_utilities
+from utilities.test_utilities import async_test
+
+ODS_CODE = "ODSCODE1"
+INTERACTION_ID = "urn:nhs:names:services:psis:MCCI_IN010000UK13"
+AS_INTERACTION_ID = "urn:nhs:names:services:psis:REPC_IN150016UK05"
+PARTY_KEY = "AP4RTY-K33Y"
+
+MHS_DETAILS = [{"nhsIDCode": ODS_CODE, "nhsMHSEndPoint": ["https://endpoint"]}]
+AS_DETAILS = [{"nhsIDCode": ODS_CODE, "nhsAsSvcIA": [AS_INTERACTION_ID]}]
+
+
+class TestCacheWarmUp(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.queries_file = os.path.join(self.directory.name, "queries.json")
+        self.snapshot_file = os.path.join(self.directory.name, "snapshot.json")
+
+        self.sds_client = Mock()
+        self.sds_client.get_mhs_details_batch.side_effect = \
+            lambda queries: test_utilities.awaitable([MHS_DETAILS for _ in queries])
+        self.sds_client.get_as_details.side_effect = lambda *args: test_utilities.awaitable(AS_DETAILS)
+        self.caching_client = SDSCachingClient(self.sds_client, ttl=60, max_entries=10)
+
+    def _write_file(self, path, items):
+        with open(path, "w") as file:
+            json.dump(items, file)
+
+    @async_test
+    async def test_lookups_from_queries_and_snapshot_files_are_cached_before_ready(self):
+        self._write_file(self.queries_file, [
+            {"org_code": ODS_CODE, "interaction_id": INTERACTION_ID},
+            {"lookup": "as", "org_code": ODS_CODE, "interaction_id": AS_INTERACTION_ID, "party_key": PARTY_KEY}
+        ])
+        self._write_file(self.snapshot_file, [
+            {"lookup": "mhs", "org_code": ODS_CODE, "interaction_id": INTERACTION_ID},
+            {"lookup": "mhs", "org_code": ODS_CODE, "party_key": PARTY_KEY}
+        ])
+        warm_up = CacheWarmUp(self.caching_client, self.queries_file, self.snapshot_file)
+
+        self.assertFalse(warm_up.is_ready())
+        await warm_up.run()
+
+        self.assertTrue(warm_up.is_ready())
+        self.sds_client.get_mhs_details_batch.assert_called_once_with(
+            [(ODS_CODE, INTERACTION_ID, None), (ODS_CODE, None, PARTY_KEY)])
+        self.sds_client.get_as_details.assert_called_once_with(ODS_CODE, AS_INTERACTION_ID, None, PARTY_KEY)
+        self.assertEqual(await self.caching_client.get_mhs_details(ODS_CODE, None, PARTY_KEY), MHS_DETAILS)
+        self.assertEqual(await self.caching_client.get_as_details(ODS_CODE, AS_INTERACTION_ID, None, PARTY_KEY),
+                         AS_DETAILS)
+        self.sds_client.get_mhs_details_batch.assert_called_once()
+        self.sds_client.get_as_details.assert_called_once()
+        self.assertEqual(warm_up.stats(), {"ready": True, "lookups": 3, "empty": 0, "failures": 0})
+
+    @async_test
+    async def test_lookups_which_time_out_are_counted_and_not_cached(self):
+        # a timed out LDAP search returns no results for every query combined into it
+        self.sds_client.get_mhs_details_batch.side_effect = \
+            lambda queries: test_utilities.awaitable([[] for _ in queries])
+        self.sds_client.get_as_details.side_effect = Exception("some error")
+        self._write_file(self.queries_file, [{"org_code": f"ODS{index}", "interaction_id": INTERACTION_ID}
+                                             for index in range(60)]
+                         + [{"lookup": "as", "org_code": ODS_CODE, "interaction_id": AS_INTERACTION_ID}])
+        warm_up = CacheWarmUp(self.caching_client, self.queries_file)
+
+        await warm_up.run()
+
+        self.assertEqual(self.sds_client.get_mhs_details_batch.call_count, 2)
+        self.assertEqual(warm_up.stats(), {"ready": True, "lookups": 61, "empty": 60, "failures": 1})
+        self.assertEqual(len(self.caching_client.cache), 0)
+
+    @async_test
+    async def test_concurrent_lookups_are_bounded(self):
+        in_flight = []
+        max_in_flight = []
+
+        async def get_as_details(*args):
+            in_flight.append(args)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0)
+            in_flight.remove(args)
+            return AS_DETAILS
+        self.sds_client.get_as_details.side_effect = get_as_details
+        self._write_file(self.queries_file, [{"lookup": "as", "org_code": f"ODS{index}",
+                                              "interaction_id": AS_INTERACTION_ID} for index in range(10)])
+
+        await CacheWarmUp(self.caching_client, self.queries_file, concurrency=3).run()
+
+        self.assertEqual(self.sds_client.get_as_details.call_count, 10)
+        self.assertEqual(max(max_in_flight), 3)
+
+    @async_test
+    async def test_service_is_ready_when_warm_up_fails_or_times_out(self):
+        self.sds_client.get_as_details.side_effect = lambda *args: asyncio.sleep(10)
+        self._write_file(self.queries_file,
+                         [{"lookup": "as", "org_code": ODS_CODE, "interaction_id": AS_INTERACTION_ID}])
+        self._write_file(self.snapshot_file, "not a list of queries")
+
+        for warm_up in [CacheWarmUp(self.caching_client, self.queries_file, self.snapshot_file, timeout=0.01),
+                        CacheWarmUp(self.caching_client, os.path.join(self.directory.name, "missing.json"))]:
+            with self.subTest(queries_file=warm_up.queries_file):
+                await warm_up.run()
+
+                self.assertTrue(warm_up.is_ready())
+
+    @async_test
+    async def test_snapshot_holds_most_recently_used_lookups(self):
+        self.sds_client.get_mhs_details.side_effect = lambda *args: test_utilities.awaitable(MHS_DETAILS)
+        await self.caching_client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+        await self.caching_client.get_as_details(ODS_CODE, AS_INTERACTION_ID, None, PARTY_KEY)
+        await self.caching_client.get_mhs_details("OTHER", INTERACTION_ID)
+        await self.caching_client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+        CacheWarmUp(self.caching_client, snapshot_file=self.snapshot_file, snapshot_max_queries=2).save_snapshot()
+
+        self.assertEqual(read_queries(self.snapshot_file), [
+            ("mhs", ODS_CODE, INTERACTION_ID, None, None),
+            ("mhs", "OTHER", INTERACTION_ID, None, None)
+        ])
+
+    def test_queries_round_trip_through_file(self):
+        queries = [("mhs", ODS_CODE, INTERACTION_ID, PARTY_KEY, None), ("as", ODS_CODE, AS_INTERACTION_ID, None, "ORG")]
+
+        write_queries(self.queries_file, queries)
+
+        self.assertEqual(read_queries(self.queries_file), queries)
+        self.assertEqual(os.listdir(self.directory.name), ["queries.json"])
+
+    def test_unknown_lookup_is_rejected(self):
+        self._write_file(self.queries_file, [{"lookup": "unknown", "org_code": ODS_CODE}])
+
+        with self.assertRaises(ValueError):
+            read_queries(self.queries_file)
+
+
+class TestCreateCacheWarmUp(TestCase):
+
+    @patch('utilities.config.get_config')
+    def test_warm_up_is_configured_from_config(self, mock_config):
+        config_values = {'WARM_UP_QUERIES_FILE': 'queries.json', 'WARM_UP_CONCURRENCY': '5'}
+        mock_config.side_effect = lambda key, default=None: config_values.get(key, default)
+
+        warm_up = create_cache_warm_up(SDSCachingClient(Mock(), ttl=60, max_entries=10))
+
+        self.assertEqual(warm_up.queries_file, 'queries.json')
+        self.assertIsNone(warm_up.snapshot_file)
+        self.assertEqual(warm_up.concurrency, 5)
+        self.assertEqual(warm_up.timeout, 60)
+
+    @patch('utilities.config.get_config')
+    def test_no_warm_up_without_files_or_lookup_cache(self, mock_config):
+        for config_values, sds_client in [({}, SDSCachingClient(Mock(), ttl=60, max_entries=10)),
+                                          ({'WARM_UP_QUERIES_FILE': 'queries.json'}, Mock())]:
+            with self.subTest(config_values=config_values):
+                mock_config.side_effect = lambda key, default=None: config_values.get(key, default)
+
+                self.assertIsNone(create_cache_warm_up(sds_client))
@@ -0,0 +1,160 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+from lookup.intermediary_address_cache import IntermediaryAddressCache, sds_address_resolver
+from utilities.constants import FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION, \
+    FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION
+from utilities.test_utilities import async_test, awaitable
+from utilities.tests.test_ttl_cache import FakeClock
+
+RELIABLE_ADDRESS = "https://reliable.example.com"
+EXPRESS_ADDRESS = "https://express.example.com"
+
+
+def _resolver():
+    addresses = {
+        FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION: RELIABLE_ADDRESS,
+        FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION: EXPRESS_ADDRESS
+    }
+    return AsyncMock(side_effect=lambda interaction, *args: addresses[interaction])
+
+
+class TestIntermediaryAddressCache(TestCase):
+
+    def test_should_raise_error_if_resolver_is_null(self):
+        with self.assertRaises(ValueError):
+            IntermediaryAddressCache(None)
+
+    @async_test
+    async def test_address_is_resolved_once_and_then_served_from_memory(self):
+        resolver = _resolver()
+        cache = IntermediaryAddressCache(resolver)
+
+        for _ in range(3):
+            self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION, {"header": "value"}),
+                             RELIABLE_ADDRESS)
+
+        resolver.assert_called_once_with(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION, {"header": "value"})
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 2, "misses": 1, "refreshes": 0, "refresh_failures": 0})
+
+    @async_test
+    async def test_concurrent_lookups_share_one_resolution(self):
+        release = asyncio.Event()
+
+        async def resolve(interaction):
+            await release.wait()
+            return RELIABLE_ADDRESS
+
+        resolver = AsyncMock(side_effect=resolve)
+        cache = IntermediaryAddressCache(resolver)
+
+        lookups = asyncio.gather(*[cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION) for _ in range(5)])
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertEqual(await lookups, [RELIABLE_ADDRESS] * 5)
+        resolver.assert_called_once()
+
+    @async_test
+    async def test_warm_up_resolves_every_core_spine_interaction(self):
+        resolver = _resolver()
+        cache = IntermediaryAddressCache(resolver)
+
+        await cache.warm_up()
+        self.assertEqual(await cache.get(FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION), EXPRESS_ADDRESS)
+
+        self.assertEqual(resolver.call_count, 2)
+        self.assertEqual(cache.stats()["refreshes"], 2)
+
+    @async_test
+    async def test_warm_up_failures_are_counted_not_raised(self):
+        cache = IntermediaryAddressCache(AsyncMock(side_effect=ValueError("no results")))
+
+        await cache.warm_up()
+
+        self.assertEqual(cache.stats()["refresh_failures"], 2)
+        self.assertEqual(cache.stats()["size"], 0)
+
+    @async_test
+    async def test_address_older_than_max_age_is_resolved_again(self):
+        clock = FakeClock()
+        resolver = AsyncMock(side_effect=[RELIABLE_ADDRESS, "https://moved.example.com"])
+        cache = IntermediaryAddressCache(resolver, max_age=10, clock=clock)
+
+        await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+        clock.now += 10
+
+        self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION), "https://moved.example.com")
+
+    @async_test
+    async def test_last_known_address_is_served_if_resolving_again_fails(self):
+        clock = FakeClock()
+        resolver = AsyncMock(side_effect=[RELIABLE_ADDRESS, ValueError("no results")])
+        cache = IntermediaryAddressCache(resolver, max_age=10, clock=clock)
+
+        await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+        clock.now += 10
+
+        self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION), RELIABLE_ADDRESS)
+
+    @async_test
+    async def test_no_address_found_does_not_replace_last_known_address(self):
+        clock = FakeClock()
+        resolver = AsyncMock(side_effect=[None, RELIABLE_ADDRESS, None, None])
+        cache = IntermediaryAddressCache(resolver, max_age=10, clock=clock)
+
+        self.assertIsNone(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION))
+        self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION), RELIABLE_ADDRESS)
+        await cache.refresh(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+        self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION), RELIABLE_ADDRESS)
+        clock.now += 10
+
+        self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION), RELIABLE_ADDRESS)
+        self.assertEqual(resolver.call_count, 4)
+        self.assertEqual(cache.stats()["refresh_failures"], 1)
+
+    @async_test
+    async def test_error_is_raised_if_address_has_never_been_resolved(self):
+        cache = IntermediaryAddressCache(AsyncMock(side_effect=ValueError("no results")))
+
+        with self.assertRaises(ValueError):
+            await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+
+    @async_test
+    async def test_held_addresses_are_refreshed_in_background(self):
+        resolver = AsyncMock(side_effect=[RELIABLE_ADDRESS, "https://moved.example.com"])
+        cache = IntermediaryAddressCache(resolver, refresh_interval=0.01)
+        await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+
+        cache.start_refreshing()
+        while resolver.call_count < 2:
+            await asyncio.sleep(0.01)
+        cache.stop_refreshing()
+
+        self.assertEqual(await cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION), "https://moved.example.com")
+
+
+class TestSdsAddressResolver(TestCase):
+
+    @async_test
+    @patch('utilities.config.get_config', return_value="SPINE")
+    async def test_resolves_single_address_of_spine_core_service(self, mock_config):
+        sds_client = Mock()
+        sds_client.get_mhs_details.return_value = awaitable([{"nhsMHSEndPoint": [RELIABLE_ADDRESS]}])
+
+        address = await sds_address_resolver(sds_client)(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+
+        self.assertEqual(address, RELIABLE_ADDRESS)
+        sds_client.get_mhs_details.assert_called_once_with("SPINE", FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+
+    @async_test
+    @patch('utilities.config.get_config', return_value="SPINE")
+    async def test_raises_error_unless_exactly_one_address_is_found(self, mock_config):
+        for ldap_results in [[], [{"nhsMHSEndPoint": []}], [{"nhsMHSEndPoint": [RELIABLE_ADDRESS]}] * 2]:
+            with self.subTest(ldap_results=ldap_results):
+                sds_client = Mock()
+                sds_client.get_mhs_details.return_value = awaitable(ldap_results)
+
+                with self.assertRaises(ValueError):
+                    await sds_address_resolver(sds_client)(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
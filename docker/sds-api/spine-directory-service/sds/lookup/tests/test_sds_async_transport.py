@@ -0,0 +1,221 @@
+import asyncio
+from typing import Dict, List, Tuple
+from unittest import TestCase
+
+import ldap3
+import ldap3.core.exceptions as ldap_exceptions
+from ldap3.protocol.rfc4511 import AttributeDescription, AttributeValue, BindResponse, LDAPDN, LDAPMessage, \
+    LDAPString, MessageID, PartialAttribute, PartialAttributeList, ProtocolOp, ResultCode, SearchResultDone, \
+    SearchResultEntry, Vals
+from ldap3.strategy.base import BaseStrategy
+from ldap3.utils.asn1 import encode
+
+from lookup.sds_async_transport import AsyncLdapTransport
+from lookup.sds_client import MHS_ATTRIBUTES, SDSAsyncTransportClient
+from lookup.tests.ldap_mocks import NHS_SERVICES_BASE, SCHEMA_PATH, SERVER_INFO_PATH
+from utilities.test_utilities import async_test
+
+BIND_REQUEST_TAG = 0x60
+SEARCH_REQUEST_TAG = 0x63
+
+ENTRY = ('uniqueIdentifier=123456789,ou=services,o=nhs', {
+    'nhsIDCode': [b'ODS'],
+    'nhsMhsSvcIA': [b'urn:nhs:names:services:psis:REPC_IN150016UK05'],
+    'nhsMHSEndPoint': [b'https://test.example.com/reliablemessaging/reliablerequest'],
+    'uniqueIdentifier': [b'123456789']
+})
+
+
+def _message(message_id: int, operation: str, response) -> bytes:
+    message = LDAPMessage()
+    message['messageID'] = MessageID(message_id)
+    message['protocolOp'] = ProtocolOp().setComponentByName(operation, response)
+    return encode(message)
+
+
+def _result(response):
+    response['resultCode'] = ResultCode(0)
+    response['matchedDN'] = LDAPDN('')
+    response['diagnosticMessage'] = LDAPString('')
+    return response
+
+
+def _search_result_entry(message_id: int, dn: str, attributes: Dict[str, List[bytes]]) -> bytes:
+    entry = SearchResultEntry()
+    entry['object'] = LDAPDN(dn)
+    attribute_list = PartialAttributeList()
+    for name, values in attributes.items():
+        attribute = PartialAttribute()
+        attribute['type'] = AttributeDescription(name)
+        vals = Vals()
+        for value in values:
+            vals.append(AttributeValue(value))
+        attribute['vals'] = vals
+        attribute_list.append(attribute)
+    entry['attributes'] = attribute_list
+    return _message(message_id, 'searchResEntry', entry)
+
+
+def _parse_request(data: bytes) -> Tuple[int, int]:
+    """Returns the message id and protocol op tag of an encoded LDAPMessage."""
+    offset = 2 if data[1] <= 127 else 2 + (data[1] - 128)
+    id_length = data[offset + 1]
+    message_id = int.from_bytes(data[offset + 2:offset + 2 + id_length], 'big')
+    return message_id, data[offset + 2 + id_length]
+
+
+class FakeLdapServer(object):
+    """
+    Answers anonymous binds and returns `entries` for every search. Searches are held until `batch_size` of them have
+    arrived and are then answered in reverse order, so responses arrive out of order with respect to their requests.
+    """
+
+    def __init__(self, entries, batch_size: int = 1, respond: bool = True):
+        self.entries = entries
+        self.batch_size = batch_size
+        self.respond = respond
+        self.connections = 0
+        self.searches = 0
+        self.writers = []
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in self.writers:
+            writer.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self.writers.append(writer)
+        buffer = bytearray()
+        held = []
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return
+            buffer += data
+            while True:
+                length = BaseStrategy.compute_ldap_message_size(buffer)
+                if length == -1 or len(buffer) < length:
+                    break
+                message_id, tag = _parse_request(bytes(buffer[:length]))
+                del buffer[:length]
+
+                if tag == BIND_REQUEST_TAG:
+                    writer.write(_message(message_id, 'bindResponse', _result(BindResponse())))
+                elif tag == SEARCH_REQUEST_TAG:
+                    self.searches += 1
+                    held.append(message_id)
+                    if self.respond and len(held) >= self.batch_size:
+                        for held_id in reversed(held):
+                            for dn, attributes in self.entries:
+                                writer.write(_search_result_entry(held_id, dn, attributes))
+                            writer.write(_message(held_id, 'searchResDone', _result(SearchResultDone())))
+                        held = []
+            await writer.drain()
+
+
+class TestAsyncLdapTransport(TestCase):
+
+    async def _start(self, fake_server: FakeLdapServer) -> AsyncLdapTransport:
+        port = await fake_server.start()
+        server = ldap3.Server.from_definition('127.0.0.1', SERVER_INFO_PATH, SCHEMA_PATH, port=port)
+        return AsyncLdapTransport(server, connect_timeout=1)
+
+    def test_should_raise_error_if_server_is_null(self):
+        with self.assertRaises(ValueError):
+            AsyncLdapTransport(None)
+
+    @async_test
+    async def test_search_returns_entries_formatted_using_server_schema(self):
+        fake_server = FakeLdapServer([ENTRY])
+        transport = await self._start(fake_server)
+
+        entries = await transport.search(NHS_SERVICES_BASE, '(nhsIDCode=ODS)', MHS_ATTRIBUTES, 1)
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['dn'], ENTRY[0])
+        attributes = entries[0]['attributes']
+        self.assertEqual(attributes['nhsIDCode'], 'ODS')
+        self.assertEqual(attributes['nhsMHSEndPoint'], ['https://test.example.com/reliablemessaging/reliablerequest'])
+        self.assertEqual(attributes['uniqueIdentifier'], ['123456789'])
+        # requested attributes the entry does not have are returned empty, as they are by an ldap3 connection
+        self.assertEqual(attributes['nhsMHSPartyKey'], [])
+        self.assertEqual(transport.outstanding, 0)
+
+        transport.close()
+        await fake_server.stop()
+
+    @async_test
+    async def test_concurrent_searches_share_one_connection_and_match_out_of_order_responses(self):
+        fake_server = FakeLdapServer([ENTRY], batch_size=3)
+        transport = await self._start(fake_server)
+
+        results = await asyncio.gather(*[
+            transport.search(NHS_SERVICES_BASE, f'(nhsIDCode=ODS{i})', ['nhsIDCode'], 1) for i in range(3)
+        ])
+
+        self.assertEqual(fake_server.connections, 1)
+        self.assertEqual(fake_server.searches, 3)
+        for entries in results:
+            self.assertEqual(entries[0]['attributes']['nhsIDCode'], 'ODS')
+
+        transport.close()
+        await fake_server.stop()
+
+    @async_test
+    async def test_search_times_out_if_server_does_not_respond(self):
+        fake_server = FakeLdapServer([ENTRY], respond=False)
+        transport = await self._start(fake_server)
+
+        with self.assertRaises(ldap_exceptions.LDAPResponseTimeoutError):
+            await transport.search(NHS_SERVICES_BASE, '(nhsIDCode=ODS)', ['nhsIDCode'], 0.1)
+        self.assertEqual(transport.outstanding, 0)
+
+        transport.close()
+        await fake_server.stop()
+
+    @async_test
+    async def test_outstanding_searches_fail_and_connection_is_reopened_when_server_disconnects(self):
+        fake_server = FakeLdapServer([ENTRY], respond=False)
+        transport = await self._start(fake_server)
+
+        search = asyncio.ensure_future(transport.search(NHS_SERVICES_BASE, '(nhsIDCode=ODS)', ['nhsIDCode'], 1))
+        while fake_server.searches == 0:
+            await asyncio.sleep(0.01)
+        fake_server.writers[0].close()
+
+        with self.assertRaises(ldap_exceptions.LDAPSocketReceiveError):
+            await search
+        self.assertTrue(transport.closed)
+
+        fake_server.respond = True
+        entries = await transport.search(NHS_SERVICES_BASE, '(nhsIDCode=ODS)', ['nhsIDCode'], 1)
+
+        self.assertEqual(entries[0]['attributes']['nhsIDCode'], 'ODS')
+        self.assertEqual(fake_server.connections, 2)
+
+        transport.close()
+        await fake_server.stop()
+
+    @async_test
+    async def test_client_returns_entry_attributes_and_swallows_timeouts(self):
+        fake_server = FakeLdapServer([ENTRY])
+        transport = await self._start(fake_server)
+        client = SDSAsyncTransportClient(transport, NHS_SERVICES_BASE)
+
+        result = await client.get_mhs_details('ODS', 'urn:nhs:names:services:psis:REPC_IN150016UK05')
+        self.assertEqual(result[0]['nhsIDCode'], 'ODS')
+
+        fake_server.respond = False
+        client.timeout = 0.1
+        result = await client.get_mhs_details('ODS', 'urn:nhs:names:services:psis:REPC_IN150016UK05')
+        self.assertEqual(result, [])
+
+        transport.close()
+        await fake_server.stop()
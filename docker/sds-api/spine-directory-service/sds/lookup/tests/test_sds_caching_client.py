@@ -0,0 +1,191 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import Mock
+
+from lookup.sds_caching_client import SDSCachingClient, stale_result_age
+from utilities import test_utilities
+from utilities.test_utilities import async_test
+from utilities.tests.test_ttl_cache import FakeClock
+from utilities.ttl_cache import TTLCache
+
+ODS_CODE = "ODSCODE1"
+INTERACTION_ID = "urn:nhs:names:services:psis:MCCI_IN010000UK13"
+PARTY_KEY = "AP4RTY-K33Y"
+MANUFACTURING_ORG = "B86071"
+
+MHS_DETAILS = [{"nhsIDCode": ODS_CODE, "nhsMHSEndPoint": ["https://endpoint"]}]
+AS_DETAILS = [{"nhsIDCode": ODS_CODE, "nhsAsSvcIA": [INTERACTION_ID]}]
+
+
+class TestSDSCachingClient(TestCase):
+
+    def setUp(self):
+        self.sds_client = Mock()
+        self.sds_client.get_mhs_details.side_effect = lambda *args: test_utilities.awaitable(MHS_DETAILS)
+        self.sds_client.get_as_details.side_effect = lambda *args: test_utilities.awaitable(AS_DETAILS)
+        self.client = SDSCachingClient(self.sds_client, ttl=60, max_entries=10)
+
+    @async_test
+    async def test_repeated_mhs_lookup_is_served_from_cache(self):
+        first = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID, PARTY_KEY)
+        second = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID, PARTY_KEY)
+
+        self.assertEqual(first, MHS_DETAILS)
+        self.assertEqual(second, MHS_DETAILS)
+        self.sds_client.get_mhs_details.assert_called_once_with(ODS_CODE, INTERACTION_ID, PARTY_KEY)
+        self.assertEqual(self.client.stats()["hits"], 1)
+        self.assertEqual(self.client.stats()["misses"], 1)
+
+    @async_test
+    async def test_repeated_as_lookup_is_served_from_cache(self):
+        await self.client.get_as_details(ODS_CODE, INTERACTION_ID, MANUFACTURING_ORG, PARTY_KEY)
+        result = await self.client.get_as_details(ODS_CODE, INTERACTION_ID, MANUFACTURING_ORG, PARTY_KEY)
+
+        self.assertEqual(result, AS_DETAILS)
+        self.sds_client.get_as_details.assert_called_once_with(ODS_CODE, INTERACTION_ID, MANUFACTURING_ORG, PARTY_KEY)
+
+    @async_test
+    async def test_lookups_are_keyed_on_normalised_query(self):
+        await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID, None)
+        await self.client.get_mhs_details(f" {ODS_CODE} ", INTERACTION_ID, "")
+        await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID, PARTY_KEY)
+        await self.client.get_as_details(ODS_CODE, INTERACTION_ID)
+
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 2)
+        self.assertEqual(self.sds_client.get_as_details.call_count, 1)
+        self.sds_client.get_mhs_details.assert_any_call(ODS_CODE, INTERACTION_ID, None)
+        self.assertNotIn(((f" {ODS_CODE} ", INTERACTION_ID, ""),), self.sds_client.get_mhs_details.call_args_list)
+
+    @async_test
+    async def test_callers_cannot_modify_cached_results(self):
+        result = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+        result[0]["nhsMHSEndPoint"] = ["https://modified"]
+
+        result = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+        self.assertEqual(result[0]["nhsMHSEndPoint"], ["https://endpoint"])
+
+    @async_test
+    async def test_failed_lookups_are_not_cached(self):
+        self.sds_client.get_mhs_details.side_effect = [Exception("some error"), test_utilities.awaitable(MHS_DETAILS)]
+
+        with self.assertRaises(Exception):
+            await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+        result = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+        self.assertEqual(result, MHS_DETAILS)
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 2)
+
+    @async_test
+    async def test_timed_out_lookup_is_not_cached(self):
+        # a timed out LDAP search returns no results
+        self.sds_client.get_mhs_details.side_effect = [test_utilities.awaitable([]),
+                                                       test_utilities.awaitable(MHS_DETAILS)]
+        self.sds_client.get_as_details.side_effect = [test_utilities.awaitable([]),
+                                                      test_utilities.awaitable(AS_DETAILS)]
+
+        self.assertEqual(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID), [])
+        self.assertEqual(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID), MHS_DETAILS)
+        self.assertEqual(await self.client.get_as_details(ODS_CODE, INTERACTION_ID), [])
+        self.assertEqual(await self.client.get_as_details(ODS_CODE, INTERACTION_ID), AS_DETAILS)
+
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 2)
+        self.assertEqual(self.sds_client.get_as_details.call_count, 2)
+        self.assertEqual(self.client.stats()["size"], 2)
+
+    @async_test
+    async def test_batched_mhs_lookups_only_look_up_queries_missing_from_cache(self):
+        self.sds_client.get_mhs_details_batch.side_effect = \
+            lambda queries: test_utilities.awaitable([MHS_DETAILS for _ in queries])
+        await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID, PARTY_KEY)
+
+        results = await self.client.get_mhs_details_batch(
+            [(ODS_CODE, INTERACTION_ID, PARTY_KEY), ("OTHER", INTERACTION_ID, None), ("OTHER", INTERACTION_ID, "")])
+        results[1][0]["nhsMHSEndPoint"] = ["https://modified"]
+
+        self.assertEqual(results, [MHS_DETAILS, [{"nhsIDCode": ODS_CODE, "nhsMHSEndPoint": ["https://modified"]}],
+                                   MHS_DETAILS])
+        self.sds_client.get_mhs_details_batch.assert_called_once_with([("OTHER", INTERACTION_ID, None)])
+        self.assertEqual(await self.client.get_mhs_details("OTHER", INTERACTION_ID), MHS_DETAILS)
+        self.sds_client.get_mhs_details_batch.assert_called_once()
+
+    @async_test
+    async def test_timed_out_batched_lookup_is_not_cached(self):
+        # a timed out LDAP search returns no results for any of the queries combined into it
+        self.sds_client.get_mhs_details_batch.side_effect = [test_utilities.awaitable([[], []]),
+                                                             test_utilities.awaitable([MHS_DETAILS, MHS_DETAILS])]
+        queries = [(ODS_CODE, INTERACTION_ID, None), ("OTHER", INTERACTION_ID, None)]
+
+        self.assertEqual(await self.client.get_mhs_details_batch(queries), [[], []])
+        self.assertEqual(await self.client.get_mhs_details_batch(queries), [MHS_DETAILS, MHS_DETAILS])
+
+        self.assertEqual(self.sds_client.get_mhs_details_batch.call_count, 2)
+        self.assertEqual(self.client.stats()["size"], 2)
+
+    def test_should_raise_error_if_no_client_set(self):
+        with self.assertRaises(ValueError):
+            SDSCachingClient(None, ttl=60, max_entries=10)
+
+
+class TestSDSCachingClientStaleWhileRevalidate(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sds_client = Mock()
+        self.client = SDSCachingClient(self.sds_client, ttl=60, max_entries=10, max_staleness=30)
+        self.client.cache = TTLCache(ttl=60, max_entries=10, clock=self.clock)
+
+    async def _prime_cache(self):
+        self.sds_client.get_mhs_details.return_value = test_utilities.awaitable(MHS_DETAILS)
+        await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+    @async_test
+    async def test_expired_result_is_served_while_refreshed_in_background(self):
+        await self._prime_cache()
+        refreshed = [{"nhsIDCode": ODS_CODE, "nhsMHSEndPoint": ["https://refreshed"]}]
+        self.sds_client.get_mhs_details.return_value = test_utilities.awaitable(refreshed)
+        self.clock.now = 70
+
+        result = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+        self.assertEqual(result, MHS_DETAILS)
+        self.assertEqual(stale_result_age.get(), 70)
+        await asyncio.sleep(0)
+        self.assertEqual(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID), refreshed)
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 2)
+        self.assertEqual(self.client.stats()["stale_hits"], 1)
+
+    @async_test
+    async def test_result_older_than_max_staleness_is_looked_up(self):
+        await self._prime_cache()
+        refreshed = [{"nhsIDCode": ODS_CODE, "nhsMHSEndPoint": ["https://refreshed"]}]
+        self.sds_client.get_mhs_details.return_value = test_utilities.awaitable(refreshed)
+        self.clock.now = 90
+
+        result = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+        self.assertEqual(result, refreshed)
+        self.assertIsNone(stale_result_age.get())
+
+    @async_test
+    async def test_failed_or_empty_refresh_keeps_last_known_result(self):
+        await self._prime_cache()
+        self.clock.now = 70
+
+        for refresh in [Exception("some error"), test_utilities.awaitable([])]:
+            with self.subTest(refresh=refresh):
+                self.sds_client.get_mhs_details.side_effect = [refresh]
+                self.assertEqual(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID), MHS_DETAILS)
+                await asyncio.sleep(0)
+                self.assertEqual(self.client.cache.peek(("mhs", ODS_CODE, INTERACTION_ID, None, None))[0], MHS_DETAILS)
+
+    @async_test
+    async def test_only_one_background_refresh_runs_per_key(self):
+        await self._prime_cache()
+        self.clock.now = 70
+        self.sds_client.get_mhs_details.return_value = test_utilities.awaitable(MHS_DETAILS)
+
+        await asyncio.gather(*[self.client.get_mhs_details(ODS_CODE, INTERACTION_ID) for _ in range(3)])
+        await asyncio.sleep(0)
+
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 2)
@@ -1,10 +1,13 @@
+import asyncio
 from copy import copy
 from unittest import TestCase
+from unittest.mock import patch
 
 from utilities.test_utilities import async_test
 
 import lookup.sds_client as sds_client
 import lookup.tests.ldap_mocks as mocks
+from lookup.sds_connection_pool import SDSConnectionPool
 
 MHS_OBJECT_CLASS = "nhsMhs"
 
@@ -77,6 +80,74 @@ class TestSDSClient(TestCase):
         # Assert exact number of attributes, minus the unique values
         self.assertEqual(len(attributes), len(EXPECTED_DEVICE_ATTRIBUTES))
 
+    @async_test
+    async def test_concurrent_identical_lookups_share_one_search(self):
+        client = mocks.mocked_sds_client()
+
+        with patch.object(client, '_search', wraps=client._search) as search:
+            results = await asyncio.gather(*[client.get_mhs_details(ODS_CODE, INTERACTION_ID) for _ in range(3)])
+
+        search.assert_called_once()
+        for attributes in results:
+            self.assertEqual(attributes[0]['nhsMhsFQDN'], expected_mhs_attributes[0]['nhsMhsFQDN'])
+        results[0][0]['nhsMHSEndPoint'] = ['https://modified']
+        self.assertEqual(results[1][0]['nhsMHSEndPoint'], expected_mhs_attributes[0]['nhsMHSEndPoint'])
+
+    @async_test
+    async def test_batched_mhs_lookups_are_combined_into_one_search(self):
+        client = mocks.mocked_sds_client()
+        queries = [(ODS_CODE, INTERACTION_ID, None), ("fake code", "fake interaction", None),
+                   (None, INTERACTION_ID, PARTY_KEY.lower()), (ODS_CODE, INTERACTION_ID, None)]
+
+        with patch.object(client, '_search', wraps=client._search) as search:
+            results = await client.get_mhs_details_batch(queries)
+
+        search.assert_called_once()
+        search_filter = search.call_args[0][0]
+        self.assertTrue(search_filter.startswith(f"(&(objectClass={MHS_OBJECT_CLASS})(|(&"))
+        self.assertEqual([len(attributes) for attributes in results], [1, 0, 1, 1])
+        self.assertEqual(results[0][0]['nhsMhsFQDN'], expected_mhs_attributes[0]['nhsMhsFQDN'])
+        results[0][0]['nhsMHSEndPoint'] = ['https://modified']
+        self.assertEqual(results[3][0]['nhsMHSEndPoint'], expected_mhs_attributes[0]['nhsMHSEndPoint'])
+
+    @async_test
+    async def test_batched_mhs_lookups_are_split_into_searches_of_at_most_max_batch_size(self):
+        client = mocks.mocked_sds_client()
+        client.max_batch_size = 2
+        queries = [(ODS_CODE, INTERACTION_ID, None), ("fake code", "fake interaction", None),
+                   (ODS_CODE, None, PARTY_KEY)]
+
+        with patch.object(client, '_search', wraps=client._search) as search:
+            results = await client.get_mhs_details_batch(queries)
+
+        self.assertEqual(search.call_count, 2)
+        self.assertEqual([len(attributes) for attributes in results], [1, 0, 1])
+
+    @async_test
+    async def test_batched_mhs_lookups_are_validated(self):
+        client = mocks.mocked_sds_client()
+
+        with self.assertRaises(sds_client.SDSException):
+            await client.get_mhs_details_batch([(ODS_CODE, INTERACTION_ID, None), (ODS_CODE, None, None)])
+
+    @async_test
+    async def test_get_all_mhs_details_reads_every_mhs_in_pages(self):
+        client = mocks.mocked_sds_client()
+
+        with patch.object(client, '_search_all', wraps=client._search_all) as search_all:
+            attributes = await client.get_all_mhs_details(page_size=1)
+            modified_attributes = await client.get_all_mhs_details(page_size=1, modified_since="20200101000000Z")
+
+        self.assertEqual(len(attributes), 1)
+        self.assertEqual(attributes[0]['nhsMhsFQDN'], expected_mhs_attributes[0]['nhsMhsFQDN'])
+        self.assertIn('modifyTimestamp', attributes[0])
+        self.assertTrue(attributes[0][sds_client.ENTRY_DN])
+        # the mock directory has no modify timestamps so nothing is modified since any time
+        self.assertEqual(modified_attributes, [])
+        self.assertEqual(client._build_search_all_filter(MHS_OBJECT_CLASS, "20200101000000Z"),
+                         "(&(objectClass=nhsMhs)(modifyTimestamp>=20200101000000Z))")
+        self.assertEqual(search_all.call_count, 2)
+
     @async_test
     async def test_no_results(self):
         client = mocks.mocked_sds_client()
@@ -96,4 +167,4 @@ class TestSDSClient(TestCase):
     @async_test
     async def test_should_raise_error_if_no_search_base_set(self):
         with self.assertRaises(ValueError):
-            sds_client.SDSClient(mocks.fake_ldap_connection(), None)
+            sds_client.SDSClient(SDSConnectionPool(mocks.fake_ldap_connection), None)
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+
+import ldap3.core.exceptions as ldap_exceptions
+
+from lookup.sds_connection_pool import SDSConnectionPool
+from lookup.sds_exception import SDSException
+from utilities.test_utilities import async_test
+
+
+def _connection_factory():
+    connection = Mock()
+    connection.bound = False
+    connection.closed = False
+    return connection
+
+
+class TestSDSConnectionPool(TestCase):
+
+    @async_test
+    async def test_connections_are_opened_and_bound_once_off_the_event_loop(self):
+        connections = []
+
+        def factory():
+            connection = _connection_factory()
+            connection.opened_on = threading.current_thread()
+            connections.append(connection)
+            return connection
+
+        pool = SDSConnectionPool(factory, min_connections=2, max_connections=4)
+        self.assertEqual(len(connections), 0)
+        self.assertEqual(pool.size, 0)
+
+        async with pool.connection():
+            async with pool.connection():
+                pass
+
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(pool.idle, 2)
+        for connection in connections:
+            self.assertIsNot(connection.opened_on, threading.main_thread())
+            connection.bind.assert_called_once()
+
+    @async_test
+    async def test_failure_to_open_a_connection_frees_its_place_in_the_pool(self):
+        factory = Mock(side_effect=[ldap_exceptions.LDAPSocketOpenError(), _connection_factory()])
+        pool = SDSConnectionPool(factory, min_connections=0, max_connections=1)
+
+        with self.assertRaises(ldap_exceptions.LDAPSocketOpenError):
+            async with pool.connection():
+                pass
+        self.assertEqual(pool.size, 0)
+
+        async with pool.connection():
+            self.assertEqual(pool.size, 1)
+
+    def test_should_raise_error_if_pool_bounds_are_invalid(self):
+        for min_connections, max_connections in [(-1, 1), (0, 0), (3, 2)]:
+            with self.subTest(f"min={min_connections} max={max_connections}"):
+                with self.assertRaises(ValueError):
+                    SDSConnectionPool(_connection_factory, min_connections, max_connections)
+
+    @async_test
+    async def test_connection_is_reused_between_requests(self):
+        factory = Mock(side_effect=_connection_factory)
+        pool = SDSConnectionPool(factory, min_connections=1, max_connections=4)
+
+        async with pool.connection() as first:
+            pass
+        async with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(factory.call_count, 1)
+        first.bind.assert_called_once()
+
+    @async_test
+    async def test_concurrent_requests_use_separate_connections(self):
+        pool = SDSConnectionPool(_connection_factory, min_connections=0, max_connections=4)
+
+        async with pool.connection() as first:
+            async with pool.connection() as second:
+                self.assertIsNot(first, second)
+                self.assertEqual(pool.in_use, 2)
+
+        self.assertEqual(pool.idle, 2)
+
+    @async_test
+    async def test_acquire_waits_for_a_connection_to_be_released(self):
+        pool = SDSConnectionPool(_connection_factory, min_connections=0, max_connections=1, acquire_timeout=1)
+
+        async def hold_connection():
+            async with pool.connection() as connection:
+                await asyncio.sleep(0.01)
+                return connection
+
+        async def wait_for_connection():
+            await asyncio.sleep(0)
+            async with pool.connection() as connection:
+                return connection
+
+        first, second = await asyncio.gather(hold_connection(), wait_for_connection())
+
+        self.assertIs(first, second)
+        self.assertEqual(pool.size, 1)
+
+    @async_test
+    async def test_acquire_times_out_when_pool_is_exhausted(self):
+        pool = SDSConnectionPool(_connection_factory, min_connections=0, max_connections=1, acquire_timeout=0.01)
+
+        async with pool.connection():
+            with self.assertRaises(SDSException):
+                async with pool.connection():
+                    pass
+
+        self.assertEqual(pool.waiting, 0)
+
+    @async_test
+    async def test_connection_raising_ldap_error_is_discarded(self):
+        pool = SDSConnectionPool(_connection_factory, min_connections=0, max_connections=1)
+
+        with self.assertRaises(ldap_exceptions.LDAPSocketOpenError):
+            async with pool.connection() as broken:
+                raise ldap_exceptions.LDAPSocketOpenError()
+
+        broken.unbind.assert_called_once()
+        self.assertEqual(pool.size, 0)
+
+        async with pool.connection() as connection:
+            self.assertIsNot(connection, broken)
+
+    @async_test
+    async def test_closed_connection_is_replaced(self):
+        pool = SDSConnectionPool(_connection_factory, min_connections=0, max_connections=1)
+
+        async with pool.connection() as closed:
+            pass
+        closed.closed = True
+
+        async with pool.connection() as connection:
+            self.assertIsNot(connection, closed)
+        self.assertEqual(pool.size, 1)
+
+    @async_test
+    async def test_idle_connections_above_minimum_are_evicted(self):
+        pool = SDSConnectionPool(_connection_factory, min_connections=1, max_connections=2, idle_timeout=0)
+
+        async with pool.connection():
+            async with pool.connection() as second:
+                pass
+        await asyncio.sleep(0.01)
+
+        async with pool.connection():
+            pass
+
+        self.assertEqual(pool.size, 1)
+        second.unbind.assert_called_once()
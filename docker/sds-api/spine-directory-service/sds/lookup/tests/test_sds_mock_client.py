@@ -0,0 +1,103 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from benchmarks import synthetic_directory
+from lookup.sds_client import SDSMockClient
+from lookup.sds_exception import SDSException
+from lookup.tests import ldap_mocks
+from utilities.test_utilities import async_test
+
+ODS_CODE = "YES"
+INTERACTION_ID = "urn:nhs:names:services:psis:REPC_IN150016UK05"
+PARTY_KEY = "YES-0000806"
+GP_CONNECT_INTERACTION_ID = "urn:nhs:names:services:gpconnect:fhir:operation:gpc.getstructuredrecord-1"
+AS_INTERACTION_ID = "urn:nhs:names:services:psis:MCCI_IN010000UK13"
+
+
+class TestSDSMockClient(TestCase):
+
+    def setUp(self):
+        self.client = SDSMockClient()
+
+    def _scan_mhs(self, ods_code, interaction_id, party_key):
+        return [entry for entry in self.client.mock_mhs_data
+                if (ods_code is None or entry['nhsIDCode'] == ods_code)
+                and (interaction_id is None or interaction_id in (entry['nhsMhsSvcIA']
+                                                                  if isinstance(entry['nhsMhsSvcIA'], list)
+                                                                  else [entry['nhsMhsSvcIA']]))
+                and (party_key is None or entry['nhsMHSPartyKey'] == party_key)]
+
+    @async_test
+    async def test_mhs_lookups_match_a_scan_of_the_mock_data(self):
+        queries = [(entry['nhsIDCode'], None, entry['nhsMHSPartyKey']) for entry in self.client.mock_mhs_data]
+        queries += [(ODS_CODE, INTERACTION_ID, None), (ODS_CODE, INTERACTION_ID, PARTY_KEY),
+                    ("B82617", GP_CONNECT_INTERACTION_ID, None), (ODS_CODE, GP_CONNECT_INTERACTION_ID, None),
+                    ("MISSING", INTERACTION_ID, None)]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(await self.client.get_mhs_details(*query), self._scan_mhs(*query))
+
+        self.assertEqual(len(await self.client.get_mhs_details("B82617", GP_CONNECT_INTERACTION_ID)), 1)
+
+    @async_test
+    async def test_mhs_lookups_are_validated(self):
+        with self.assertRaises(SDSException):
+            await self.client.get_mhs_details(ODS_CODE)
+
+    @async_test
+    async def test_as_lookups_match_every_given_value(self):
+        entry = self.client.mock_as_data[0]
+        ods_code, party_key, manufacturer = entry['nhsIDCode'], entry['nhsMHSPartyKey'], entry['nhsMhsManufacturerOrg']
+        interaction_id = entry['nhsAsSvcIA'][0]
+
+        self.assertIn(entry, await self.client.get_as_details(ods_code, interaction_id))
+        self.assertIn(entry, await self.client.get_as_details(ods_code, interaction_id, manufacturer, party_key))
+        self.assertEqual(await self.client.get_as_details(ods_code, interaction_id, "OTHER"), [])
+        self.assertEqual(await self.client.get_as_details(ods_code, "urn:missing"), [])
+
+
+class TestSDSMockClientWithSyntheticDirectory(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.mhs_entries, self.as_entries = synthetic_directory.generate_directory(
+            organisations=20, interactions_per_organisation=3, party_keys_per_organisation=2, endpoints_per_mhs=2,
+            interaction_pool=8, seed=1)
+        synthetic_directory.write_directory(self.directory.name, self.mhs_entries, self.as_entries)
+
+    @async_test
+    @patch('utilities.config.get_config')
+    async def test_mock_client_reads_synthetic_directory(self, mock_config):
+        config_values = {
+            'MOCK_LDAP_MHS_DATA_FILE': os.path.join(self.directory.name, synthetic_directory.MOCK_MHS_DATA_FILE),
+            'MOCK_LDAP_AS_DATA_FILE': os.path.join(self.directory.name, synthetic_directory.MOCK_AS_DATA_FILE)
+        }
+        mock_config.side_effect = lambda key, default=None: config_values.get(key, default)
+        client = SDSMockClient()
+        queries = synthetic_directory.sample_endpoint_queries(self.mhs_entries, 20, skew=1.2, seed=1)
+
+        self.assertEqual(len(client.mock_mhs_data), 120)
+        self.assertEqual(len(client.mock_as_data), 40)
+        for ods_code, interaction_id, party_key in queries:
+            with self.subTest(query=(ods_code, interaction_id, party_key)):
+                mhs_details = await client.get_mhs_details(ods_code, interaction_id, party_key)
+                as_details = await client.get_as_details(ods_code, interaction_id, None, party_key)
+
+                self.assertEqual(len(mhs_details), 1)
+                self.assertEqual(len(mhs_details[0]['nhsMHSEndPoint']), 2)
+                self.assertEqual(len(as_details), 1)
+
+    @async_test
+    async def test_ldap_mock_reads_synthetic_directory(self):
+        client = ldap_mocks.mocked_sds_client(os.path.join(self.directory.name, synthetic_directory.LDAP_ENTRIES_FILE))
+        entry = self.mhs_entries[7]
+
+        mhs_details = await client.get_mhs_details(entry['nhsIDCode'], entry['nhsMhsSvcIA'])
+        as_details = await client.get_as_details(entry['nhsIDCode'], entry['nhsMhsSvcIA'], None,
+                                                 entry['nhsMHSPartyKey'])
+
+        self.assertEqual([details['nhsMhsCPAId'] for details in mhs_details], [entry['nhsMhsCPAId']])
+        self.assertEqual(len(as_details), 1)
@@ -0,0 +1,247 @@
+import os
+import tempfile
+from datetime import datetime, timezone
+from unittest import TestCase
+from unittest.mock import Mock
+
+import lookup.tests.ldap_mocks as mocks
+from lookup.sds_exception import SDSException
+from lookup.sds_snapshot_client import DirectoryIndex, SDSSnapshotClient
+from utilities import test_utilities
+from utilities.test_utilities import async_test
+from utilities.tests.test_ttl_cache import FakeClock
+
+ODS_CODE = "ODSCODE1"
+INTERACTION_ID = "urn:nhs:names:services:psis:MCCI_IN010000UK13"
+AS_INTERACTION_ID = "urn:nhs:names:services:psis:REPC_IN150016UK05"
+PARTY_KEY = "AP4RTY-K33Y"
+
+MHS_ENTRIES = [
+    {"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": INTERACTION_ID, "nhsMHSPartyKey": PARTY_KEY, "nhsMhsFQDN": "first"},
+    {"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": "urn:nhs:names:services:psis:OTHER", "nhsMHSPartyKey": PARTY_KEY,
+     "nhsMhsFQDN": "second"},
+    {"nhsIDCode": "OTHER", "nhsMhsSvcIA": INTERACTION_ID, "nhsMHSPartyKey": "OTHER-KEY", "nhsMhsFQDN": "third"}
+]
+AS_ENTRIES = [
+    {"nhsIDCode": ODS_CODE, "nhsAsSvcIA": [AS_INTERACTION_ID, INTERACTION_ID], "nhsMHSPartyKey": PARTY_KEY,
+     "nhsMhsManufacturerOrg": "MANUFACTURER", "uniqueIdentifier": ["123456789"]}
+]
+
+
+class TestDirectoryIndex(TestCase):
+
+    def test_entries_are_replaced_and_removed_by_distinguished_name(self):
+        index = DirectoryIndex([{**MHS_ENTRIES[0], "dn": "uniqueIdentifier=1,o=nhs"},
+                                {**MHS_ENTRIES[2], "dn": "uniqueIdentifier=2,o=nhs"}], ["nhsIDCode"])
+
+        index.put({**MHS_ENTRIES[2], "dn": "UNIQUEIDENTIFIER=1,O=NHS", "nhsMhsFQDN": "replaced"})
+        self.assertEqual(index.find({"nhsIDCode": ODS_CODE}), [])
+        self.assertEqual([entry["nhsMhsFQDN"] for entry in index.find({"nhsIDCode": "OTHER"})], ["third", "replaced"])
+
+        index.remove("uniqueidentifier=2,o=nhs")
+        self.assertEqual(index.keys(), ["uniqueidentifier=1,o=nhs"])
+        self.assertEqual([entry["nhsMhsFQDN"] for entry in index.find({"nhsIDCode": "OTHER"})], ["replaced"])
+
+    def test_entries_sharing_a_unique_identifier_are_kept(self):
+        index = DirectoryIndex([{**MHS_ENTRIES[0], "uniqueIdentifier": ["1"], "dn": "uniqueIdentifier=1,ou=a,o=nhs"},
+                                {**MHS_ENTRIES[1], "uniqueIdentifier": ["1"], "dn": "uniqueIdentifier=1,ou=b,o=nhs"},
+                                {**MHS_ENTRIES[2], "uniqueIdentifier": ["1"]}], ["nhsIDCode"])
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual([entry["nhsMhsFQDN"] for entry in index.find({"nhsIDCode": ODS_CODE})], ["first", "second"])
+
+    def test_entries_are_found_by_every_given_value(self):
+        index = DirectoryIndex(MHS_ENTRIES, ["nhsIDCode", "nhsMhsSvcIA", "nhsMHSPartyKey"])
+        values = [
+            ({"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": INTERACTION_ID, "nhsMHSPartyKey": None}, ["first"]),
+            ({"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": None, "nhsMHSPartyKey": PARTY_KEY}, ["first", "second"]),
+            ({"nhsIDCode": None, "nhsMhsSvcIA": INTERACTION_ID.upper(), "nhsMHSPartyKey": None}, ["first", "third"]),
+            ({"nhsIDCode": "OTHER", "nhsMhsSvcIA": None, "nhsMHSPartyKey": PARTY_KEY}, []),
+            ({"nhsIDCode": "MISSING", "nhsMhsSvcIA": None, "nhsMHSPartyKey": None}, [])
+        ]
+        for criteria, expected in values:
+            with self.subTest(criteria=criteria):
+                self.assertEqual([entry["nhsMhsFQDN"] for entry in index.find(criteria)], expected)
+
+    def test_multi_valued_attributes_are_indexed_by_each_value(self):
+        index = DirectoryIndex(AS_ENTRIES, ["nhsIDCode", "nhsAsSvcIA"])
+
+        self.assertEqual(len(index.find({"nhsAsSvcIA": INTERACTION_ID})), 1)
+        self.assertEqual(len(index.find({"nhsAsSvcIA": AS_INTERACTION_ID})), 1)
+
+    def test_found_entries_are_copies(self):
+        index = DirectoryIndex(MHS_ENTRIES, ["nhsIDCode"])
+
+        index.find({"nhsIDCode": "OTHER"})[0]["nhsMhsFQDN"] = "modified"
+
+        self.assertEqual(index.find({"nhsIDCode": "OTHER"})[0]["nhsMhsFQDN"], "third")
+
+
+class TestSDSSnapshotClient(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sds_client = Mock()
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(MHS_ENTRIES)
+        self.sds_client.get_all_as_details.side_effect = lambda *args: test_utilities.awaitable(AS_ENTRIES)
+        self.client = SDSSnapshotClient(self.sds_client, page_size=100, timeout=10, clock=self.clock)
+
+    @async_test
+    async def test_lookups_are_answered_from_snapshot(self):
+        await self.client.refresh()
+
+        mhs_details = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+        batch_details = await self.client.get_mhs_details_batch([(ODS_CODE, None, PARTY_KEY),
+                                                                 ("OTHER", INTERACTION_ID, None)])
+        as_details = await self.client.get_as_details(ODS_CODE, AS_INTERACTION_ID, "MANUFACTURER", PARTY_KEY)
+        missing_as_details = await self.client.get_as_details(ODS_CODE, AS_INTERACTION_ID, "OTHER", PARTY_KEY)
+
+        self.assertEqual(mhs_details, [MHS_ENTRIES[0]])
+        self.assertEqual(batch_details, [MHS_ENTRIES[:2], [MHS_ENTRIES[2]]])
+        self.assertEqual(as_details, AS_ENTRIES)
+        self.assertEqual(missing_as_details, [])
+        self.sds_client.get_all_mhs_details.assert_called_once_with(100, 10)
+        self.sds_client.get_mhs_details.assert_not_called()
+        self.sds_client.get_as_details.assert_not_called()
+
+    @async_test
+    async def test_lookups_are_validated(self):
+        await self.client.refresh()
+
+        with self.assertRaises(SDSException):
+            await self.client.get_mhs_details(ODS_CODE)
+        with self.assertRaises(SDSException):
+            await self.client.get_as_details(ODS_CODE, None)
+
+    @async_test
+    async def test_lookups_are_passed_through_until_snapshot_is_read(self):
+        self.sds_client.get_mhs_details.side_effect = lambda *args: test_utilities.awaitable(MHS_ENTRIES[:1])
+
+        result = await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)
+
+        self.assertEqual(result, MHS_ENTRIES[:1])
+        self.sds_client.get_mhs_details.assert_called_once_with(ODS_CODE, INTERACTION_ID, None)
+
+    @async_test
+    async def test_failed_or_empty_refresh_keeps_last_snapshot(self):
+        await self.client.refresh()
+        self.clock.now = 300
+
+        for refreshed in [Exception("some error"), test_utilities.awaitable([])]:
+            with self.subTest(refreshed=refreshed):
+                self.sds_client.get_all_mhs_details.side_effect = [refreshed]
+                self.sds_client.get_all_as_details.side_effect = lambda *args: test_utilities.awaitable([])
+
+                await self.client.refresh()
+
+                self.assertEqual(len(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID)), 1)
+        self.assertEqual(self.client.stats(), {"mhs_entries": 3, "as_entries": 1, "age": 300, "high_water_mark": None,
+                                               "refreshes": 3, "refresh_failures": 2, "syncs": 0, "synced_entries": 0,
+                                               "snapshot_file_writes": 0})
+
+    @async_test
+    async def test_refresh_swaps_in_new_snapshot(self):
+        await self.client.refresh()
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(MHS_ENTRIES[2:])
+
+        await self.client.refresh()
+
+        self.assertEqual(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID), [])
+        self.assertEqual(self.client.stats()["mhs_entries"], 1)
+
+    @async_test
+    async def test_sync_applies_entries_modified_since_latest_modify_timestamp(self):
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(
+            [{**MHS_ENTRIES[0], "dn": "uniqueIdentifier=1",
+              "modifyTimestamp": datetime(2020, 1, 1, tzinfo=timezone.utc)},
+             {**MHS_ENTRIES[2], "dn": "uniqueIdentifier=2", "modifyTimestamp": "20200102000000Z"}])
+        await self.client.refresh()
+        changed_entry = {**MHS_ENTRIES[1], "dn": "uniqueIdentifier=1", "modifyTimestamp": "20200103000000Z"}
+        new_entry = {**MHS_ENTRIES[0], "dn": "uniqueIdentifier=3", "modifyTimestamp": "20200103000000Z"}
+        self.sds_client.get_all_mhs_details.side_effect = \
+            lambda *args: test_utilities.awaitable([changed_entry.copy(), new_entry.copy()])
+        self.sds_client.get_all_as_details.side_effect = lambda *args: test_utilities.awaitable([])
+        self.clock.now = 60
+
+        await self.client.sync()
+
+        self.sds_client.get_all_mhs_details.assert_called_with(100, 10, "20200102000000Z")
+        self.sds_client.get_all_as_details.assert_called_with(100, 10, "20200102000000Z")
+        mhs_details = await self.client.get_mhs_details(ODS_CODE, None, PARTY_KEY)
+        self.assertEqual([entry["nhsMhsFQDN"] for entry in mhs_details], ["second", "first"])
+        self.assertNotIn("modifyTimestamp", (await self.client.get_mhs_details("OTHER", INTERACTION_ID))[0])
+        self.assertEqual(self.client.stats()["high_water_mark"], "20200103000000Z")
+        self.assertEqual(self.client.stats()["synced_entries"], 2)
+        self.assertEqual(self.client.stats()["refreshes"], 1)
+
+    @async_test
+    async def test_sync_reads_whole_directory_when_due_to_reconcile_or_without_modify_timestamps(self):
+        await self.client.sync()
+        await self.client.sync()
+        self.assertEqual(self.client.stats()["refreshes"], 2)
+
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(
+            [{**MHS_ENTRIES[0], "modifyTimestamp": "20200101000000Z"}])
+        await self.client.refresh()
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(MHS_ENTRIES[2:])
+        self.clock.now = 3600
+
+        await self.client.sync()
+
+        self.assertEqual(self.client.stats()["refreshes"], 4)
+        self.assertEqual(self.client.stats()["syncs"], 0)
+        self.assertEqual(await self.client.get_mhs_details(ODS_CODE, INTERACTION_ID), [])
+
+    @async_test
+    async def test_snapshot_is_read_from_ldap_in_pages(self):
+        client = SDSSnapshotClient(mocks.mocked_sds_client(), page_size=1)
+
+        await client.refresh()
+
+        self.assertEqual(client.stats()["mhs_entries"], 1)
+        self.assertEqual(client.stats()["as_entries"], 1)
+        self.assertEqual(len(await client.get_mhs_details(ODS_CODE, INTERACTION_ID)), 1)
+        self.assertEqual(len(await client.get_as_details(ODS_CODE, AS_INTERACTION_ID, None, PARTY_KEY)), 1)
+
+    @async_test
+    async def test_snapshot_is_written_to_and_served_from_snapshot_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshot_file = os.path.join(directory.name, "snapshot.bin")
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(
+            [{**MHS_ENTRIES[0], "dn": "uniqueIdentifier=1", "modifyTimestamp": "20200101000000Z"}])
+        client = SDSSnapshotClient(self.sds_client, page_size=100, timeout=10, snapshot_file=snapshot_file)
+        self.assertFalse(client.load_snapshot_file())
+        await client.refresh()
+        self.assertEqual(client.stats()["snapshot_file_writes"], 1)
+
+        restarted = SDSSnapshotClient(self.sds_client, page_size=100, timeout=10, snapshot_file=snapshot_file)
+        self.assertTrue(restarted.load_snapshot_file())
+
+        self.assertEqual(await restarted.get_mhs_details(ODS_CODE, INTERACTION_ID),
+                         [{**MHS_ENTRIES[0], "dn": "uniqueIdentifier=1"}])
+        self.assertEqual(restarted.stats()["high_water_mark"], "20200101000000Z")
+
+        self.sds_client.get_all_mhs_details.side_effect = lambda *args: test_utilities.awaitable(
+            [{**MHS_ENTRIES[2], "dn": "uniqueIdentifier=2", "modifyTimestamp": "20200102000000Z"}])
+        self.sds_client.get_all_as_details.side_effect = lambda *args: test_utilities.awaitable([])
+        await restarted.sync()
+
+        self.sds_client.get_all_mhs_details.assert_called_with(100, 10, "20200101000000Z")
+        self.assertEqual(restarted.stats()["refreshes"], 0)
+        self.assertEqual(restarted.stats()["mhs_entries"], 2)
+        self.assertEqual(len(await restarted.get_mhs_details("OTHER", INTERACTION_ID)), 1)
+        self.assertEqual(restarted.stats()["snapshot_file_writes"], 1)
+
+    @async_test
+    async def test_unreadable_snapshot_file_is_ignored(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshot_file = os.path.join(directory.name, "snapshot.bin")
+        with open(snapshot_file, "w") as file:
+            file.write("not a snapshot")
+
+        client = SDSSnapshotClient(self.sds_client, snapshot_file=snapshot_file)
+
+        self.assertFalse(client.load_snapshot_file())
+        self.assertEqual(client.stats()["mhs_entries"], 0)
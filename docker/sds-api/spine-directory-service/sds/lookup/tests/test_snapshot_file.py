@@ -0,0 +1,98 @@
+import datetime
+import os
+import tempfile
+from unittest import TestCase
+
+from lookup.sds_snapshot_client import DirectorySnapshot
+from lookup.snapshot_file import MappedDirectorySnapshot, serialize_snapshot, write_snapshot_file
+from utilities.tests.test_ttl_cache import FakeClock
+
+ODS_CODE = "ODSCODE1"
+INTERACTION_ID = "urn:nhs:names:services:psis:MCCI_IN010000UK13"
+AS_INTERACTION_ID = "urn:nhs:names:services:psis:REPC_IN150016UK05"
+PARTY_KEY = "AP4RTY-K33Y"
+
+MHS_ENTRIES = [
+    {"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": INTERACTION_ID, "nhsMHSPartyKey": PARTY_KEY, "nhsMhsFQDN": "first",
+     "nhsMHSEndPoint": ["https://first"], "nhsMHSRetries": 3, "nhsMHSAckRequested": True, "uniqueIdentifier": ["1"]},
+    {"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": "urn:nhs:names:services:psis:OTHER", "nhsMHSPartyKey": PARTY_KEY,
+     "nhsMhsFQDN": "second", "uniqueIdentifier": ["2"]},
+    {"nhsIDCode": "OTHER", "nhsMhsSvcIA": INTERACTION_ID, "nhsMHSPartyKey": "OTHER-KEY", "nhsMhsFQDN": "third",
+     "uniqueIdentifier": ["3"]}
+]
+AS_ENTRIES = [
+    {"nhsIDCode": ODS_CODE, "nhsAsSvcIA": [AS_INTERACTION_ID, INTERACTION_ID], "nhsMHSPartyKey": PARTY_KEY,
+     "nhsMhsManufacturerOrg": "MANUFACTURER", "uniqueIdentifier": ["123456789"], "nhsApproverURP": "uniqueidentifier",
+     "nhsDateApproved": datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)}
+]
+
+
+class TestMappedDirectorySnapshot(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "snapshot.bin")
+        self.clock = FakeClock()
+        self.clock.now = 1000
+
+    def _write(self, snapshot: DirectorySnapshot, created: float = 0):
+        tables = [snapshot.mhs.table(), snapshot.accredited_systems.table()]
+        write_snapshot_file(self.path, serialize_snapshot(tables, created or datetime.datetime.now().timestamp(),
+                                                          snapshot.high_water_mark))
+        return MappedDirectorySnapshot(self.path, self.clock)
+
+    def test_entries_round_trip_through_file(self):
+        mapped = self._write(DirectorySnapshot(MHS_ENTRIES, AS_ENTRIES, 0))
+
+        self.assertEqual(len(mapped.mhs), 3)
+        self.assertEqual(len(mapped.accredited_systems), 1)
+        self.assertEqual(mapped.mhs.values(), MHS_ENTRIES)
+        self.assertEqual(mapped.accredited_systems.values(), AS_ENTRIES)
+        self.assertEqual(mapped.mhs.values()[0]["NHSMHSENDPOINT"], ["https://first"])
+        self.assertIsNone(mapped.high_water_mark)
+        self.assertEqual(os.listdir(self.directory.name), ["snapshot.bin"])
+
+    def test_entries_are_found_by_every_given_value(self):
+        mapped = self._write(DirectorySnapshot(MHS_ENTRIES, AS_ENTRIES, 0))
+        values = [
+            ({"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": INTERACTION_ID, "nhsMHSPartyKey": None}, ["first"]),
+            ({"nhsIDCode": ODS_CODE, "nhsMhsSvcIA": None, "nhsMHSPartyKey": PARTY_KEY}, ["first", "second"]),
+            ({"nhsIDCode": None, "nhsMhsSvcIA": INTERACTION_ID.upper(), "nhsMHSPartyKey": None}, ["first", "third"]),
+            ({"nhsIDCode": "OTHER", "nhsMhsSvcIA": None, "nhsMHSPartyKey": PARTY_KEY}, []),
+            ({"nhsIDCode": "MISSING", "nhsMhsSvcIA": None, "nhsMHSPartyKey": None}, [])
+        ]
+        for criteria, expected in values:
+            with self.subTest(criteria=criteria):
+                self.assertEqual([entry["nhsMhsFQDN"] for entry in mapped.mhs.find(criteria)], expected)
+        self.assertEqual(mapped.accredited_systems.find({"nhsAsSvcIA": INTERACTION_ID}), AS_ENTRIES)
+
+    def test_high_water_mark_and_age_are_kept(self):
+        snapshot = DirectorySnapshot([{**MHS_ENTRIES[0], "modifyTimestamp": "20200101000000Z"}], [], 0)
+
+        mapped = self._write(snapshot, created=datetime.datetime.now().timestamp() - 60)
+
+        self.assertEqual(mapped.high_water_mark, "20200101000000Z")
+        self.assertAlmostEqual(mapped.created, 940, delta=5)
+        self.assertEqual(mapped.synced, mapped.created)
+
+    def test_empty_snapshot_round_trips(self):
+        mapped = self._write(DirectorySnapshot([], [], 0))
+
+        self.assertEqual(len(mapped.mhs), 0)
+        self.assertEqual(mapped.mhs.find({"nhsIDCode": ODS_CODE}), [])
+
+    def test_values_which_cannot_be_restored_are_rejected(self):
+        entries = [dict(MHS_ENTRIES[0], nhsMhsFQDN=b"first")]
+
+        with self.assertRaises(ValueError):
+            self._write(DirectorySnapshot(entries, [], 0))
+
+    def test_other_files_are_rejected(self):
+        for contents in [b"", b"short", b"[" * 100]:
+            with self.subTest(contents=contents):
+                with open(self.path, "wb") as file:
+                    file.write(contents)
+
+                with self.assertRaises(ValueError):
+                    MappedDirectorySnapshot(self.path)
@@ -1,54 +1,140 @@
+import os
+import socket
+from typing import List, Optional
+
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.web
 
 import lookup.sds_client_factory
+from lookup.cache_warm_up import CacheWarmUp, create_cache_warm_up
+from lookup.intermediary_address_cache import IntermediaryAddressCache, create_intermediary_address_cache, \
+    sds_address_resolver
 from lookup.sds_client import SDSClient
-from request import healthcheck_handler, routing_reliability_handler, accredited_system_handler
+from lookup.sds_snapshot_client import SDSSnapshotClient
+from request import cpm, healthcheck_handler, routing_reliability_handler, routing_reliability_batch_handler, \
+    accredited_system_handler
+from request.compression import create_compression_transform
 from request.error_handler import ErrorHandler
-from utilities import config, secrets
+from request.graceful_shutdown import GracefulShutdown, InFlightRequests
+from request.response_cache import ResponseCache, create_response_cache
+from utilities import config, json_serializer, secrets
 from utilities import integration_adaptors_logger as log
+from utilities.worker_processes import WorkerProcesses
 
 logger = log.IntegrationAdaptorsLogger(__name__)
 
 
-def start_tornado_server(sds_client: SDSClient) -> None:
+def start_tornado_server(sds_client: SDSClient, intermediary_address_cache: IntermediaryAddressCache,
+                         sockets: Optional[List[socket.socket]] = None,
+                         response_cache: Optional[ResponseCache] = None,
+                         cache_warm_up: Optional[CacheWarmUp] = None) -> None:
     """Start the Tornado server
 
     :param sds_client: The sds client component to be used when servicing requests.
+    :param intermediary_address_cache: The cache of Spine core forward reliable/express addresses looked up in SDS.
+    :param sockets: Already bound listening sockets to serve requests on, shared between worker processes. If not
+    provided, the server listens on `SDS_SERVER_PORT` itself.
+    :param response_cache: The cache of serialized `/Endpoint` and `/Device` responses, or None to not cache them.
+    :param cache_warm_up: Preloads the lookup cache, `/healthcheck` reporting the server unavailable until it has, or
+    None to not warm up the cache.
     """
 
-    handler_dependencies = {"sds_client": sds_client}
+    handler_dependencies = {"sds_client": sds_client, "response_cache": response_cache}
+    endpoint_handler_dependencies = {**handler_dependencies, "intermediary_address_cache": intermediary_address_cache}
+    batch_handler_dependencies = {**endpoint_handler_dependencies,
+                                  "max_entries": int(config.get_config('BATCH_MAX_ENTRIES', default='100'))}
+    compression_transform = create_compression_transform()
     application = tornado.web.Application([
-        ("/Endpoint", routing_reliability_handler.RoutingReliabilityRequestHandler, handler_dependencies),
+        ("/Endpoint", routing_reliability_handler.RoutingReliabilityRequestHandler, endpoint_handler_dependencies),
+        ("/Endpoint" + routing_reliability_batch_handler.BATCH_PATH_SUFFIX,
+         routing_reliability_batch_handler.RoutingReliabilityBatchRequestHandler, batch_handler_dependencies),
         ("/Device", accredited_system_handler.AccreditedSystemRequestHandler, handler_dependencies),
-        ("/healthcheck", healthcheck_handler.HealthcheckHandler),
-        ("/healthcheck/deep", healthcheck_handler.DeepHealthcheckHandler),
-    ], default_handler_class=ErrorHandler)
-    server = tornado.httpserver.HTTPServer(application)
+        ("/healthcheck", healthcheck_handler.HealthcheckHandler,
+         {"is_ready": cache_warm_up.is_ready if cache_warm_up else None}),
+        # the deep healthcheck checks LDAP itself, so bypasses any snapshot or cache lookups are answered from
+        ("/healthcheck/deep", healthcheck_handler.DeepHealthcheckHandler,
+         {"sds_client": lookup.sds_client_factory.get_ldap_client(sds_client)}),
+    ], transforms=[compression_transform] if compression_transform else [], default_handler_class=ErrorHandler)
+    in_flight = InFlightRequests(application)
+    server = tornado.httpserver.HTTPServer(in_flight)
     server_port = int(config.get_config('SERVER_PORT', default='9000'))
-    server.listen(server_port)
+    if sockets:
+        server.add_sockets(sockets)
+    else:
+        server.listen(server_port)
 
-    logger.info('Starting router server at port {server_port}', fparams={'server_port': server_port})
     tornado_io_loop = tornado.ioloop.IOLoop.current()
+    if isinstance(sds_client, SDSSnapshotClient):
+        # the first snapshot is read before serving, so no request waits on LDAP unless it cannot be read at all. A
+        # snapshot left in the snapshot file is served at once instead, and brought up to date straight away
+        if sds_client.load_snapshot_file():
+            tornado_io_loop.add_callback(sds_client.sync)
+        else:
+            tornado_io_loop.run_sync(sds_client.refresh)
+        tornado_io_loop.add_callback(sds_client.start_refreshing)
+    intermediary_address_caches = [intermediary_address_cache]
+    if os.environ.get("USE_CPM") == "1":
+        intermediary_address_caches.append(cpm.get_intermediary_address_cache())
+    for cache in intermediary_address_caches:
+        tornado_io_loop.run_sync(cache.warm_up)
+        tornado_io_loop.add_callback(cache.start_refreshing)
+    if cache_warm_up:
+        # the server answers healthchecks (as unavailable) while warming up rather than not answering at all
+        tornado_io_loop.add_callback(cache_warm_up.run)
+        tornado_io_loop.add_callback(cache_warm_up.start_saving_snapshots)
+
+    # stopped on SIGTERM (e.g. by the worker process supervisor or `docker stop`) once in flight requests have finished
+    shutdown_timeout = float(config.get_config('SERVER_SHUTDOWN_TIMEOUT_IN_SECONDS', default='10'))
+    GracefulShutdown(server, in_flight, shutdown_timeout).install()
+
+    logger.info('Starting router server at port {server_port}', fparams={'server_port': server_port})
     try:
         tornado_io_loop.start()
     except KeyboardInterrupt:
         logger.warning('Keyboard interrupt')
         pass
     finally:
+        if cache_warm_up:
+            cache_warm_up.save_snapshot()
         tornado_io_loop.stop()
         tornado_io_loop.close(True)
     logger.info('Server shut down, exiting...')
 
 
+def create_worker_processes() -> Optional[WorkerProcesses]:
+    """Create the worker processes from the `SERVER_*` config values, or return None to serve from this process."""
+    server_processes = int(config.get_config('SERVER_PROCESSES', default='1'))
+    if server_processes == 1:
+        return None
+    max_restarts = int(config.get_config('SERVER_MAX_WORKER_RESTARTS', default='100'))
+    return WorkerProcesses(server_processes, max_restarts)
+
+
 def main():
     config.setup_config("SDS")
     secrets.setup_secret_config("SDS")
     log.configure_logging('sds')
+    json_serializer.configure()
+
+    sockets = None
+    worker_processes = create_worker_processes()
+    if worker_processes:
+        # the listening sockets are bound once and inherited by every worker, which then accept connections from them
+        # independently. Everything else (LDAP connections, caches, the IOLoop) is created after the fork so each worker
+        # has its own and nothing is shared between them.
+        sockets = tornado.netutil.bind_sockets(int(config.get_config('SERVER_PORT', default='9000')))
+        task_id = worker_processes.start()
+        if task_id is None:
+            # the supervisor, once every worker has exited
+            return
+        logger.info('Started worker process {task_id}', fparams={'task_id': task_id})
 
     sds_client = lookup.sds_client_factory.get_sds_client()
-    start_tornado_server(sds_client)
+    intermediary_address_cache = create_intermediary_address_cache(sds_address_resolver(sds_client))
+    start_tornado_server(sds_client, intermediary_address_cache, sockets, create_response_cache(),
+                         create_cache_warm_up(sds_client))
 
 
 if __name__ == "__main__":
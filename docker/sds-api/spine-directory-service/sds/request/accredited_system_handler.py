@@ -1,5 +1,3 @@
-import json
-
 from urllib.parse import unquote
 
 import tornado
@@ -7,13 +5,14 @@ import tornado
 from request.cpm import get_device_from_cpm, should_use_cpm
 from request.base_handler import BaseHandler, ORG_CODE_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
     IDENTIFIER_QUERY_PARAMETER_NAME, SERVICE_ID_FHIR_IDENTIFIER, PARTY_KEY_FHIR_IDENTIFIER, \
-    MANUFACTURING_ORGANIZATION_QUERY_PARAMETER_NAME, MANUFACTURING_ORGANIZATION_FHIR_IDENTIFIER
+    MANUFACTURING_ORGANIZATION_QUERY_PARAMETER_NAME, MANUFACTURING_ORGANIZATION_FHIR_IDENTIFIER, \
+    PRETTY_QUERY_PARAMETER_NAME, build_etag
 from request.content_type_validator import get_valid_accept_type
 from request.error_handler import ErrorHandler
 from request.fhir_json_mapper import build_bundle_resource, build_device_resource
 from request.http_headers import HttpHeaders
 from request.tracking_ids_headers_reader import read_tracking_id_headers
-from utilities import timing, integration_adaptors_logger as log, mdc
+from utilities import timing, integration_adaptors_logger as log, mdc, json_serializer
 
 logger = log.IntegrationAdaptorsLogger(__name__)
 
@@ -23,6 +22,7 @@ class AccreditedSystemRequestHandler(BaseHandler, ErrorHandler):
 
     @timing.time_request
     async def get(self):
+        self._reset_stale_result_age()
         tracking_id_headers = read_tracking_id_headers(self.request.headers)
 
         self._validate_query_params()
@@ -34,41 +34,49 @@ class AccreditedSystemRequestHandler(BaseHandler, ErrorHandler):
         party_key = self.get_optional_query_param(IDENTIFIER_QUERY_PARAMETER_NAME, PARTY_KEY_FHIR_IDENTIFIER)
 
         accept_type = get_valid_accept_type(self.request.headers)
+        use_cpm = should_use_cpm(handler=self)
+
+        cache_key = self._response_cache_key(org_code, service_id, manufacturing_organization, party_key, use_cpm)
+        if self._write_cached_response(cache_key, accept_type):
+            return
 
         logger.info("Looking up accredited system information for {org_code}, {service_id}, {manufacturing_organization}, {party_key}",
                     fparams={"org_code": org_code, "service_id": service_id, 'manufacturing_organization': manufacturing_organization, 'party_key': party_key})
 
-        if should_use_cpm(handler=self):
+        if use_cpm:
             ldap_result = await get_device_from_cpm(org_code=org_code, interaction_id=service_id, manufacturing_organization=manufacturing_organization, party_key=party_key, tracking_id_headers=tracking_id_headers)
             if 'resourceType' in ldap_result and ldap_result['resourceType'] == 'OperationOutcome':
-                self.write(json.dumps(ldap_result, indent=2, sort_keys=False))
+                self.write(json_serializer.dumps(ldap_result, self.get_pretty_query_param()))
                 self.set_header(HttpHeaders.CONTENT_TYPE, accept_type)
                 self.set_header(HttpHeaders.X_CORRELATION_ID, mdc.correlation_id.get())
             else:
-                self._build_output(ldap_result, accept_type)
+                self._build_output(ldap_result, accept_type, cache_key)
         else:
             ldap_result = await self.sds_client.get_as_details(org_code, service_id, manufacturing_organization, party_key)
-            self._build_output(ldap_result, accept_type)
+            self._build_output(ldap_result, accept_type, cache_key)
 
-    def _build_output(self, ldap_result, accept_type):
+    def _build_output(self, ldap_result, accept_type, cache_key):
         logger.info("Obtained accredited system information. {ldap_result}",
                     fparams={"ldap_result": ldap_result})
 
         base_url = f"{self.request.protocol}://{self.request.host}{self.request.path}/"
+        etag = build_etag(base_url, ldap_result)
+        if self._is_not_modified(etag):
+            return
+
         full_url = unquote(self.request.full_url())
 
         devices = [build_device_resource(ldap_attributes) for ldap_attributes in ldap_result]
 
         bundle = build_bundle_resource(devices, base_url, full_url)
 
-        self.write(json.dumps(bundle, indent=2, sort_keys=False))
-        self.set_header(HttpHeaders.CONTENT_TYPE, accept_type)
-        self.set_header(HttpHeaders.X_CORRELATION_ID, mdc.correlation_id.get())
+        self._write_bundle(bundle, accept_type, cache_key, etag)
 
     def _validate_query_params(self):
         query_params = self.request.arguments
         for query_param in query_params.keys():
-            if query_param not in [ORG_CODE_QUERY_PARAMETER_NAME, IDENTIFIER_QUERY_PARAMETER_NAME, MANUFACTURING_ORGANIZATION_QUERY_PARAMETER_NAME]:
+            if query_param not in [ORG_CODE_QUERY_PARAMETER_NAME, IDENTIFIER_QUERY_PARAMETER_NAME,
+                                   MANUFACTURING_ORGANIZATION_QUERY_PARAMETER_NAME, PRETTY_QUERY_PARAMETER_NAME]:
                 raise tornado.web.HTTPError(
                     status_code=400,
                     log_message=f"Illegal query parameter '{query_param}'")
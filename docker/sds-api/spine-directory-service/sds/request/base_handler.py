@@ -1,13 +1,21 @@
-from typing import Optional
+import hashlib
+import json
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+from urllib.parse import unquote
 
 import tornado.web
 
+from lookup.sds_caching_client import stale_result_age
 from lookup.sds_client import SDSClient
-from utilities import mdc, message_utilities
+from request.http_headers import HttpHeaders
+from request.response_cache import ResponseCache
+from utilities import json_serializer, mdc, message_utilities
+from utilities.string_utilities import str2bool
 
 ORG_CODE_QUERY_PARAMETER_NAME = "organization"
 IDENTIFIER_QUERY_PARAMETER_NAME = "identifier"
 MANUFACTURING_ORGANIZATION_QUERY_PARAMETER_NAME = "manufacturing-organization"
+PRETTY_QUERY_PARAMETER_NAME = "_pretty"
 
 ORG_CODE_FHIR_IDENTIFIER = "https://fhir.nhs.uk/Id/ods-organization-code"
 SERVICE_ID_FHIR_IDENTIFIER = "https://fhir.nhs.uk/Id/nhsServiceInteractionId"
@@ -15,19 +23,34 @@ PARTY_KEY_FHIR_IDENTIFIER = "https://fhir.nhs.uk/Id/nhsMhsPartyKey"
 MANUFACTURING_ORGANIZATION_FHIR_IDENTIFIER = "https://fhir.nhs.uk/Id/ods-organization-code"
 CPM_FILTER = "use_cpm"
 CPM_FILTER_IDENTIFIER = "iwanttogetdatafromcpm"
+STALE_RESPONSE_WARNING = '110 - "Response is Stale"'
+
+
+def build_etag(base_url: str, results: List[Mapping]) -> str:
+    """
+    Build a weak entity tag from the LDAP (or CPM) results a response is built from, so a client can be told its copy is
+    still current without the response being built. It is weak as the bundle built from the same results is equivalent
+    but not identical each time, e.g. its id differs.
+    """
+    canonical = json.dumps([base_url, [dict(result) for result in results]], sort_keys=True, default=str,
+                           separators=(',', ':'))
+    return f'W/"{hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()}"'
 
 
 class BaseHandler(tornado.web.RequestHandler):
     """A base handler for spine route lookup"""
     sds_client: SDSClient
+    response_cache: Optional[ResponseCache]
 
-    def initialize(self, sds_client: SDSClient) -> None:
+    def initialize(self, sds_client: SDSClient, response_cache: Optional[ResponseCache] = None) -> None:
         """Initialise this request handler with the provided configuration values.
 
         :param sds_client: The sds client component to use to look up values in SDS.
+        :param response_cache: The cache of serialized responses, or None if responses are not cached.
         """
         mdc.trace_id.set(message_utilities.get_uuid())
         self.sds_client = sds_client
+        self.response_cache = response_cache
 
     def prepare(self):
         if self.request.method != "GET":
@@ -42,12 +65,95 @@ class BaseHandler(tornado.web.RequestHandler):
         return value
 
     def get_optional_query_param(self, query_param_name: str, fhir_identifier: str) -> Optional[str]:
-        values = list(filter(lambda value: "|" in value and value.split("|")[0] == fhir_identifier and value[value.index("|") + 1:].strip(), self.get_query_arguments(query_param_name)))
+        return self.find_identifier_value(self.get_query_arguments(query_param_name), fhir_identifier)
+
+    @staticmethod
+    def find_identifier_value(values: List[str], fhir_identifier: str) -> Optional[str]:
+        """Return the value of the last of `values` of the form `fhir_identifier|value`, or None if there is none."""
+        values = list(filter(lambda value: "|" in value and value.split("|")[0] == fhir_identifier
+                             and value[value.index("|") + 1:].strip(), values))
 
         last_value = values and values[-1]
         result_value = (last_value and last_value[last_value.index("|") + 1:]) or None
         return result_value
 
+    def get_pretty_query_param(self) -> Optional[bool]:
+        """Whether the `_pretty` query parameter asks for an indented response, or None if it is not given."""
+        value = self.get_query_argument(PRETTY_QUERY_PARAMETER_NAME, default=None)
+        if value is None:
+            return None
+        try:
+            return str2bool(value)
+        except ValueError:
+            raise tornado.web.HTTPError(
+                status_code=400,
+                log_message=f"Invalid '{PRETTY_QUERY_PARAMETER_NAME}' query parameter. Should be "
+                            f"'{PRETTY_QUERY_PARAMETER_NAME}=true' or '{PRETTY_QUERY_PARAMETER_NAME}=false'")
+
+    def _is_pretty_print_requested(self) -> bool:
+        pretty = self.get_pretty_query_param()
+        return json_serializer.pretty_print_by_default() if pretty is None else pretty
+
+    def _response_cache_key(self, *query: Any) -> Tuple:
+        # the key is built from the parsed query rather than the URL, so the order and encoding of query parameters do
+        # not matter. The base URL is part of every entry's fullUrl so is part of the key too.
+        base_url = f"{self.request.protocol}://{self.request.host}{self.request.path}/"
+        return (base_url, self._is_pretty_print_requested(),
+                *[(value.strip() or None) if isinstance(value, str) else value for value in query])
+
+    def _write_cached_response(self, cache_key: Tuple, accept_type: str) -> bool:
+        """Write the response held in the response cache for `cache_key`, returning whether there was one."""
+        if self.response_cache is None:
+            return False
+        serialized_bundle = self.response_cache.get(cache_key)
+        if serialized_bundle is None:
+            return False
+        if serialized_bundle.etag is not None and self._is_not_modified(serialized_bundle.etag):
+            return True
+        self._write_response(serialized_bundle.render(message_utilities.get_uuid(), unquote(self.request.full_url())),
+                             accept_type)
+        return True
+
+    def _is_not_modified(self, etag: str) -> bool:
+        """
+        Set `etag` as the response's entity tag and, if the request's If-None-Match header already has it, make the
+        response a 304 Not Modified, returning whether it did. No body should then be written.
+        """
+        self.set_header(HttpHeaders.ETAG, etag)
+        if not self.check_etag_header():
+            return False
+        self.set_status(304)
+        self.set_header(HttpHeaders.X_CORRELATION_ID, mdc.correlation_id.get())
+        self._set_stale_result_headers()
+        return True
+
+    def _write_bundle(self, bundle: Dict, accept_type: str, cache_key: Tuple, etag: Optional[str] = None):
+        pretty = self._is_pretty_print_requested()
+        # empty bundles aren't cached as a timed out LDAP query looks the same, and stale results are already being
+        # refreshed by the lookup cache
+        if self.response_cache is not None and bundle["total"] and stale_result_age.get() is None:
+            serialized_bundle = self.response_cache.put(cache_key, bundle, pretty, etag)
+            serialized = serialized_bundle.render(bundle["id"], bundle["link"][0]["url"])
+        else:
+            serialized = json_serializer.dumps(bundle, pretty)
+        self._write_response(serialized, accept_type)
+
+    def _write_response(self, serialized: Union[str, bytes], accept_type: str):
+        self.write(serialized)
+        self.set_header(HttpHeaders.CONTENT_TYPE, accept_type)
+        self.set_header(HttpHeaders.X_CORRELATION_ID, mdc.correlation_id.get())
+        self._set_stale_result_headers()
+
+    @staticmethod
+    def _reset_stale_result_age():
+        stale_result_age.set(None)
+
+    def _set_stale_result_headers(self):
+        age = stale_result_age.get()
+        if age is not None:
+            self.set_header(HttpHeaders.WARNING, STALE_RESPONSE_WARNING)
+            self.set_header(HttpHeaders.AGE, str(int(age)))
+
     def _raise_invalid_query_param_error(self, query_param_name, fhir_identifier):
         raise tornado.web.HTTPError(
             status_code=400,
@@ -0,0 +1,163 @@
+"""This module contains the negotiated compression of response bodies."""
+import abc
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from tornado import httputil
+from tornado.web import OutputTransform
+
+from utilities import config
+from utilities import integration_adaptors_logger as log
+from utilities.string_utilities import str2bool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+GZIP = "gzip"
+BROTLI = "br"
+
+COMPRESSIBLE_CONTENT_TYPES = {"application/fhir+json", "application/json"}
+
+
+class Compressor(abc.ABC):
+    """Compresses a response body written in one or more chunks."""
+
+    @abc.abstractmethod
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        """Compress the next chunk of the body, flushed so it can be sent, finishing the stream if `finishing`."""
+        pass
+
+
+class GzipCompressor(Compressor):
+
+    def __init__(self, level: int):
+        # a wbits of 31 makes zlib write a gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        flush_mode = zlib.Z_FINISH if finishing else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(chunk) + self._compressor.flush(flush_mode)
+
+
+class BrotliCompressor(Compressor):
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        compressed = self._compressor.process(chunk)
+        return compressed + (self._compressor.finish() if finishing else self._compressor.flush())
+
+
+# the encodings available, most preferred first, with the range of levels each accepts
+ENCODINGS: Dict[str, Tuple[Callable[[int], Compressor], range]] = {}
+if brotli is not None:
+    ENCODINGS[BROTLI] = (BrotliCompressor, range(0, 12))
+ENCODINGS[GZIP] = (GzipCompressor, range(1, 10))
+
+
+def create_compressor(encoding: str, level: int) -> Compressor:
+    create, levels = ENCODINGS[encoding]
+    if level not in levels:
+        raise ValueError(f"{encoding} compression level must be between {levels.start} and {levels.stop - 1}")
+    return create(level)
+
+
+def negotiate_encoding(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """
+    Choose the encoding the client weights highest in its Accept-Encoding header from `encodings`, which are in order
+    of preference for when the client weights several equally. Returns None if the client accepts none of them.
+    """
+    weights = {}
+    for accepted in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in accepted.split(";")]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.lower()] = weight
+
+    chosen, chosen_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > chosen_weight:
+            chosen, chosen_weight = encoding, weight
+    return chosen
+
+
+class CompressionTransform(OutputTransform):
+    """
+    Compresses JSON and text responses of at least `min_length` bytes with Brotli (when installed) or gzip, whichever
+    the client prefers. Unlike Tornado's own `GZipContentEncoding` it recognises FHIR JSON and its levels are
+    configurable.
+    """
+    min_length = 1024
+    levels = {BROTLI: 4, GZIP: 6}
+
+    def __init__(self, request: httputil.HTTPServerRequest) -> None:
+        self._encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""), list(ENCODINGS))
+        self._compressor: Optional[Compressor] = None
+
+    def transform_first_chunk(self, status_code: int, headers: httputil.HTTPHeaders, chunk: bytes,
+                              finishing: bool) -> Tuple[int, httputil.HTTPHeaders, bytes]:
+        # the body differs by Accept-Encoding whether or not this response is compressed
+        if "Vary" in headers:
+            headers["Vary"] += ", Accept-Encoding"
+        else:
+            headers["Vary"] = "Accept-Encoding"
+
+        content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if self._encoding is not None \
+                and (content_type in COMPRESSIBLE_CONTENT_TYPES or content_type.startswith("text/")) \
+                and "Content-Encoding" not in headers \
+                and (not finishing or len(chunk) >= self.min_length):
+            headers["Content-Encoding"] = self._encoding
+            self._compressor = create_compressor(self._encoding, self.levels[self._encoding])
+            chunk = self.transform_chunk(chunk, finishing)
+            if "Content-Length" in headers:
+                if finishing:
+                    headers["Content-Length"] = str(len(chunk))
+                else:
+                    del headers["Content-Length"]
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk: bytes, finishing: bool) -> bytes:
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk, finishing)
+        return chunk
+
+
+def create_compression_transform() -> Optional[Type[CompressionTransform]]:
+    """
+    Create the transform compressing responses from the `RESPONSE_COMPRESSION_*` config values, or return None if
+    responses are not to be compressed.
+    """
+    if not str2bool(config.get_config('RESPONSE_COMPRESSION_ENABLED', default=str(True))):
+        return None
+
+    configured_min_length = int(config.get_config('RESPONSE_COMPRESSION_MIN_LENGTH', default='1024'))
+    configured_levels = {
+        GZIP: int(config.get_config('RESPONSE_COMPRESSION_GZIP_LEVEL', default='6')),
+        BROTLI: int(config.get_config('RESPONSE_COMPRESSION_BROTLI_QUALITY', default='4'))
+    }
+    for encoding in ENCODINGS:
+        # fail at startup rather than on the first compressed response
+        create_compressor(encoding, configured_levels[encoding])
+
+    class ConfiguredCompressionTransform(CompressionTransform):
+        min_length = configured_min_length
+        levels = configured_levels
+
+    logger.info("Compressing responses of at least {min_length} bytes with {encodings} at {levels}",
+                fparams={"min_length": configured_min_length, "encodings": list(ENCODINGS),
+                         "levels": configured_levels})
+    return ConfiguredCompressionTransform
@@ -1,9 +1,13 @@
+import asyncio
 import os
 import copy
-import requests
+import json
+from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httputil import url_concat
 from tornado.web import RequestHandler
 
-from typing import List, Dict
+from typing import List, Dict, Optional
+from lookup.intermediary_address_cache import IntermediaryAddressCache, create_intermediary_address_cache
 from lookup.sds_exception import SDSException
 from request.base_handler import CPM_FILTER, CPM_FILTER_IDENTIFIER, ORG_CODE_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
     IDENTIFIER_QUERY_PARAMETER_NAME, SERVICE_ID_FHIR_IDENTIFIER, PARTY_KEY_FHIR_IDENTIFIER
@@ -14,6 +18,10 @@ from utilities import integration_adaptors_logger as log
 
 logger = log.IntegrationAdaptorsLogger(__name__)
 
+_http_client_configured = False
+
+_intermediary_address_cache: Optional[IntermediaryAddressCache] = None
+
 
 def should_use_cpm(handler: RequestHandler) -> bool:
     try: 
@@ -55,20 +63,46 @@ async def get_endpoint_from_cpm(tracking_id_headers: dict, **query_parts) -> Lis
 
 async def set_mhs_endpoint(ldap_results: list, tracking_id_headers: dict):
     if ldap_results:
+        core_spine_interactions: Dict[int, str] = {}
         for key, ldap_result in enumerate(ldap_results):
             service, interaction = _extract_service_and_interaction(ldap_result['nhsMhsSvcIA'])
             if service in RELIABLE_SERVICES:
-                address: Optional[str] = None
                 for core_spine_interaction, interactions in INTERACTION_MAPPINGS.items():
                     if interaction in interactions:
-                        address = await _get_address(core_spine_interaction, tracking_id_headers)
+                        core_spine_interactions[key] = core_spine_interaction
                         break
 
-                if address:
-                    ldap_results[key]['nhsMHSEndPoint'] = address
+        # each distinct core spine interaction is resolved once, all of them concurrently
+        distinct_interactions = sorted(set(core_spine_interactions.values()))
+        addresses = await asyncio.gather(*[_get_forward_address(core_spine_interaction, tracking_id_headers)
+                                           for core_spine_interaction in distinct_interactions])
+        addresses_by_interaction = dict(zip(distinct_interactions, addresses))
+
+        for key, core_spine_interaction in core_spine_interactions.items():
+            address = addresses_by_interaction[core_spine_interaction]
+            if address:
+                ldap_results[key]['nhsMHSEndPoint'] = [address]
 
     return ldap_results
 
+
+def get_intermediary_address_cache() -> IntermediaryAddressCache:
+    """Returns the process-wide cache of forward reliable/express addresses looked up from CPM."""
+    global _intermediary_address_cache
+    if _intermediary_address_cache is None:
+        _intermediary_address_cache = create_intermediary_address_cache(_resolve_address)
+    return _intermediary_address_cache
+
+
+async def _get_forward_address(service_id: str, tracking_id_headers: dict) -> Optional[str]:
+    return await get_intermediary_address_cache().get(service_id, tracking_id_headers)
+
+
+async def _resolve_address(service_id: str, tracking_id_headers: Optional[dict] = None) -> Optional[str]:
+    addresses = await _get_address(service_id, tracking_id_headers or {})
+    return addresses[0] if addresses else None
+
+
 def _extract_service_and_interaction(service_interaction: str):
     if not service_interaction:
         return False
@@ -128,14 +162,42 @@ def process_cpm_device_request(data: dict):
     ldap_converted = devices.transform_to_ldap()
     return ldap_converted
 
-def make_get_request(call_name: str, url, headers=None, params=None):
-    res = requests.get(url, params=params, headers=headers)
+
+def get_http_client() -> AsyncHTTPClient:
+    """
+    Returns the HTTP client shared by every CPM request made on the current IOLoop. The curl based client, which keeps
+    connections (and their TLS sessions) alive between requests, is used when pycurl is installed.
+    """
+    global _http_client_configured
+    if not _http_client_configured:
+        max_clients = int(config.get_config('CPM_MAX_CONNECTIONS', default='10'))
+        try:
+            import pycurl  # noqa: F401
+            implementation = "tornado.curl_httpclient.CurlAsyncHTTPClient"
+        except ImportError:
+            implementation = None
+        logger.info("Configuring CPM HTTP client {implementation} {max_clients}",
+                    fparams={"implementation": implementation or "simple", "max_clients": max_clients})
+        AsyncHTTPClient.configure(implementation, max_clients=max_clients)
+        _http_client_configured = True
+    return AsyncHTTPClient()
+
+
+async def make_get_request(call_name: str, url, headers=None, params=None) -> HTTPResponse:
+    res = await get_http_client().fetch(
+        url_concat(url, params),
+        headers=headers,
+        connect_timeout=float(config.get_config('CPM_CONNECT_TIMEOUT_IN_SECONDS', default='5')),
+        request_timeout=float(config.get_config('CPM_REQUEST_TIMEOUT_IN_SECONDS', default='20')),
+        raise_error=False)
     handle_error(res, call_name)
     return res
 
-def handle_error(response, call_name):
-    if response.status_code != 200:
-        detail = f"Request to {call_name} failed with status code: {response.status_code} and message: {response.text}"
+
+def handle_error(response: HTTPResponse, call_name):
+    if response.code != 200:
+        message = response.body.decode() if response.body else ''
+        detail = f"Request to {call_name} failed with status code: {response.code} and message: {message}"
         logger.info(detail)
         raise SDSException(detail)
 
@@ -158,7 +220,8 @@ class CpmClient:
             **extra_headers
         }
         logger.info("Requesting data from... {url}/{endpoint}", fparams={"url": url, "endpoint": search_endpoint,  "query_params": self._params})
-        res = make_get_request(call_name="SDS get_cpm", url=f"{url}/{search_endpoint}", headers=headers, params=self._params)
+        res = await make_get_request(call_name="SDS get_cpm", url=f"{url}/{search_endpoint}", headers=headers,
+                                     params=self._params)
         return self._get_response(res=res)
 
     def _set_params(self, query_params: Dict[str, str]) -> Dict[str, str]:
@@ -166,7 +229,7 @@ class CpmClient:
         return params
 
     def _get_response(self, res):
-        return res.json()
+        return json.loads(res.body)
 
 class DeviceCpmClient(CpmClient):
     FILTER_MAP = FILTER_MAP_DEVICE
@@ -1,16 +1,23 @@
-import json
 from enum import Enum
-from typing import Any, List
+from typing import Any, List, Optional
 
 import tornado
 
 from request import content_type_validator
+from request.base_handler import PRETTY_QUERY_PARAMETER_NAME
 from request.http_headers import HttpHeaders
 from request.tracking_ids_headers_reader import read_tracking_id_headers
-from utilities import mdc, message_utilities
+from utilities import mdc, message_utilities, json_serializer
+from utilities.executors import ExecutorSaturatedError
+from utilities.string_utilities import str2bool
+
+# the seconds clients are told to wait before retrying a request rejected because a backend is saturated
+SATURATED_RETRY_AFTER_SECONDS = 1
 
 
 class ErrorHandler(tornado.web.RequestHandler):
+    # the methods listed in the Allow header of 405 responses
+    allowed_methods = "GET"
 
     def initialize(self) -> None:
         mdc.trace_id.set(message_utilities.get_uuid())
@@ -20,6 +27,13 @@ class ErrorHandler(tornado.web.RequestHandler):
             status_code=404,
             log_message="Invalid resource path.")
 
+    def send_error(self, status_code: int = 500, **kwargs: Any) -> None:
+        exc_info = kwargs.get('exc_info')
+        if exc_info is not None and isinstance(exc_info[1], ExecutorSaturatedError):
+            # the backend is overloaded rather than broken, so the request can be retried
+            status_code = 503
+        super().send_error(status_code, **kwargs)
+
     def write_error(self, status_code: int, **kwargs: Any) -> None:
         read_tracking_id_headers(self.request.headers, raise_error=False)
 
@@ -33,7 +47,7 @@ class ErrorHandler(tornado.web.RequestHandler):
             operation_outcome = OperationOutcome([Issue(Severity.error, Code.not_found, [SpineCodings.NO_RECORD_FOUND],
                                                         diagnostics="HTTP endpoint not found")])
         elif status_code == 405:
-            additional_headers.append(("Allow", "GET"))
+            additional_headers.append(("Allow", self.allowed_methods))
             operation_outcome = OperationOutcome([Issue(Severity.error, Code.not_supported, [SpineCodings.NOT_IMPLEMENTED],
                                                         diagnostics="HTTP operation not supported")])
         elif status_code == 406:
@@ -46,6 +60,15 @@ class ErrorHandler(tornado.web.RequestHandler):
         elif status_code == 502:
             operation_outcome = OperationOutcome([Issue(Severity.error, Code.exception, [SpineCodings.INTERNAL_SERVER_ERROR],
                                                         diagnostics="Invalid LDAP response received")])
+        elif status_code == 503:
+            # a handler may send a 503 itself, without an exception
+            exc_info = kwargs.get('exc_info')
+            exception = exc_info[1] if exc_info is not None else None
+            if isinstance(exception, ExecutorSaturatedError):
+                additional_headers.append(("Retry-After", str(SATURATED_RETRY_AFTER_SECONDS)))
+            operation_outcome = OperationOutcome([Issue(Severity.error, Code.transient,
+                                                        [SpineCodings.INTERNAL_SERVER_ERROR],
+                                                        diagnostics=str(exception or "Service unavailable"))])
         elif status_code == 504:
             operation_outcome = OperationOutcome([Issue(Severity.error, Code.timeout, [SpineCodings.INTERNAL_SERVER_ERROR],
                                                         diagnostics="LDAP request timed out")])
@@ -62,13 +85,21 @@ class ErrorHandler(tornado.web.RequestHandler):
         if operation_outcome is not None:
             operation_outcome.id = str(mdc.correlation_id.get())
             content_type = content_type_validator.APPLICATION_FHIR_JSON
-            serialized = operation_outcome.to_json()
+            serialized = operation_outcome.to_json(self._get_requested_pretty_print())
             self.set_header(HttpHeaders.CONTENT_TYPE, content_type)
             [self.set_header(kv[0], kv[1]) for kv in additional_headers]
             self.write(serialized)
         else:
             super().write_error(status_code, **kwargs)
 
+    def _get_requested_pretty_print(self) -> Optional[bool]:
+        # an invalid value may be the very error being reported, so it is ignored rather than raising another error
+        value = self.get_query_argument(PRETTY_QUERY_PARAMETER_NAME, default=None)
+        try:
+            return str2bool(value) if value is not None else None
+        except ValueError:
+            return None
+
 
 class Coding:
     def __init__(self, system: str, code: str, display: str):
@@ -204,7 +235,7 @@ class OperationOutcome:
         self.id = id
         self.issues = issues
 
-    def _to_dict(self):
+    def to_dict(self):
         operation_outcome = {
             "resourceType": "OperationOutcome"
         }
@@ -213,5 +244,5 @@ class OperationOutcome:
         operation_outcome["issue"] = [issue.to_dict() for issue in self.issues]
         return operation_outcome
 
-    def to_json(self):
-        return json.dumps(self._to_dict(), indent=4)
+    def to_json(self, pretty: Optional[bool] = None):
+        return json_serializer.dumps(self.to_dict(), pretty, indent=4)
@@ -21,7 +21,7 @@ def build_bundle_resource(resources: List[Dict], base_url: str, full_url: str):
                 "url": full_url
             }
         ],
-        "entry": list(map(lambda resource: _map_resource_to_bundle_entry(resource, base_url), resources))
+        "entry": [_map_resource_to_bundle_entry(resource, base_url) for resource in resources]
     }
 
 
@@ -36,44 +36,55 @@ def _map_resource_to_bundle_entry(resource, base_url):
 
 
 def build_endpoint_resources(ldap_attributes: dict) -> List[Dict]:
-    def build_endpoint(address):
-        result = {
-            "resourceType": "Endpoint",
-            "id": str(message_utilities.get_uuid()),
-            "status": "active",
-            "connectionType": build_connection_type(),
-            "payloadType": _build_payload_type()
-        }
-        if address:
-            result["address"] = address
-
-        managing_organization = _build_managing_organization(ldap_attributes.get("nhsIDCode"))
-        if managing_organization:
-            result["managingOrganization"] = managing_organization
-
-        identifiers = _build_identifier_array(ldap_attributes)
-        identifiers = list(filter(lambda item: item, identifiers))
-        if identifiers:
-            result["identifier"] = identifiers
-
-        extensions = []
-        reliability_configuration_extensions = _build_extension_array(ldap_attributes)
-        reliability_configuration_extensions = list(filter(lambda item: item, reliability_configuration_extensions))
-        if reliability_configuration_extensions:
-            extensions.append({
-                "url": Url.EXTENSION_URL,
-                "extension": reliability_configuration_extensions
-            })
-        interaction_id = ldap_attributes.get("nhsMhsSvcIA")
-        if interaction_id:
-            extensions.append(_build_value_reference_extension(
-                Url.SDS_SERVICE_INTERACTION_ID_URL, SERVICE_ID_FHIR_IDENTIFIER, interaction_id))
-
-        if extensions:
-            result["extension"] = extensions
-
-        return result
-    return [build_endpoint(address) for address in ldap_attributes.get('nhsMHSEndPoint', [None]) or [None]]
+    # apart from its id and address every endpoint built from the same LDAP result is identical, so the rest of the
+    # resource is built once and shared between them
+    template = _build_endpoint_template(ldap_attributes)
+    return [_fill_endpoint_template(template, address)
+            for address in ldap_attributes.get('nhsMHSEndPoint', [None]) or [None]]
+
+
+def _build_endpoint_template(ldap_attributes: dict) -> Dict:
+    template = {}
+
+    managing_organization = _build_managing_organization(ldap_attributes.get("nhsIDCode"))
+    if managing_organization:
+        template["managingOrganization"] = managing_organization
+
+    identifiers = [identifier for identifier in _build_identifier_array(ldap_attributes) if identifier]
+    if identifiers:
+        template["identifier"] = identifiers
+
+    extensions = []
+    reliability_configuration_extensions = [extension for extension in _build_extension_array(ldap_attributes)
+                                            if extension]
+    if reliability_configuration_extensions:
+        extensions.append({
+            "url": Url.EXTENSION_URL,
+            "extension": reliability_configuration_extensions
+        })
+    interaction_id = ldap_attributes.get("nhsMhsSvcIA")
+    if interaction_id:
+        extensions.append(_build_value_reference_extension(
+            Url.SDS_SERVICE_INTERACTION_ID_URL, SERVICE_ID_FHIR_IDENTIFIER, interaction_id))
+
+    if extensions:
+        template["extension"] = extensions
+
+    return template
+
+
+def _fill_endpoint_template(template: Dict, address: Optional[str]) -> Dict:
+    result = {
+        "resourceType": "Endpoint",
+        "id": str(message_utilities.get_uuid()),
+        "status": "active",
+        "connectionType": _CONNECTION_TYPE,
+        "payloadType": _PAYLOAD_TYPE
+    }
+    if address:
+        result["address"] = address
+    result.update(template)
+    return result
 
 
 def build_device_resource(ldap_attributes: dict) -> Dict:
@@ -102,10 +113,9 @@ def build_device_resource(ldap_attributes: dict) -> Dict:
         extension.append(
             _build_value_reference_extension(
                 Url.MANUFACTURING_ORGANIZATION_EXTENSION_URL, Url.MANUFACTURING_ORGANIZATION_URL, manufacturing_organization))
-    service_id_extensions = map(
-        lambda v: _build_value_reference_extension(Url.SDS_SERVICE_INTERACTION_ID_URL, SERVICE_ID_FHIR_IDENTIFIER, v),
-        ldap_attributes.get('nhsAsSvcIA', [None]) or [None])
-    service_id_extensions = list(filter(lambda x: x, service_id_extensions))
+    service_id_extensions = [
+        _build_value_reference_extension(Url.SDS_SERVICE_INTERACTION_ID_URL, SERVICE_ID_FHIR_IDENTIFIER, service_id)
+        for service_id in ldap_attributes.get('nhsAsSvcIA', [None]) or [None] if service_id]
     if service_id_extensions:
         extension += service_id_extensions
     if extension:
@@ -218,3 +228,9 @@ def _build_payload_type():
 
 def _build_address(value: str):
     return "https://{}/".format(value)
+
+
+# the parts of every endpoint which never change are built once, and shared between all of the resources built. They
+# must not be modified.
+_CONNECTION_TYPE = build_connection_type()
+_PAYLOAD_TYPE = _build_payload_type()
@@ -0,0 +1,148 @@
+"""Stops the server on SIGTERM or SIGINT once the requests it is handling have finished."""
+import asyncio
+import datetime
+import signal
+from typing import Optional
+
+import tornado.httpserver
+import tornado.httputil
+import tornado.ioloop
+import tornado.locks
+import tornado.util
+
+from utilities import integration_adaptors_logger as log
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+
+class InFlightRequests(tornado.httputil.HTTPServerConnectionDelegate):
+    """Wraps the application served by an `HTTPServer`, counting the requests it is handling."""
+
+    def __init__(self, application: tornado.httputil.HTTPServerConnectionDelegate):
+        self.application = application
+        self.count = 0
+        self._idle = tornado.locks.Event()
+        self._idle.set()
+
+    def start_request(self, server_conn: object,
+                      request_conn: tornado.httputil.HTTPConnection) -> tornado.httputil.HTTPMessageDelegate:
+        connection = _CountedConnection(self, request_conn)
+        return _CountedRequest(connection, self.application.start_request(server_conn, connection))
+
+    def on_close(self, server_conn: object):
+        self.application.on_close(server_conn)
+
+    async def wait_until_idle(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for every request to finish, returning whether they have."""
+        try:
+            await self._idle.wait(timeout=datetime.timedelta(seconds=timeout))
+            return True
+        except tornado.util.TimeoutError:
+            return False
+
+    def _started(self):
+        self.count += 1
+        self._idle.clear()
+
+    def _finished(self):
+        self.count -= 1
+        if self.count == 0:
+            self._idle.set()
+
+
+class _CountedConnection(tornado.httputil.HTTPConnection):
+    """Stands in for a request's connection, counting the request until its response is finished."""
+
+    def __init__(self, in_flight: InFlightRequests, request_conn: tornado.httputil.HTTPConnection):
+        self.in_flight = in_flight
+        self.request_conn = request_conn
+        self._counted = False
+
+    def __getattr__(self, name: str):
+        # the rest of the connection (e.g. `context` and `set_close_callback`) is used by the application as it is
+        return getattr(self.request_conn, name)
+
+    def write_headers(self, start_line, headers, chunk=None):
+        return self.request_conn.write_headers(start_line, headers, chunk)
+
+    def write(self, chunk: bytes):
+        return self.request_conn.write(chunk)
+
+    def finish(self):
+        try:
+            self.request_conn.finish()
+        finally:
+            self.stop_counting()
+
+    def start_counting(self):
+        self._counted = True
+        self.in_flight._started()
+
+    def stop_counting(self):
+        if self._counted:
+            self._counted = False
+            self.in_flight._finished()
+
+
+class _CountedRequest(tornado.httputil.HTTPMessageDelegate):
+    """Passes a request on to the application, counting it from when it arrives."""
+
+    def __init__(self, connection: _CountedConnection, delegate: tornado.httputil.HTTPMessageDelegate):
+        self.connection = connection
+        self.delegate = delegate
+
+    def headers_received(self, start_line, headers):
+        # a kept alive connection starts its next request before it arrives, so only requests being read are counted
+        self.connection.start_counting()
+        return self.delegate.headers_received(start_line, headers)
+
+    def data_received(self, chunk: bytes):
+        return self.delegate.data_received(chunk)
+
+    def finish(self):
+        self.delegate.finish()
+
+    def on_connection_close(self):
+        self.connection.stop_counting()
+        self.delegate.on_connection_close()
+
+
+class GracefulShutdown(object):
+    """
+    On SIGTERM or SIGINT, stops the server accepting connections, waits up to `timeout` seconds for the requests it is
+    handling to finish and then stops the IOLoop. A second signal stops the IOLoop straight away.
+    """
+
+    def __init__(self, server: tornado.httpserver.HTTPServer, in_flight: InFlightRequests, timeout: float):
+        """
+        :param server: The server to stop.
+        :param in_flight: The requests being handled by `server`.
+        :param timeout: The number of seconds to wait for requests to finish before stopping anyway.
+        """
+        self.server = server
+        self.in_flight = in_flight
+        self.timeout = timeout
+        self._shutdown: Optional[asyncio.Future] = None
+
+    def install(self):
+        io_loop = tornado.ioloop.IOLoop.current()
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            io_loop.asyncio_loop.add_signal_handler(signum, self.begin, signum)
+
+    def begin(self, signum: int = signal.SIGTERM):
+        if self._shutdown is not None:
+            logger.warning('Stopping without waiting for requests on second signal {signum}',
+                           fparams={'signum': signum})
+            tornado.ioloop.IOLoop.current().stop()
+            return
+        self._shutdown = asyncio.ensure_future(self.shut_down(signum))
+        self._shutdown.add_done_callback(lambda _: tornado.ioloop.IOLoop.current().stop())
+
+    async def shut_down(self, signum: int = signal.SIGTERM):
+        """Stop the server accepting connections and wait for the requests it is handling to finish."""
+        logger.info('Shutting down on signal {signum}, waiting for {requests} requests to finish',
+                    fparams={'signum': signum, 'requests': self.in_flight.count})
+        self.server.stop()
+        if not await self.in_flight.wait_until_idle(self.timeout):
+            logger.warning('{requests} requests had not finished after {timeout} seconds, stopping anyway',
+                           fparams={'requests': self.in_flight.count, 'timeout': self.timeout})
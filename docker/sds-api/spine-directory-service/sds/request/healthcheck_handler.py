@@ -1,7 +1,8 @@
 import json
+from typing import Callable, Optional
 
 import tornado.web
-from lookup.sds_client_factory import get_sds_client
+from lookup.sds_client import SDSClient
 from request.http_headers import HttpHeaders
 from utilities import config
 
@@ -16,20 +17,30 @@ class HealthcheckHandler(tornado.web.RequestHandler):
     application is running ie for load balancers to do healthchecks.
     """
 
+    def initialize(self, is_ready: Optional[Callable[[], bool]] = None) -> None:
+        """
+        :param is_ready: Returns whether the application is ready to serve requests (e.g. has finished warming up its
+        cache), or None if it is ready as soon as it is running.
+        """
+        self.is_ready = is_ready
+
     async def get(self):
         """
         ---
         summary: Healthcheck endpoint
         description: >-
-          This endpoint just returns a HTTP 200 response and does no further processing. This endpoint
-          is intended to be used by load balancers/other infrastructure to check that the server is
-          running.
+          This endpoint just returns a HTTP 200 response once the server is ready (i.e. has finished
+          warming up its cache) and a HTTP 503 response before then. It does no further processing. This
+          endpoint is intended to be used by load balancers/other infrastructure to check that the
+          server is running.
         operationId: getHealthcheck
         responses:
           200:
-            description: The only response this endpoint returns.
+            description: The server is ready.
+          503:
+            description: The server is still warming up.
         """
-        self.set_status(200)
+        self.set_status(200 if self.is_ready is None or self.is_ready() else 503)
 
 
 class DeepHealthcheckHandler(tornado.web.RequestHandler):
@@ -39,6 +50,13 @@ class DeepHealthcheckHandler(tornado.web.RequestHandler):
     application is running and is able to serve data.
     """
 
+    def initialize(self, sds_client: SDSClient) -> None:
+        """
+        :param sds_client: The LDAP backed sds client the application serves requests with, whose LDAP connection is
+        checked. It must not answer lookups from a snapshot or cache, which would hide LDAP being down.
+        """
+        self.sds_client = sds_client
+
     async def get(self):
         """
         ---
@@ -56,7 +74,7 @@ class DeepHealthcheckHandler(tornado.web.RequestHandler):
         status = FAIL
         output = None
         try:
-            await get_sds_client().get_mhs_details('TEST', 'TEST', 'TEST')
+            await self.sds_client.get_mhs_details('TEST', 'TEST', 'TEST')
             status = PASS
         except Exception as ex:
             output = str(ex)
@@ -3,4 +3,7 @@ class HttpHeaders:
     X_REQUEST_ID = "X-Request-ID"
     CONTENT_TYPE = "Content-Type"
     ACCEPT = 'Accept'
-
+    WARNING = 'Warning'
+    AGE = 'Age'
+    ETAG = 'ETag'
+    IF_NONE_MATCH = 'If-None-Match'
@@ -0,0 +1,105 @@
+"""This module contains a cache of serialized FHIR bundles, keyed by the query they were built for."""
+import json
+import re
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from utilities import config, json_serializer
+from utilities import integration_adaptors_logger as log
+from utilities.ttl_cache import TTLCache
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+# placeholders serialized in place of the values which differ between responses to the same query
+_BUNDLE_ID_SLOT = "urn:sds:response-cache:bundle-id"
+_SELF_URL_SLOT = "urn:sds:response-cache:self-url"
+_SLOT_PATTERN = re.compile(f'"({re.escape(_BUNDLE_ID_SLOT)}|{re.escape(_SELF_URL_SLOT)})"'.encode())
+
+
+class SerializedBundle(object):
+    """
+    A bundle serialized to JSON once, with its id and `self` link left as slots which are filled in for each response.
+    Everything else, including the id of every entry, is served exactly as it was first serialized.
+    """
+
+    def __init__(self, bundle: Dict, pretty: bool, etag: Optional[str] = None):
+        """
+        :param bundle: The bundle, as built by `fhir_json_mapper.build_bundle_resource`.
+        :param pretty: Whether the bundle is indented.
+        :param etag: The entity tag of the results the bundle was built from, if known.
+        """
+        self.etag = etag
+        slotted_bundle = {
+            **bundle,
+            "id": _BUNDLE_ID_SLOT,
+            "link": [{**link, "url": _SELF_URL_SLOT} if link.get("relation") == "self" else link
+                     for link in bundle["link"]]
+        }
+        serialized = json_serializer.dumps(slotted_bundle, pretty)
+        if isinstance(serialized, str):
+            serialized = serialized.encode()
+
+        self._parts: List[bytes] = []
+        self._slots: List[str] = []
+        position = 0
+        for match in _SLOT_PATTERN.finditer(serialized):
+            self._parts.append(serialized[position:match.start()])
+            self._slots.append(match.group(1).decode())
+            position = match.end()
+        self._parts.append(serialized[position:])
+
+    def render(self, bundle_id: str, self_url: str) -> bytes:
+        """Return the serialized bundle with the given id and `self` link."""
+        values = {
+            _BUNDLE_ID_SLOT: json.dumps(bundle_id).encode(),
+            _SELF_URL_SLOT: json.dumps(self_url).encode()
+        }
+        rendered = [self._parts[0]]
+        for slot, part in zip(self._slots, self._parts[1:]):
+            rendered.append(values[slot])
+            rendered.append(part)
+        return b"".join(rendered)
+
+
+class ResponseCache(object):
+    """
+    Holds the serialized bundle returned for each distinct query for `ttl` seconds, so a repeated query is answered
+    without looking anything up, mapping the results to FHIR resources or serializing them again. Each response still
+    gets a new bundle id and a `self` link to the URL actually requested.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        """
+        :param ttl: The number of seconds a serialized bundle is served for.
+        :param max_entries: The maximum number of serialized bundles held before the least recently used is evicted.
+        :param clock: A monotonic clock returning seconds, overridable for testing.
+        """
+        self.cache = TTLCache(ttl, max_entries, clock)
+
+    def get(self, key: Hashable) -> Optional[SerializedBundle]:
+        """Return the serialized bundle held for `key`, if there is one."""
+        serialized_bundle = self.cache.get(key)
+        if serialized_bundle is not None:
+            logger.info("Serving response from cache for {key}", fparams={"key": key})
+        return serialized_bundle
+
+    def put(self, key: Hashable, bundle: Dict, pretty: bool, etag: Optional[str] = None) -> SerializedBundle:
+        """Serialize `bundle` and hold it against `key`."""
+        serialized_bundle = SerializedBundle(bundle, pretty, etag)
+        self.cache.put(key, serialized_bundle)
+        return serialized_bundle
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def create_response_cache() -> Optional[ResponseCache]:
+    """Create the response cache from the `RESPONSE_CACHE_*` config values, or return None if it is disabled."""
+    ttl = float(config.get_config('RESPONSE_CACHE_TTL_IN_SECONDS', default='0'))
+    if ttl <= 0:
+        return None
+
+    max_entries = int(config.get_config('RESPONSE_CACHE_MAX_ENTRIES', default='10000'))
+    logger.info("Caching serialized responses for {ttl} seconds in up to {max_entries} entries",
+                fparams={"ttl": ttl, "max_entries": max_entries})
+    return ResponseCache(ttl, max_entries)
@@ -0,0 +1,193 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import tornado.web
+
+from lookup.intermediary_address_cache import IntermediaryAddressCache
+from lookup.sds_client import SDSClient
+from request.base_handler import ORG_CODE_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
+    IDENTIFIER_QUERY_PARAMETER_NAME, SERVICE_ID_FHIR_IDENTIFIER, PARTY_KEY_FHIR_IDENTIFIER, PRETTY_QUERY_PARAMETER_NAME
+from request.content_type_validator import get_valid_accept_type
+from request.cpm import should_use_cpm
+from request.error_handler import Code, Issue, OperationOutcome, Severity, SpineCodings
+from request.response_cache import ResponseCache
+from request.routing_reliability_handler import RoutingReliabilityRequestHandler
+from request.tracking_ids_headers_reader import read_tracking_id_headers
+from utilities import timing, integration_adaptors_logger as log, json_serializer, message_utilities
+from utilities.executors import ExecutorSaturatedError
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+BATCH_PATH_SUFFIX = "/_batch"
+
+# the org code, service id and party key of an Endpoint search
+Query = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class RoutingReliabilityBatchRequestHandler(RoutingReliabilityRequestHandler):
+    """
+    A handler for FHIR batch Bundles of requests to obtain combined routing and reliability information. Each entry of
+    the batch is an `/Endpoint` search and the response holds the searchset Bundle for each, in the same order, so many
+    recipients can be routed in one HTTP request. Identical searches are only looked up once and the rest are combined
+    into as few LDAP searches as possible, or looked up concurrently in CPM.
+    """
+    allowed_methods = "POST"
+    max_entries: int
+
+    def initialize(self, sds_client: SDSClient, intermediary_address_cache: IntermediaryAddressCache,
+                   response_cache: Optional[ResponseCache] = None, max_entries: int = 100) -> None:
+        """Initialise this request handler with the provided configuration values.
+
+        :param sds_client: The sds client component to use to look up values in SDS.
+        :param intermediary_address_cache: The cache of Spine core forward reliable/express addresses.
+        :param response_cache: Unused, batch responses are not cached.
+        :param max_entries: The maximum number of searches allowed in one batch.
+        """
+        super().initialize(sds_client, intermediary_address_cache, response_cache)
+        self.max_entries = max_entries
+
+    def prepare(self):
+        if self.request.method != "POST":
+            raise tornado.web.HTTPError(
+                status_code=405,
+                log_message="Method not allowed.")
+
+    @timing.time_request
+    async def post(self):
+        self._reset_stale_result_age()
+        tracking_id_headers = read_tracking_id_headers(self.request.headers)
+
+        for query_param in self.request.query_arguments:
+            if query_param != PRETTY_QUERY_PARAMETER_NAME:
+                raise tornado.web.HTTPError(
+                    status_code=400,
+                    log_message=f"Illegal query parameter '{query_param}'")
+        pretty = self._is_pretty_print_requested()
+        accept_type = get_valid_accept_type(self.request.headers)
+        use_cpm = should_use_cpm(handler=self)
+
+        search_urls = self._read_search_urls()
+        queries = [self._parse_search(search_url) for search_url in search_urls]
+
+        distinct_queries = list(dict.fromkeys(query for query in queries if isinstance(query, tuple)))
+        logger.info("Looking up {lookups} distinct searches for a batch of {searches}",
+                    fparams={"lookups": len(distinct_queries), "searches": len(queries)})
+        if use_cpm:
+            lookups = await asyncio.gather(
+                *[self._look_up_endpoints(*query, use_cpm=use_cpm, tracking_id_headers=tracking_id_headers)
+                  for query in distinct_queries],
+                return_exceptions=True)
+        else:
+            lookups = await self._look_up_endpoints_in_ldap(distinct_queries)
+        results: Dict[Query, Union[List[dict], Exception]] = dict(zip(distinct_queries, lookups))
+
+        endpoint_path = self.request.path[:-len(BATCH_PATH_SUFFIX)]
+        base_url = f"{self.request.protocol}://{self.request.host}{endpoint_path}/"
+        entries = []
+        for search_url, query in zip(search_urls, queries):
+            if not isinstance(query, tuple):
+                entries.append(_build_error_entry("400 Bad Request", Code.required, SpineCodings.BAD_REQUEST, query))
+                continue
+
+            result = results[query]
+            if isinstance(result, ExecutorSaturatedError):
+                logger.warning("Batch search {search_url} rejected as a backend is saturated",
+                               fparams={"search_url": search_url})
+                entries.append(_build_error_entry("503 Service Unavailable", Code.transient,
+                                                  SpineCodings.INTERNAL_SERVER_ERROR, str(result)))
+                continue
+            if isinstance(result, Exception):
+                logger.error("Batch search {search_url} failed", fparams={"search_url": search_url}, exc_info=result)
+                entries.append(_build_error_entry("500 Internal Server Error", Code.exception,
+                                                  SpineCodings.INTERNAL_SERVER_ERROR, str(result)))
+                continue
+
+            search_query = unquote(urlsplit(search_url).query)
+            full_url = f"{self.request.protocol}://{self.request.host}{endpoint_path}?{search_query}"
+            entries.append({
+                "resource": self._build_endpoint_bundle(result, base_url, full_url),
+                "response": {"status": "200 OK"}
+            })
+
+        batch_response = {
+            "resourceType": "Bundle",
+            "id": message_utilities.get_uuid(),
+            "type": "batch-response",
+            "entry": entries
+        }
+        self._write_response(json_serializer.dumps(batch_response, pretty), accept_type)
+
+    async def _look_up_endpoints_in_ldap(self, queries: List[Query]) -> List[Union[List[dict], Exception]]:
+        """Look up `queries` in SDS together, combining them into as few LDAP searches as possible."""
+        try:
+            ldap_results = await self.sds_client.get_mhs_details_batch(queries)
+        except Exception as e:
+            return [e] * len(queries)
+
+        async def handle_forward_reliable_results(query_ldap_results: List[dict]) -> List[dict]:
+            await self._handle_forward_reliable_results(query_ldap_results)
+            return query_ldap_results
+
+        return await asyncio.gather(*[handle_forward_reliable_results(query_ldap_results)
+                                      for query_ldap_results in ldap_results], return_exceptions=True)
+
+    def _read_search_urls(self) -> List[str]:
+        try:
+            batch = json.loads(self.request.body)
+        except ValueError:
+            self._raise_invalid_batch_error("Request body is not valid JSON")
+
+        if not isinstance(batch, dict) or batch.get("resourceType") != "Bundle" or batch.get("type") != "batch":
+            self._raise_invalid_batch_error("Request body should be a Bundle of type 'batch'")
+
+        entries = batch.get("entry", [])
+        if not isinstance(entries, list) or len(entries) > self.max_entries:
+            self._raise_invalid_batch_error(f"Batch should have a list of at most {self.max_entries} entries")
+
+        search_urls = []
+        for entry in entries:
+            request = entry.get("request") if isinstance(entry, dict) else None
+            if not isinstance(request, dict) or request.get("method") != "GET" \
+                    or not isinstance(request.get("url"), str):
+                self._raise_invalid_batch_error("Every batch entry should have a request with method 'GET' and a url")
+            search_urls.append(request["url"])
+        return search_urls
+
+    def _parse_search(self, search_url: str):
+        """Return the query of `search_url`, or the reason it is invalid."""
+        url = urlsplit(search_url)
+        if url.path.strip("/").split("/")[-1].lower() != "endpoint":
+            return f"Only Endpoint searches are supported in a batch, not '{search_url}'"
+
+        query_params = parse_qs(url.query, keep_blank_values=True)
+        try:
+            self._validate_query_params({name: [value.encode() for value in values]
+                                         for name, values in query_params.items()})
+            identifiers = query_params.get(IDENTIFIER_QUERY_PARAMETER_NAME, [])
+            org_code = self.find_identifier_value(query_params.get(ORG_CODE_QUERY_PARAMETER_NAME, []),
+                                                  ORG_CODE_FHIR_IDENTIFIER)
+            service_id = self.find_identifier_value(identifiers, SERVICE_ID_FHIR_IDENTIFIER)
+            party_key = self.find_identifier_value(identifiers, PARTY_KEY_FHIR_IDENTIFIER)
+            if not self._is_valid_query(org_code, service_id, party_key):
+                self._raise_invalid_query_params_error()
+        except tornado.web.HTTPError as e:
+            return str(e)
+        return org_code, service_id, party_key
+
+    @staticmethod
+    def _raise_invalid_batch_error(message: str):
+        raise tornado.web.HTTPError(
+            status_code=400,
+            log_message=message)
+
+
+def _build_error_entry(status: str, code: Code, coding: SpineCodings, diagnostics: str) -> dict:
+    operation_outcome = OperationOutcome([Issue(Severity.error, code, [coding], diagnostics=diagnostics)])
+    return {
+        "response": {
+            "status": status,
+            "outcome": operation_outcome.to_dict()
+        }
+    }
@@ -1,19 +1,20 @@
-import json
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import tornado
 from urllib.parse import unquote
 
+from lookup.intermediary_address_cache import IntermediaryAddressCache
+from lookup.sds_client import SDSClient
 from request.cpm import get_endpoint_from_cpm, should_use_cpm
 from request.base_handler import BaseHandler, ORG_CODE_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
-    IDENTIFIER_QUERY_PARAMETER_NAME, SERVICE_ID_FHIR_IDENTIFIER, PARTY_KEY_FHIR_IDENTIFIER
+    IDENTIFIER_QUERY_PARAMETER_NAME, SERVICE_ID_FHIR_IDENTIFIER, PARTY_KEY_FHIR_IDENTIFIER, \
+    PRETTY_QUERY_PARAMETER_NAME, build_etag
 from request.content_type_validator import get_valid_accept_type
 from request.error_handler import ErrorHandler
 from request.fhir_json_mapper import build_endpoint_resources, build_bundle_resource
-from request.http_headers import HttpHeaders
+from request.response_cache import ResponseCache
 from request.tracking_ids_headers_reader import read_tracking_id_headers
-from utilities import timing, integration_adaptors_logger as log, mdc
-from utilities import config
+from utilities import timing, integration_adaptors_logger as log
 from utilities.constants import RELIABLE_SERVICES, FORWARD_RELIABLE_INTERACTIONS, FORWARD_EXPRESS_INTERACTIONS, FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION, FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION
 
 logger = log.IntegrationAdaptorsLogger(__name__)
@@ -21,6 +22,18 @@ logger = log.IntegrationAdaptorsLogger(__name__)
 
 class RoutingReliabilityRequestHandler(BaseHandler, ErrorHandler):
     """A handler for requests to obtain combined routing and reliability information."""
+    intermediary_address_cache: IntermediaryAddressCache
+
+    def initialize(self, sds_client: SDSClient, intermediary_address_cache: IntermediaryAddressCache,
+                   response_cache: Optional[ResponseCache] = None) -> None:
+        """Initialise this request handler with the provided configuration values.
+
+        :param sds_client: The sds client component to use to look up values in SDS.
+        :param intermediary_address_cache: The cache of Spine core forward reliable/express addresses.
+        :param response_cache: The cache of serialized responses, or None if responses are not cached.
+        """
+        super().initialize(sds_client, response_cache)
+        self.intermediary_address_cache = intermediary_address_cache
 
     def prepare(self):
         if self.request.method != "GET":
@@ -30,6 +43,7 @@ class RoutingReliabilityRequestHandler(BaseHandler, ErrorHandler):
 
     @timing.time_request
     async def get(self):
+        self._reset_stale_result_age()
         tracking_id_headers = read_tracking_id_headers(self.request.headers)
 
         self._validate_query_params()
@@ -39,11 +53,28 @@ class RoutingReliabilityRequestHandler(BaseHandler, ErrorHandler):
         party_key = self.get_optional_query_param(IDENTIFIER_QUERY_PARAMETER_NAME, PARTY_KEY_FHIR_IDENTIFIER)
         use_cpm = should_use_cpm(handler=self)
 
-        if (org_code and not service_id and not party_key) or (not org_code and (not service_id or not party_key)):
+        if not self._is_valid_query(org_code, service_id, party_key):
             self._raise_invalid_query_params_error()
 
         accept_type = get_valid_accept_type(self.request.headers)
 
+        cache_key = self._response_cache_key(org_code, service_id, party_key, use_cpm)
+        if self._write_cached_response(cache_key, accept_type):
+            return
+
+        ldap_results = await self._look_up_endpoints(org_code, service_id, party_key, use_cpm, tracking_id_headers)
+
+        base_url = f"{self.request.protocol}://{self.request.host}{self.request.path}/"
+        etag = build_etag(base_url, ldap_results)
+        if self._is_not_modified(etag):
+            return
+
+        bundle = self._build_endpoint_bundle(ldap_results, base_url, unquote(self.request.full_url()))
+
+        self._write_bundle(bundle, accept_type, cache_key, etag)
+
+    async def _look_up_endpoints(self, org_code: Optional[str], service_id: Optional[str], party_key: Optional[str],
+                                 use_cpm: bool, tracking_id_headers: dict) -> List[dict]:
         logger.info("Looking up routing and reliability information. {org_code}, {service_id}, {party_key}",
                     fparams={"org_code": org_code, "service_id": service_id, "party_key": party_key})
 
@@ -65,59 +96,29 @@ class RoutingReliabilityRequestHandler(BaseHandler, ErrorHandler):
 
             await self._handle_forward_reliable_results(ldap_results)
 
-        base_url = f"{self.request.protocol}://{self.request.host}{self.request.path}/"
-        full_url = unquote(self.request.full_url())
+        return ldap_results
 
+    @staticmethod
+    def _build_endpoint_bundle(ldap_results: List[dict], base_url: str, full_url: str) -> dict:
         endpoints = []
         for ldap_result in ldap_results:
             endpoints += build_endpoint_resources(ldap_result)
 
-        bundle = build_bundle_resource(endpoints, base_url, full_url)
-
-        self.write(json.dumps(bundle, indent=2, sort_keys=False))
-        self.set_header(HttpHeaders.CONTENT_TYPE, accept_type)
-        self.set_header(HttpHeaders.X_CORRELATION_ID, mdc.correlation_id.get())
+        return build_bundle_resource(endpoints, base_url, full_url)
 
     async def _handle_forward_reliable_results(self, ldap_results: List[dict]):
-        forward_reliable_address_cache: Optional[str] = None
-        forward_express_address_cache: Optional[str] = None
-
         for ldap_result in ldap_results:
             service, interaction = self._extract_service_and_interaction(ldap_result['nhsMhsSvcIA'])
             if service in RELIABLE_SERVICES:
                 address: Optional[str] = None
                 if interaction in FORWARD_RELIABLE_INTERACTIONS:
-                    forward_reliable_address_cache = \
-                        forward_reliable_address_cache \
-                        or await self._get_address(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
-                    address = forward_reliable_address_cache
+                    address = await self.intermediary_address_cache.get(FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
                 elif interaction in FORWARD_EXPRESS_INTERACTIONS:
-                    forward_express_address_cache = \
-                        forward_express_address_cache \
-                        or await self._get_address(FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION)
-                    address = forward_express_address_cache
+                    address = await self.intermediary_address_cache.get(FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION)
 
                 if address:
                     ldap_result['nhsMHSEndPoint'] = [address]
 
-    async def _get_address(self, service_id: str) -> str:
-        spine_core_ods_code = config.get_config('SPINE_CORE_ODS_CODE')
-        logger.info("Looking up forward reliable/express routing and reliability information. {org_code}, {service_id}",
-                    fparams={"org_code": spine_core_ods_code, "service_id": service_id})
-        ldap_results = await self.sds_client.get_mhs_details(spine_core_ods_code, service_id)
-        logger.info("Obtained forward reliable/express routing and reliability information. {ldap_results}",
-                    fparams={"ldap_results": ldap_results})
-
-        if len(ldap_results) != 1:
-            raise ValueError(f"Expected 1 result for forward reliable/express routing and reliability but got {str(len(ldap_results))}")
-
-        addresses = ldap_results[0]['nhsMHSEndPoint']
-
-        if len(addresses) != 1:
-            raise ValueError(f"Expected 1 address for forward reliable/express routing and reliability but got {str(len(addresses))}")
-
-        return addresses[0]
-
     @staticmethod
     def _extract_service_and_interaction(service_interaction: str):
         if not service_interaction:
@@ -133,10 +134,11 @@ class RoutingReliabilityRequestHandler(BaseHandler, ErrorHandler):
 
         return service_part, interaction_part
 
-    def _validate_query_params(self):
-        query_params = self.request.arguments
+    def _validate_query_params(self, query_params: Optional[Dict[str, List[bytes]]] = None):
+        query_params = self.request.arguments if query_params is None else query_params
         for query_param in query_params.keys():
-            if query_param not in [ORG_CODE_QUERY_PARAMETER_NAME, IDENTIFIER_QUERY_PARAMETER_NAME]:
+            if query_param not in [ORG_CODE_QUERY_PARAMETER_NAME, IDENTIFIER_QUERY_PARAMETER_NAME,
+                                   PRETTY_QUERY_PARAMETER_NAME]:
                 raise tornado.web.HTTPError(
                     status_code=400,
                     log_message=f"Illegal query parameter '{query_param}'")
@@ -150,6 +152,11 @@ class RoutingReliabilityRequestHandler(BaseHandler, ErrorHandler):
                         and not query_param_value.startswith(f"{PARTY_KEY_FHIR_IDENTIFIER}|"):
                     self._raise_invalid_identifier_query_param_error()
 
+    @staticmethod
+    def _is_valid_query(org_code: Optional[str], service_id: Optional[str], party_key: Optional[str]) -> bool:
+        return not ((org_code and not service_id and not party_key)
+                    or (not org_code and (not service_id or not party_key)))
+
     @staticmethod
     def _raise_invalid_query_params_error():
         org_code = f'{ORG_CODE_QUERY_PARAMETER_NAME}={ORG_CODE_FHIR_IDENTIFIER}|value'
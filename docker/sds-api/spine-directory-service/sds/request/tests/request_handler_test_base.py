@@ -9,6 +9,7 @@ from typing import Optional
 import tornado.testing
 import tornado.web
 
+from lookup.intermediary_address_cache import IntermediaryAddressCache, sds_address_resolver
 from request import routing_reliability_handler, accredited_system_handler
 from request.http_headers import HttpHeaders
 from utilities import message_utilities
@@ -32,9 +33,11 @@ class RequestHandlerTestBase(ABC, tornado.testing.AsyncHTTPTestCase):
 
     def get_app(self):
         self.sds_client = unittest.mock.Mock()
+        self.intermediary_address_cache = IntermediaryAddressCache(sds_address_resolver(self.sds_client))
 
         return tornado.web.Application([
-            (r"/endpoint", routing_reliability_handler.RoutingReliabilityRequestHandler, {"sds_client": self.sds_client}),
+            (r"/endpoint", routing_reliability_handler.RoutingReliabilityRequestHandler,
+             {"sds_client": self.sds_client, "intermediary_address_cache": self.intermediary_address_cache}),
             (r"/device", accredited_system_handler.AccreditedSystemRequestHandler, {"sds_client": self.sds_client})
         ])
 
@@ -4,7 +4,7 @@ from unittest.mock import MagicMock
 
 import tornado
 
-from request.base_handler import BaseHandler
+from request.base_handler import BaseHandler, build_etag
 
 
 SUPPORTED_IDENTIFIERS = {"fhir1", "fhir2"}
@@ -52,3 +52,10 @@ class TestBaseHandler(TestCase):
                 self.assertRaises(
                     tornado.web.HTTPError,
                     self.base_handler.get_required_query_param, "identifier", "fhir1")
+
+    def test_etag_depends_only_on_content_of_results(self):
+        etag = build_etag("http://localhost/Endpoint/", [{"a": "1", "b": ["2"]}])
+
+        self.assertEqual(etag, build_etag("http://localhost/Endpoint/", [{"b": ["2"], "a": "1"}]))
+        self.assertNotEqual(etag, build_etag("http://localhost/Endpoint/", [{"a": "1", "b": ["3"]}]))
+        self.assertNotEqual(etag, build_etag("http://other/Endpoint/", [{"a": "1", "b": ["2"]}]))
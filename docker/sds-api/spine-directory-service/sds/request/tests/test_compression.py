@@ -0,0 +1,109 @@
+import gzip
+import json
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+import tornado.testing
+import tornado.web
+
+from request import compression
+from request.compression import BROTLI, GZIP, CompressionTransform, create_compression_transform, negotiate_encoding
+
+LARGE_BODY = json.dumps({"resourceType": "Bundle", "entry": [{"url": "https://fhir.nhs.uk/StructureDefinition"}] * 100})
+
+
+class FhirJsonHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.set_header("Content-Type", "application/fhir+json")
+        self.write(LARGE_BODY if self.get_query_argument("size") == "large" else "{}")
+
+
+class TestNegotiateEncoding(TestCase):
+
+    def test_encoding_weighted_highest_by_client_is_chosen(self):
+        values = [
+            ("gzip", [BROTLI, GZIP], GZIP),
+            ("gzip, deflate, br", [BROTLI, GZIP], BROTLI),
+            ("gzip;q=1.0, br;q=0.5", [BROTLI, GZIP], GZIP),
+            ("*", [BROTLI, GZIP], BROTLI),
+            ("br;q=0, *;q=0.1", [BROTLI, GZIP], GZIP),
+            ("GZIP", [GZIP], GZIP),
+            ("gzip;q=0", [GZIP], None),
+            ("identity", [BROTLI, GZIP], None),
+            ("", [BROTLI, GZIP], None),
+        ]
+        for accept_encoding, encodings, expected in values:
+            with self.subTest(accept_encoding=accept_encoding, encodings=encodings):
+                self.assertEqual(negotiate_encoding(accept_encoding, encodings), expected)
+
+
+class TestCompressor(TestCase):
+
+    def test_compressor_without_compress_cannot_be_created(self):
+        class IncompleteCompressor(compression.Compressor):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteCompressor()
+
+
+class TestCompressionTransform(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return tornado.web.Application([(r"/", FhirJsonHandler)], transforms=[CompressionTransform])
+
+    def test_large_fhir_json_response_is_gzipped_when_accepted(self):
+        response = self.fetch("/?size=large", headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(response.headers.get("Vary"), "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.body).decode(), LARGE_BODY)
+        self.assertLess(len(response.body), len(LARGE_BODY))
+
+    def test_response_is_not_compressed_unless_accepted_and_large_enough(self):
+        for url, accept_encoding in [("/?size=large", "identity"), ("/?size=small", "gzip")]:
+            with self.subTest(url=url, accept_encoding=accept_encoding):
+                response = self.fetch(url, headers={"Accept-Encoding": accept_encoding}, decompress_response=False)
+
+                self.assertIsNone(response.headers.get("Content-Encoding"))
+                self.assertEqual(response.headers.get("Vary"), "Accept-Encoding")
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_large_fhir_json_response_is_brotli_compressed_when_preferred(self):
+        response = self.fetch("/?size=large", headers={"Accept-Encoding": "gzip, br"}, decompress_response=False)
+
+        self.assertEqual(response.headers.get("Content-Encoding"), "br")
+        self.assertEqual(compression.brotli.decompress(response.body).decode(), LARGE_BODY)
+
+
+class TestCreateCompressionTransform(TestCase):
+
+    @patch('utilities.config.get_config')
+    def test_transform_is_configured_from_config(self, mock_config):
+        config_values = {
+            'RESPONSE_COMPRESSION_ENABLED': 'True',
+            'RESPONSE_COMPRESSION_MIN_LENGTH': '100',
+            'RESPONSE_COMPRESSION_GZIP_LEVEL': '9',
+            'RESPONSE_COMPRESSION_BROTLI_QUALITY': '11'
+        }
+        mock_config.side_effect = lambda key, default=None: config_values[key]
+
+        transform = create_compression_transform()
+
+        self.assertEqual(transform.min_length, 100)
+        self.assertEqual(transform.levels, {GZIP: 9, BROTLI: 11})
+        self.assertEqual(CompressionTransform.min_length, 1024)
+
+    @patch('utilities.config.get_config')
+    def test_compression_can_be_disabled(self, mock_config):
+        mock_config.side_effect = lambda key, default=None: {'RESPONSE_COMPRESSION_ENABLED': 'False'}[key]
+
+        self.assertIsNone(create_compression_transform())
+
+    @patch('utilities.config.get_config')
+    def test_invalid_level_raises_error(self, mock_config):
+        mock_config.side_effect = lambda key, default=None: '0' if key == 'RESPONSE_COMPRESSION_GZIP_LEVEL' else default
+
+        with self.assertRaises(ValueError):
+            create_compression_transform()
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import requests
@@ -11,6 +12,10 @@ from request.cpm import EndpointCpm, process_cpm_endpoint_request, CpmClient, ge
 from request.base_handler import ORG_CODE_QUERY_PARAMETER_NAME, ORG_CODE_FHIR_IDENTIFIER, \
     IDENTIFIER_QUERY_PARAMETER_NAME, SERVICE_ID_FHIR_IDENTIFIER, PARTY_KEY_FHIR_IDENTIFIER
 from lookup.sds_exception import SDSException
+from request import cpm
+from utilities.constants import (FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION,
+                                 FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION)
+from utilities.test_utilities import async_test
 
 RETURNED_ENDPOINTS_JSON = "returned_endpoints_single.json"
 RETURNED_ENDPOINTS_MULTIPLE_JSON = "returned_endpoints_multiple.json"
@@ -341,3 +346,55 @@ class TestCPMEndpoints(TestCase):
         self.assertEqual(result, expected)
 
 
+class TestCPMForwardAddressResolution(TestCase):
+
+    def setUp(self):
+        cpm._intermediary_address_cache = None
+
+    def tearDown(self):
+        cpm._intermediary_address_cache = None
+
+    @staticmethod
+    def _result(service_interaction):
+        return {'nhsMhsSvcIA': service_interaction, 'nhsMHSEndPoint': ['https://original']}
+
+    @async_test
+    async def test_distinct_core_spine_interactions_are_resolved_once_and_concurrently(self):
+        started = []
+        release = asyncio.Event()
+
+        async def get_address(service_id, tracking_id_headers):
+            started.append(service_id)
+            await release.wait()
+            return [f'https://{service_id}']
+
+        results = [
+            self._result('urn:nhs:names:services:gp2gp:RCMR_IN010000UK05'),
+            self._result('urn:nhs:names:services:ebs:PRSC_IN070000UK08'),
+            self._result('urn:nhs:names:services:ebs:PRSC_IN080000UK03'),
+            self._result('urn:nhs:names:services:gpconnect:fhir:rest:read:location-1')
+        ]
+
+        with patch.object(cpm, '_get_address', side_effect=get_address):
+            task = asyncio.ensure_future(cpm.set_mhs_endpoint(results, {}))
+            while len(started) < 2:
+                await asyncio.sleep(0)
+            release.set()
+            await task
+
+        self.assertEqual(sorted(started), sorted([FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION,
+                                                  FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION]))
+        self.assertEqual(results[0]['nhsMHSEndPoint'], [f'https://{FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION}'])
+        self.assertEqual(results[1]['nhsMHSEndPoint'], [f'https://{FORWARD_RELIABLE_CORE_SPINE_SERVICE_INTERACTION}'])
+        self.assertEqual(results[2]['nhsMHSEndPoint'], [f'https://{FORWARD_EXPRESS_CORE_SPINE_SERVICE_INTERACTION}'])
+        self.assertEqual(results[3]['nhsMHSEndPoint'], ['https://original'])
+
+    @async_test
+    async def test_resolved_addresses_are_reused_across_requests(self):
+        with patch.object(cpm, '_get_address', return_value=['https://intermediary']) as get_address:
+            for _ in range(3):
+                results = [self._result('urn:nhs:names:services:gp2gp:RCMR_IN010000UK05')]
+                await cpm.set_mhs_endpoint(results, {})
+                self.assertEqual(results[0]['nhsMHSEndPoint'], ['https://intermediary'])
+
+        get_address.assert_called_once()
@@ -0,0 +1,44 @@
+import json
+
+import tornado.testing
+import tornado.web
+
+from lookup.sds_exception import SDSException
+from request import cpm
+
+
+class FakeCpmHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        if self.get_query_argument("fail", default=None):
+            self.set_status(404)
+            self.write("not found")
+            return
+        self.write(json.dumps({
+            "apikey": self.request.headers.get("apikey"),
+            "nhs_id_code": self.get_query_argument("nhs_id_code")
+        }))
+
+
+class TestCpmHttpClient(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return tornado.web.Application([(r"/searchSdsEndpoint", FakeCpmHandler)])
+
+    @tornado.testing.gen_test
+    async def test_get_request_sends_headers_and_query_params(self):
+        response = await cpm.make_get_request("test", self.get_url("/searchSdsEndpoint"),
+                                              headers={"apikey": "1234"}, params={"nhs_id_code": "RTX"})
+
+        self.assertEqual(json.loads(response.body), {"apikey": "1234", "nhs_id_code": "RTX"})
+
+    @tornado.testing.gen_test
+    async def test_get_request_raises_error_for_non_200_response(self):
+        with self.assertRaises(SDSException) as context:
+            await cpm.make_get_request("test", self.get_url("/searchSdsEndpoint"), params={"fail": "true"})
+
+        self.assertIn("404", str(context.exception))
+        self.assertIn("not found", str(context.exception))
+
+    def test_http_client_is_shared_between_requests(self):
+        self.assertIs(cpm.get_http_client(), cpm.get_http_client())
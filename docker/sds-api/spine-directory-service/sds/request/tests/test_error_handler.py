@@ -0,0 +1,40 @@
+import json
+
+import tornado.testing
+import tornado.web
+
+from request.error_handler import ErrorHandler
+from utilities.executors import ExecutorSaturatedError
+
+
+class UnavailableHandler(ErrorHandler):
+
+    def prepare(self):
+        pass
+
+    def get(self):
+        if self.get_query_argument("saturated", default=None):
+            raise ExecutorSaturatedError("ldap executor is saturated")
+        self.send_error(503)
+
+
+class TestErrorHandler(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return tornado.web.Application([(r"/unavailable", UnavailableHandler)])
+
+    def test_503_sent_without_an_exception(self):
+        response = self.fetch("/unavailable")
+
+        self.assertEqual(response.code, 503)
+        self.assertNotIn("Retry-After", response.headers)
+        issue = json.loads(response.body)["issue"][0]
+        self.assertEqual(issue["code"], "transient")
+        self.assertEqual(issue["diagnostics"], "Service unavailable")
+
+    def test_saturated_executor_is_a_retryable_503(self):
+        response = self.fetch("/unavailable?saturated=true")
+
+        self.assertEqual(response.code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(json.loads(response.body)["issue"][0]["diagnostics"], "ldap executor is saturated")
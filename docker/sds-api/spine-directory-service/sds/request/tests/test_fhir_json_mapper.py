@@ -4,7 +4,51 @@ import os
 from unittest import TestCase
 from unittest.mock import patch
 
+from request import fhir_json_mapper
+from request.base_handler import SERVICE_ID_FHIR_IDENTIFIER
 from request.fhir_json_mapper import build_endpoint_resources, build_device_resource
+from request.mapper_urls import MapperUrls as Url
+
+
+def _build_endpoint_resources_per_address(ldap_attributes: dict):
+    """The mapping `build_endpoint_resources` replaced, which built every endpoint from scratch."""
+    def build_endpoint(address):
+        result = {
+            "resourceType": "Endpoint",
+            "id": str(fhir_json_mapper.message_utilities.get_uuid()),
+            "status": "active",
+            "connectionType": fhir_json_mapper.build_connection_type(),
+            "payloadType": fhir_json_mapper._build_payload_type()
+        }
+        if address:
+            result["address"] = address
+
+        managing_organization = fhir_json_mapper._build_managing_organization(ldap_attributes.get("nhsIDCode"))
+        if managing_organization:
+            result["managingOrganization"] = managing_organization
+
+        identifiers = [item for item in fhir_json_mapper._build_identifier_array(ldap_attributes) if item]
+        if identifiers:
+            result["identifier"] = identifiers
+
+        extensions = []
+        reliability_configuration_extensions = [
+            item for item in fhir_json_mapper._build_extension_array(ldap_attributes) if item]
+        if reliability_configuration_extensions:
+            extensions.append({
+                "url": Url.EXTENSION_URL,
+                "extension": reliability_configuration_extensions
+            })
+        interaction_id = ldap_attributes.get("nhsMhsSvcIA")
+        if interaction_id:
+            extensions.append(fhir_json_mapper._build_value_reference_extension(
+                Url.SDS_SERVICE_INTERACTION_ID_URL, SERVICE_ID_FHIR_IDENTIFIER, interaction_id))
+
+        if extensions:
+            result["extension"] = extensions
+
+        return result
+    return [build_endpoint(address) for address in ldap_attributes.get('nhsMHSEndPoint', [None]) or [None]]
 
 
 class TestGetJsonFormat(TestCase):
@@ -35,3 +79,24 @@ class TestGetJsonFormat(TestCase):
                 with self.subTest(f'{resource} : {test_case}'):
                     result = tested_method(ldap_attributes)
                     self.assertEqual(result, expected_result)
+
+    @patch('request.fhir_json_mapper.message_utilities')
+    def test_endpoints_built_from_template_match_endpoints_built_per_address(self, message_utilities_mock):
+        dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                "test_data", "fhir_json_mapper", "endpoint")
+        everything = self._read_file(os.path.join(dir_path, "everything.in.json"))
+        ldap_results = [
+            everything,
+            {**everything, "nhsMhsSvcIA": "other_interaction_id",
+             "nhsMHSEndPoint": ["http://one.com", "http://two.com", "http://three.com"]},
+            {**everything, "nhsMhsSvcIA": "urn:nhs:names:services:psis:MCCI_IN010000UK13", "nhsMHSRetries": None,
+             "nhsMHSEndPoint": ["http://acme.com"]}
+        ]
+
+        message_utilities_mock.get_uuid.side_effect = itertools.count().__next__
+        expected = [_build_endpoint_resources_per_address(ldap_result) for ldap_result in ldap_results]
+        # built twice, so the shared parts of the template being changed by building an endpoint would be caught
+        for attempt in range(2):
+            message_utilities_mock.get_uuid.side_effect = itertools.count().__next__
+            with self.subTest(attempt=attempt):
+                self.assertEqual([build_endpoint_resources(ldap_result) for ldap_result in ldap_results], expected)
@@ -0,0 +1,61 @@
+import asyncio
+
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+from request.graceful_shutdown import GracefulShutdown, InFlightRequests
+
+
+class SlowHandler(tornado.web.RequestHandler):
+
+    def initialize(self, release: asyncio.Event):
+        self.release = release
+
+    async def get(self):
+        await self.release.wait()
+        self.write("done")
+
+
+class TestGracefulShutdown(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.release = asyncio.Event()
+        return tornado.web.Application([("/slow", SlowHandler, {"release": self.release})])
+
+    def get_http_server(self):
+        self.in_flight = InFlightRequests(self._app)
+        return tornado.httpserver.HTTPServer(self.in_flight)
+
+    async def _start_slow_request(self):
+        request = asyncio.ensure_future(self.http_client.fetch(self.get_url("/slow")))
+        while self.in_flight.count == 0:
+            await asyncio.sleep(0.01)
+        return request
+
+    @tornado.testing.gen_test
+    async def test_shutdown_waits_for_in_flight_requests_and_stops_accepting_connections(self):
+        request = await self._start_slow_request()
+
+        shutdown = asyncio.ensure_future(GracefulShutdown(self.http_server, self.in_flight, timeout=5).shut_down())
+        await asyncio.sleep(0.05)
+        self.assertFalse(shutdown.done())
+        self.release.set()
+        response = await request
+        await shutdown
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.in_flight.count, 0)
+        with self.assertRaises(ConnectionError):
+            await self.http_client.fetch(self.get_url("/slow"))
+
+    @tornado.testing.gen_test
+    async def test_shutdown_gives_up_waiting_after_timeout(self):
+        request = await self._start_slow_request()
+
+        await GracefulShutdown(self.http_server, self.in_flight, timeout=0.05).shut_down()
+
+        self.assertEqual(self.in_flight.count, 1)
+        self.release.set()
+        await request
+        self.assertEqual(self.in_flight.count, 0)
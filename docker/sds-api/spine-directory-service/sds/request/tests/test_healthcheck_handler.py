@@ -1,14 +1,21 @@
 import asyncio
 import json
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
 
 import tornado.testing
 from tornado.web import Application
-from unittest.mock import MagicMock, patch
+
+from lookup import sds_client_factory
+from lookup.sds_caching_client import SDSCachingClient
+from lookup.sds_snapshot_client import SDSSnapshotClient
 from request import healthcheck_handler
+from utilities import test_utilities
 
 LDAP_URL = 'ldap://some_domain'
 PASS = 'pass'
 FAIL = 'fail'
+MHS_ENTRY = {'nhsIDCode': 'TEST', 'nhsMhsSvcIA': 'TEST', 'nhsMHSPartyKey': 'TEST'}
 
 
 class TestHealthcheckHandler(tornado.testing.AsyncHTTPTestCase):
@@ -18,16 +25,20 @@ class TestHealthcheckHandler(tornado.testing.AsyncHTTPTestCase):
 
         self.assertEqual(200, response.code)
 
+    def test_health_is_unavailable_until_ready(self):
+        self.ready = False
+        self.assertEqual(503, self.fetch('/healthcheck/readiness', method='GET').code)
+
+        self.ready = True
+        self.assertEqual(200, self.fetch('/healthcheck/readiness', method='GET').code)
+
     @patch('request.healthcheck_handler.config')
-    @patch('request.healthcheck_handler.get_sds_client')
-    def test_success_deep_healthcheck(self, mock_get_sds_client, mock_config):
+    def test_success_deep_healthcheck(self, mock_config):
         mock_config.get_config.return_value = LDAP_URL
 
         empty_future = asyncio.Future()
         empty_future.set_result(None)
-        mock_get_mhs_details = MagicMock()
-        mock_get_mhs_details.get_mhs_details.return_value = empty_future
-        mock_get_sds_client.return_value = mock_get_mhs_details
+        self.sds_client.get_mhs_details.return_value = empty_future
 
         response = self.fetch('/healthcheck/deep', method='GET')
 
@@ -37,15 +48,13 @@ class TestHealthcheckHandler(tornado.testing.AsyncHTTPTestCase):
         self.assertEqual(PASS, response_body['details']['ldap']['status'])
         self.assertEqual(LDAP_URL, response_body['details']['ldap']['links']['ldap'])
         self.assertEqual('', response_body['details']['ldap']['output'])
+        self.sds_client.get_mhs_details.assert_called_once_with('TEST', 'TEST', 'TEST')
 
     @patch('request.healthcheck_handler.config')
-    @patch('request.healthcheck_handler.get_sds_client')
-    def test_failure_deep_healthcheck(self, mock_get_sds_client, mock_config):
+    def test_failure_deep_healthcheck(self, mock_config):
         mock_config.get_config.return_value = LDAP_URL
 
-        mock_get_mhs_details = MagicMock()
-        mock_get_mhs_details.get_mhs_details.side_effect = RuntimeError('some error')
-        mock_get_sds_client.return_value = mock_get_mhs_details
+        self.sds_client.get_mhs_details.side_effect = RuntimeError('some error')
 
         response = self.fetch('/healthcheck/deep', method='GET')
 
@@ -57,8 +66,49 @@ class TestHealthcheckHandler(tornado.testing.AsyncHTTPTestCase):
         self.assertEqual('some error', response_body['details']['ldap']['output'])
 
     def get_app(self) -> Application:
+        self.sds_client = MagicMock()
         return tornado.web.Application(
             [
                 (r'/healthcheck', healthcheck_handler.HealthcheckHandler),
-                (r'/healthcheck/deep', healthcheck_handler.DeepHealthcheckHandler),
+                (r'/healthcheck/readiness', healthcheck_handler.HealthcheckHandler, {"is_ready": lambda: self.ready}),
+                (r'/healthcheck/deep', healthcheck_handler.DeepHealthcheckHandler, {"sds_client": self.sds_client}),
             ])
+
+
+class TestDeepHealthcheckBehindSnapshot(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self) -> Application:
+        self.ldap_client = MagicMock()
+        self.snapshot_client = SDSSnapshotClient(self.ldap_client, refresh_interval=0)
+        return tornado.web.Application([
+            (r'/healthcheck/deep', healthcheck_handler.DeepHealthcheckHandler,
+             {"sds_client": sds_client_factory.get_ldap_client(self.snapshot_client)}),
+        ])
+
+    def test_deep_healthcheck_fails_when_ldap_is_down_even_though_snapshot_is_populated(self):
+        self.ldap_client.get_all_mhs_details.return_value = test_utilities.awaitable([MHS_ENTRY])
+        self.ldap_client.get_all_as_details.return_value = test_utilities.awaitable([])
+        self.io_loop.run_sync(self.snapshot_client.refresh)
+        self.ldap_client.get_mhs_details.side_effect = RuntimeError('LDAP is down')
+
+        self.assertEqual(self.io_loop.run_sync(lambda: self.snapshot_client.get_mhs_details('TEST', 'TEST')),
+                         [MHS_ENTRY])
+        response = self.fetch('/healthcheck/deep', method='GET')
+
+        self.assertEqual(503, response.code)
+        self.assertEqual('LDAP is down', json.loads(response.body.decode())['details']['ldap']['output'])
+
+
+class TestGetLdapClient(TestCase):
+
+    def test_snapshot_and_cache_layers_are_bypassed(self):
+        ldap_client = MagicMock()
+        clients = [
+            ldap_client,
+            SDSCachingClient(ldap_client, ttl=60, max_entries=10),
+            SDSSnapshotClient(ldap_client),
+            SDSSnapshotClient(SDSCachingClient(ldap_client, ttl=60, max_entries=10))
+        ]
+        for sds_client in clients:
+            with self.subTest(sds_client=type(sds_client).__name__):
+                self.assertIs(sds_client_factory.get_ldap_client(sds_client), ldap_client)
@@ -0,0 +1,138 @@
+import json
+import os
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import tornado.web
+
+from lookup.intermediary_address_cache import IntermediaryAddressCache, sds_address_resolver
+from request import routing_reliability_handler, accredited_system_handler
+from request.fhir_json_mapper import build_bundle_resource
+from request.response_cache import ResponseCache, SerializedBundle
+from request.tests.request_handler_test_base import RequestHandlerTestBase, ORG_CODE, SERVICE_ID
+from request.tests.test_accredited_system_handler import SINGLE_ACCREDITED_SYSTEM_DETAILS, \
+    EXPECTED_SINGLE_DEVICE_JSON_FILE_PATH
+from utilities import test_utilities
+from utilities.tests.test_ttl_cache import FakeClock
+
+RESOURCES = [{"resourceType": "Device", "id": "ENTRY-ID", "status": "active"}]
+BASE_URL = "http://localhost/Device/"
+SELF_URL = "http://localhost/Device?organization=https://fhir.nhs.uk/Id/ods-organization-code|YES"
+
+
+class TestSerializedBundle(TestCase):
+
+    def test_rendered_bundle_has_given_id_and_self_link_and_is_otherwise_unchanged(self):
+        bundle = build_bundle_resource(RESOURCES, BASE_URL, SELF_URL)
+
+        for pretty in [True, False]:
+            with self.subTest(pretty=pretty):
+                rendered = json.loads(SerializedBundle(bundle, pretty).render("BUNDLE-ID",
+                                                                              "http://other/Device?a=\"b\""))
+
+                self.assertEqual(rendered, {**bundle, "id": "BUNDLE-ID",
+                                            "link": [{"relation": "self", "url": "http://other/Device?a=\"b\""}]})
+
+    def test_rendering_is_compact_or_pretty_as_serialized(self):
+        bundle = build_bundle_resource(RESOURCES, BASE_URL, SELF_URL)
+
+        self.assertIn(b"\n", SerializedBundle(bundle, True).render("BUNDLE-ID", SELF_URL))
+        self.assertNotIn(b"\n", SerializedBundle(bundle, False).render("BUNDLE-ID", SELF_URL))
+
+
+class TestResponseCache(TestCase):
+
+    def test_bundle_held_is_served_with_new_id_and_self_link(self):
+        cache = ResponseCache(ttl=10, max_entries=10)
+        bundle = build_bundle_resource(RESOURCES, BASE_URL, SELF_URL)
+
+        cache.put("key", bundle, pretty=False, etag='W/"etag"')
+        serialized_bundle = cache.get("key")
+        cached = json.loads(serialized_bundle.render("BUNDLE-ID", "http://localhost/Device?other"))
+
+        self.assertEqual(serialized_bundle.etag, 'W/"etag"')
+        self.assertEqual(cached["id"], "BUNDLE-ID")
+        self.assertEqual(cached["link"][0]["url"], "http://localhost/Device?other")
+        self.assertEqual(cached["entry"], bundle["entry"])
+
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = ResponseCache(ttl=10, max_entries=10, clock=clock)
+        cache.put("key", build_bundle_resource(RESOURCES, BASE_URL, SELF_URL), pretty=False)
+
+        clock.now += 10
+
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+
+class TestHandlersWithResponseCache(RequestHandlerTestBase):
+
+    def get_app(self):
+        self.sds_client = Mock()
+        self.response_cache = ResponseCache(ttl=60, max_entries=10)
+        intermediary_address_cache = IntermediaryAddressCache(sds_address_resolver(self.sds_client))
+
+        return tornado.web.Application([
+            (r"/endpoint", routing_reliability_handler.RoutingReliabilityRequestHandler,
+             {"sds_client": self.sds_client, "intermediary_address_cache": intermediary_address_cache,
+              "response_cache": self.response_cache}),
+            (r"/device", accredited_system_handler.AccreditedSystemRequestHandler,
+             {"sds_client": self.sds_client, "response_cache": self.response_cache})
+        ])
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_repeated_query_is_served_from_cache_without_a_lookup(self):
+        self.sds_client.get_as_details.return_value = test_utilities.awaitable(SINGLE_ACCREDITED_SYSTEM_DETAILS)
+        url = self._build_device_url(party_key=None, manufacturing_organization=None)
+
+        first = self.fetch(url, method="GET")
+        # the same query with its parameters in a different order
+        second = self.fetch(f"/device?identifier=https://fhir.nhs.uk/Id/nhsServiceInteractionId|{SERVICE_ID}"
+                            f"&organization=https://fhir.nhs.uk/Id/ods-organization-code|{ORG_CODE}", method="GET")
+
+        self.sds_client.get_as_details.assert_called_once()
+        self.assertEqual(second.code, 200)
+        self.assertEqual(second.headers.get("Content-Type"), "application/fhir+json")
+        first_body, second_body = json.loads(first.body), json.loads(second.body)
+        self.assertNotEqual(first_body["id"], second_body["id"])
+        self.assertIn("identifier=https://fhir.nhs.uk/Id/nhsServiceInteractionId", second_body["link"][0]["url"])
+        self.assertEqual(first_body["entry"], second_body["entry"])
+        current, expected = self._get_current_and_expected_body(second, EXPECTED_SINGLE_DEVICE_JSON_FILE_PATH)
+        self.assertEqual(expected, current)
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_compact_and_pretty_responses_are_cached_separately(self):
+        self.sds_client.get_as_details.side_effect = \
+            lambda *args: test_utilities.awaitable(SINGLE_ACCREDITED_SYSTEM_DETAILS)
+        url = self._build_device_url(party_key=None, manufacturing_organization=None)
+
+        pretty = self.fetch(url, method="GET")
+        compact = self.fetch(f"{url}&_pretty=false", method="GET")
+
+        self.assertEqual(self.sds_client.get_as_details.call_count, 2)
+        self.assertIn(b"\n", pretty.body)
+        self.assertNotIn(b"\n", compact.body)
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_empty_results_are_not_cached(self):
+        self.sds_client.get_mhs_details.side_effect = lambda *args: test_utilities.awaitable([])
+
+        for _ in range(2):
+            response = self.fetch(self._build_endpoint_url(), method="GET")
+            self.assertEqual(response.code, 200)
+
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 2)
+        self.assertEqual(self.response_cache.stats()["size"], 0)
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_conditional_get_of_cached_response_returns_304(self):
+        self.sds_client.get_as_details.return_value = test_utilities.awaitable(SINGLE_ACCREDITED_SYSTEM_DETAILS)
+        url = self._build_device_url(party_key=None, manufacturing_organization=None)
+
+        etag = self.fetch(url, method="GET").headers.get("ETag")
+        response = self.fetch(url, method="GET", headers={"If-None-Match": etag})
+
+        self.sds_client.get_as_details.assert_called_once()
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.headers.get("ETag"), etag)
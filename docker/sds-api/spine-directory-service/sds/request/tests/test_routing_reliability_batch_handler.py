@@ -0,0 +1,140 @@
+import json
+import os
+from unittest.mock import Mock, patch
+
+import tornado.web
+
+from lookup.intermediary_address_cache import IntermediaryAddressCache, sds_address_resolver
+from request import routing_reliability_batch_handler
+from request.tests.request_handler_test_base import RequestHandlerTestBase, ORG_CODE, SERVICE_ID, PARTY_KEY
+from request.tests.test_routing_reliability_handler import SINGLE_ROUTING_AND_RELIABILITY_DETAILS, \
+    MULTIPLE_ROUTING_AND_RELIABILITY_DETAILS
+from utilities import test_utilities
+from utilities.executors import ExecutorSaturatedError
+
+BATCH_URL = "/endpoint/_batch"
+HEADERS = {"Content-Type": "application/fhir+json"}
+
+
+def _build_batch(*search_urls):
+    return json.dumps({
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [{"request": {"method": "GET", "url": search_url}} for search_url in search_urls]
+    })
+
+
+class TestRoutingReliabilityBatchRequestHandler(RequestHandlerTestBase):
+
+    def get_app(self):
+        self.sds_client = Mock()
+        intermediary_address_cache = IntermediaryAddressCache(sds_address_resolver(self.sds_client))
+
+        return tornado.web.Application([
+            (BATCH_URL, routing_reliability_batch_handler.RoutingReliabilityBatchRequestHandler,
+             {"sds_client": self.sds_client, "intermediary_address_cache": intermediary_address_cache,
+              "max_entries": 3})
+        ])
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_batch_returns_a_bundle_per_search_and_looks_up_identical_searches_once(self):
+        results = {
+            (ORG_CODE, SERVICE_ID, PARTY_KEY): SINGLE_ROUTING_AND_RELIABILITY_DETAILS,
+            ("other_org", SERVICE_ID, None): MULTIPLE_ROUTING_AND_RELIABILITY_DETAILS
+        }
+        self.sds_client.get_mhs_details_batch.side_effect = \
+            lambda queries: test_utilities.awaitable([results[query] for query in queries])
+        other_org_url = f"Endpoint?organization=https://fhir.nhs.uk/Id/ods-organization-code|other_org" \
+                        f"&identifier=https://fhir.nhs.uk/Id/nhsServiceInteractionId|{SERVICE_ID}"
+
+        response = self.fetch(BATCH_URL, method="POST", headers=HEADERS, body=_build_batch(
+            self._build_endpoint_url(), other_org_url, self._build_endpoint_url()))
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers.get("Content-Type"), "application/fhir+json")
+        self.assertIsNotNone(response.headers.get("X-Correlation-ID"))
+        self.sds_client.get_mhs_details_batch.assert_called_once_with(
+            [(ORG_CODE, SERVICE_ID, PARTY_KEY), ("other_org", SERVICE_ID, None)])
+
+        batch_response = json.loads(response.body)
+        self.assertEqual(batch_response["resourceType"], "Bundle")
+        self.assertEqual(batch_response["type"], "batch-response")
+        self.assertEqual([entry["response"]["status"] for entry in batch_response["entry"]], ["200 OK"] * 3)
+        bundles = [entry["resource"] for entry in batch_response["entry"]]
+        self.assertEqual([bundle["type"] for bundle in bundles], ["searchset"] * 3)
+        self.assertEqual([bundle["total"] for bundle in bundles], [1, 3, 1])
+        self.assertEqual(bundles[1]["link"][0]["url"],
+                         f"{self.get_url('/endpoint')}?{other_org_url.split('?')[1]}")
+        self.assertTrue(bundles[0]["entry"][0]["fullUrl"].startswith(self.get_url("/endpoint/")))
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_invalid_and_failed_searches_are_reported_in_their_own_entry(self):
+        self.sds_client.get_mhs_details_batch.side_effect = Exception("some error")
+
+        response = self.fetch(BATCH_URL, method="POST", headers=HEADERS, body=_build_batch(
+            self._build_endpoint_url(org_code="failing_org"),
+            self._build_endpoint_url(service_id=None, party_key=None),
+            self._build_endpoint_url()))
+
+        self.assertEqual(response.code, 200)
+        entries = json.loads(response.body)["entry"]
+        self.assertEqual([entry["response"]["status"] for entry in entries],
+                         ["500 Internal Server Error", "400 Bad Request", "500 Internal Server Error"])
+        self.assertEqual(entries[0]["response"]["outcome"]["issue"][0]["diagnostics"], "some error")
+        self.assertIn("Missing or invalid query parameters",
+                      entries[1]["response"]["outcome"]["issue"][0]["diagnostics"])
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_searches_rejected_by_a_saturated_backend_are_reported_as_unavailable(self):
+        self.sds_client.get_mhs_details_batch.side_effect = ExecutorSaturatedError("ldap executor is saturated")
+
+        response = self.fetch(BATCH_URL, method="POST", headers=HEADERS, body=_build_batch(self._build_endpoint_url()))
+
+        self.assertEqual(response.code, 200)
+        entry = json.loads(response.body)["entry"][0]
+        self.assertEqual(entry["response"]["status"], "503 Service Unavailable")
+        self.assertEqual(entry["response"]["outcome"]["issue"][0]["code"], "transient")
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    @patch('utilities.config.get_config')
+    def test_forward_reliable_addresses_are_resolved_for_each_search(self, mock_config):
+        mock_config.side_effect = lambda key, default=None: {"SPINE_CORE_ODS_CODE": "spine_core"}[key]
+        forward_reliable_details = [{**SINGLE_ROUTING_AND_RELIABILITY_DETAILS[0],
+                                     "nhsMhsSvcIA": "urn:nhs:names:services:gp2gp:RCMR_IN010000UK05",
+                                     "nhsMHSEndPoint": ["https://original"]}]
+        self.sds_client.get_mhs_details_batch.side_effect = \
+            lambda queries: test_utilities.awaitable([forward_reliable_details for _ in queries])
+        self.sds_client.get_mhs_details.side_effect = \
+            lambda *query: test_utilities.awaitable([{"nhsMHSEndPoint": ["https://forward-reliable"]}])
+
+        response = self.fetch(BATCH_URL, method="POST", headers=HEADERS, body=_build_batch(self._build_endpoint_url()))
+
+        self.assertEqual(response.code, 200)
+        endpoint = json.loads(response.body)["entry"][0]["resource"]["entry"][0]["resource"]
+        self.assertEqual(endpoint["address"], "https://forward-reliable")
+        self.sds_client.get_mhs_details.assert_called_once_with(
+            "spine_core", "urn:nhs:names:services:tms:ReliableIntermediary")
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_invalid_batch_is_rejected(self):
+        bodies = {
+            "Invalid JSON": "{",
+            "Not a batch": json.dumps({"resourceType": "Bundle", "type": "searchset"}),
+            "Entry without request": json.dumps({"resourceType": "Bundle", "type": "batch", "entry": [{}]}),
+            "Too many entries": _build_batch(*[self._build_endpoint_url()] * 4)
+        }
+        for description, body in bodies.items():
+            with self.subTest(description):
+                response = self.fetch(BATCH_URL, method="POST", headers=HEADERS, body=body)
+
+                self.assertEqual(response.code, 400)
+                self.assertEqual(json.loads(response.body)["resourceType"], "OperationOutcome")
+        self.sds_client.get_mhs_details_batch.assert_not_called()
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    def test_should_return_405_when_not_using_post(self):
+        response = self.fetch(BATCH_URL, method="GET")
+
+        self.assertEqual(response.code, 405)
+        self.assertEqual(response.headers.get("Allow"), "POST")
+        self._assert_405_operation_outcome(response.body.decode())
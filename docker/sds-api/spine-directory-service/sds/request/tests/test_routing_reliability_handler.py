@@ -1,10 +1,14 @@
+import copy
+import json
 import os
 from os import path
 from unittest.mock import patch, call
 
+from lookup.sds_caching_client import stale_result_age
 from request.tests.request_handler_test_base import RequestHandlerTestBase, ORG_CODE, SERVICE_ID, PARTY_KEY, \
     SPINE_CORE_ORG_CODE, FORWARD_RELIABLE_SERVICE_ID, CORE_SPINE_FORWARD_RELIABLE_SERVICE_ID
 from utilities import test_utilities
+from utilities.executors import ExecutorSaturatedError
 
 EXPECTED_SINGLE_ENDPOINT_JSON_FILE_PATH = path.join(path.dirname(__file__), "examples/single_endpoint.json")
 EXPECTED_MULTIPLE_ENDPOINTS_JSON_FILE_PATH = path.join(path.dirname(__file__), "examples/multiple_endpoints.json")
@@ -104,6 +108,27 @@ class TestRoutingReliabilityRequestHandler(RequestHandlerTestBase):
             call(SPINE_CORE_ORG_CODE, CORE_SPINE_FORWARD_RELIABLE_SERVICE_ID)
         ])
 
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    @patch('utilities.config.get_config')
+    def test_forward_reliable_address_is_looked_up_once_across_requests(self, mock_config):
+        self._set_core_spine_ods_code(mock_config, SPINE_CORE_ORG_CODE)
+
+        routing_and_reliability_details = copy.deepcopy(MULTIPLE_ROUTING_AND_RELIABILITY_DETAILS)
+        routing_and_reliability_details[1]["nhsMhsSvcIA"] = FORWARD_RELIABLE_SERVICE_ID
+
+        self.sds_client.get_mhs_details.side_effect = [
+            test_utilities.awaitable(routing_and_reliability_details),
+            test_utilities.awaitable(FORWARD_RELIABLE_ROUTING_AND_RELIABILITY_DETAILS),
+            test_utilities.awaitable(routing_and_reliability_details),
+            ]
+
+        for _ in range(2):
+            super()._test_get(super()._build_endpoint_url(service_id=FORWARD_RELIABLE_SERVICE_ID),
+                              EXPECTED_FORWARD_RELIABLE_ENDPOINTS_JSON_FILE_PATH)
+
+        self.assertEqual(self.sds_client.get_mhs_details.call_count, 3)
+        self.assertEqual(self.intermediary_address_cache.stats()["hits"], 1)
+
     @patch.dict(os.environ, {"USE_CPM": "0"})
     @patch('utilities.config.get_config')
     def test_supported_query_params(self, mock_config):
@@ -140,6 +165,89 @@ class TestRoutingReliabilityRequestHandler(RequestHandlerTestBase):
             mock500
         )
 
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    @patch('utilities.config.get_config')
+    def test_stale_result_sets_warning_and_age_headers(self, mock_config):
+        self._set_core_spine_ods_code(mock_config, SPINE_CORE_ORG_CODE)
+
+        def serve_stale(*args):
+            stale_result_age.set(42.5)
+            return test_utilities.awaitable(SINGLE_ROUTING_AND_RELIABILITY_DETAILS)
+
+        with self.subTest("Fresh result"):
+            self.sds_client.get_mhs_details.side_effect = None
+            self.sds_client.get_mhs_details.return_value = test_utilities.awaitable(
+                SINGLE_ROUTING_AND_RELIABILITY_DETAILS)
+            response = self.fetch(self._build_endpoint_url(), method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertIsNone(response.headers.get("Warning"))
+            self.assertIsNone(response.headers.get("Age"))
+
+        with self.subTest("Stale result"):
+            self.sds_client.get_mhs_details.side_effect = serve_stale
+            response = self.fetch(self._build_endpoint_url(), method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.headers.get("Warning"), '110 - "Response is Stale"')
+            self.assertEqual(response.headers.get("Age"), "42")
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    @patch('utilities.config.get_config')
+    def test_pretty_query_param_selects_indented_or_compact_json(self, mock_config):
+        self._set_core_spine_ods_code(mock_config, SPINE_CORE_ORG_CODE)
+        self.sds_client.get_mhs_details.side_effect = \
+            lambda *args: test_utilities.awaitable(SINGLE_ROUTING_AND_RELIABILITY_DETAILS)
+
+        with self.subTest("Indented by default"):
+            response = self.fetch(self._build_endpoint_url(), method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertIn(b'\n  "resourceType": "Bundle"', response.body)
+
+        with self.subTest("Compact when _pretty=false"):
+            response = self.fetch(f"{self._build_endpoint_url()}&_pretty=false", method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertNotIn(b"\n", response.body)
+            self.assertEqual(json.loads(response.body)["resourceType"], "Bundle")
+
+        with self.subTest("Invalid _pretty value"):
+            response = self.fetch(f"{self._build_endpoint_url()}&_pretty=yes", method="GET")
+            self.assertEqual(response.code, 400)
+            super()._assert_400_operation_outcome(
+                response.body.decode(),
+                "HTTP 400: Bad Request "
+                "(Invalid '_pretty' query parameter. Should be '_pretty=true' or '_pretty=false')")
+
+        with self.subTest("Compact error when _pretty=false"):
+            response = self.fetch("/endpoint?_pretty=false", method="GET")
+            self.assertEqual(response.code, 400)
+            self.assertNotIn(b"\n", response.body)
+
+    @patch.dict(os.environ, {"USE_CPM": "0"})
+    @patch('utilities.config.get_config')
+    def test_conditional_get_returns_304_while_results_are_unchanged(self, mock_config):
+        self._set_core_spine_ods_code(mock_config, SPINE_CORE_ORG_CODE)
+        self.sds_client.get_mhs_details.side_effect = \
+            lambda *args: test_utilities.awaitable(copy.deepcopy(SINGLE_ROUTING_AND_RELIABILITY_DETAILS))
+
+        response = self.fetch(self._build_endpoint_url(), method="GET")
+        etag = response.headers.get("ETag")
+        self.assertEqual(response.code, 200)
+        self.assertTrue(etag.startswith('W/"'))
+
+        with self.subTest("Unchanged results"):
+            response = self.fetch(self._build_endpoint_url(), method="GET", headers={"If-None-Match": etag})
+            self.assertEqual(response.code, 304)
+            self.assertEqual(response.body, b"")
+            self.assertEqual(response.headers.get("ETag"), etag)
+            self.assertIsNotNone(response.headers.get("X-Correlation-ID"))
+
+        with self.subTest("Changed results"):
+            changed_details = copy.deepcopy(SINGLE_ROUTING_AND_RELIABILITY_DETAILS)
+            changed_details[0]["nhsMHSEndPoint"] = ["https://192.168.128.11/moved"]
+            self.sds_client.get_mhs_details.side_effect = lambda *args: test_utilities.awaitable(changed_details)
+            response = self.fetch(self._build_endpoint_url(), method="GET", headers={"If-None-Match": etag})
+            self.assertEqual(response.code, 200)
+            self.assertNotEqual(response.headers.get("ETag"), etag)
+
     @patch.dict(os.environ, {"USE_CPM": "0"})
     def test_get_returns_error(self):
         with self.subTest("Lookup error"):
@@ -148,6 +256,15 @@ class TestRoutingReliabilityRequestHandler(RequestHandlerTestBase):
             self.assertEqual(response.code, 500)
             super()._assert_500_operation_outcome(response.body.decode())
 
+        with self.subTest("Saturated backend"):
+            self.sds_client.get_mhs_details.side_effect = ExecutorSaturatedError("ldap executor is saturated")
+            response = self.fetch(self._build_endpoint_url(), method="GET")
+            self.assertEqual(response.code, 503)
+            self.assertEqual(response.headers.get("Retry-After"), "1")
+            issue = json.loads(response.body)["issue"][0]
+            self.assertEqual(issue["code"], "transient")
+            self.assertEqual(issue["diagnostics"], "ldap executor is saturated")
+
     @patch.dict(os.environ, {"USE_CPM": "0"})
     def test_get_handles_missing_params(self):
         error_message = "HTTP 400: Bad Request (Missing or invalid query parameters. Should one of following combinations: ['organization=https://fhir.nhs.uk/Id/ods-organization-code|value&identifier=https://fhir.nhs.uk/Id/nhsServiceInteractionId|value&identifier=https://fhir.nhs.uk/Id/nhsMhsPartyKey|value''organization=https://fhir.nhs.uk/Id/ods-organization-code|value&identifier=https://fhir.nhs.uk/Id/nhsServiceInteractionId|value''organization=https://fhir.nhs.uk/Id/ods-organization-code|value&identifier=https://fhir.nhs.uk/Id/nhsMhsPartyKey|value''identifier=https://fhir.nhs.uk/Id/nhsServiceInteractionId|value&identifier=https://fhir.nhs.uk/Id/nhsMhsPartyKey|value'])"
@@ -0,0 +1,83 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import main
+from utilities.worker_processes import WorkerProcesses
+
+
+class TestCreateWorkerProcesses(TestCase):
+
+    @patch('utilities.config.get_config')
+    def test_worker_processes_are_configured_from_config(self, mock_config):
+        config_values = {'SERVER_PROCESSES': '4', 'SERVER_MAX_WORKER_RESTARTS': '7'}
+        mock_config.side_effect = lambda key, default=None: config_values.get(key, default)
+
+        worker_processes = main.create_worker_processes()
+
+        self.assertIsInstance(worker_processes, WorkerProcesses)
+        self.assertEqual(worker_processes.processes, 4)
+        self.assertEqual(worker_processes.max_restarts, 7)
+
+    @patch('utilities.config.get_config')
+    def test_one_process_per_cpu_or_none(self, mock_config):
+        for processes, expected in [('0', 8), ('1', None)]:
+            with self.subTest(processes=processes):
+                mock_config.side_effect = lambda key, default=None: processes if key == 'SERVER_PROCESSES' else default
+
+                with patch('tornado.process.cpu_count', return_value=8):
+                    worker_processes = main.create_worker_processes()
+
+                self.assertEqual(worker_processes.processes if worker_processes else None, expected)
+
+
+@patch('main.json_serializer')
+@patch('main.log')
+@patch('main.secrets')
+@patch('main.config.setup_config')
+class TestMain(TestCase):
+
+    def setUp(self):
+        self.sockets = [Mock()]
+        self.sds_client = Mock()
+        patches = {
+            'main.create_worker_processes': Mock(),
+            'tornado.netutil.bind_sockets': Mock(return_value=self.sockets),
+            'lookup.sds_client_factory.get_sds_client': Mock(return_value=self.sds_client),
+            'main.start_tornado_server': Mock(),
+            'main.create_response_cache': Mock(),
+            'main.create_cache_warm_up': Mock()
+        }
+        self.mocks = {}
+        for target, mock in patches.items():
+            patcher = patch(target, mock)
+            self.mocks[target] = patcher.start()
+            self.addCleanup(patcher.stop)
+        self.worker_processes = self.mocks['main.create_worker_processes'].return_value
+
+    def test_workers_serve_on_sockets_bound_before_forking(self, *_):
+        self.worker_processes.start.return_value = 2
+
+        main.main()
+
+        self.mocks['tornado.netutil.bind_sockets'].assert_called_once_with(9000)
+        self.worker_processes.start.assert_called_once()
+        start_tornado_server = self.mocks['main.start_tornado_server']
+        start_tornado_server.assert_called_once()
+        self.assertIs(start_tornado_server.call_args[0][0], self.sds_client)
+        self.assertIs(start_tornado_server.call_args[0][2], self.sockets)
+
+    def test_supervisor_does_not_serve(self, *_):
+        self.worker_processes.start.return_value = None
+
+        main.main()
+
+        self.mocks['lookup.sds_client_factory.get_sds_client'].assert_not_called()
+        self.mocks['main.start_tornado_server'].assert_not_called()
+
+    def test_single_process_serves_without_forking(self, *_):
+        self.mocks['main.create_worker_processes'].return_value = None
+
+        main.main()
+
+        self.mocks['tornado.netutil.bind_sockets'].assert_not_called()
+        self.assertIsNone(self.mocks['main.start_tornado_server'].call_args[0][2])
@@ -0,0 +1,139 @@
+"""Dedicated, bounded thread pools for blocking calls to the backends SDS depends on."""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from utilities import config
+from utilities import integration_adaptors_logger as log
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+LDAP = "ldap"
+FILES = "files"
+
+_DEFAULT_MAX_WORKERS = 10
+_DEFAULT_MAX_QUEUE = 100
+
+_executors: Dict[str, 'BoundedExecutor'] = {}
+
+
+class ExecutorSaturatedError(Exception):
+    """Raised when a call is rejected because every worker of an executor is busy and its queue is full."""
+    pass
+
+
+class BoundedExecutor(object):
+    """
+    A named thread pool which runs blocking calls for a single backend. At most `max_workers` calls run at once and at
+    most `max_queue` more wait for a worker; any further calls are rejected immediately rather than queued, so a slow
+    backend fails fast instead of building an unbounded backlog or taking threads needed by another backend.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        """
+        :param name: Identifies the executor in logs, metrics and worker thread names.
+        :param max_workers: The number of threads available to run calls.
+        :param max_queue: The number of calls allowed to wait for a free thread before further calls are rejected.
+        """
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        if max_queue < 0:
+            raise ValueError('max_queue must not be negative')
+
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._pending = 0
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-executor')
+
+    @property
+    def active(self) -> int:
+        """The number of calls currently running on a worker thread."""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """The number of calls submitted which are waiting for a free worker thread."""
+        return max(self._pending - self._active, 0)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run `func(*args)` on one of this executor's threads and await its result.
+
+        :raises ExecutorSaturatedError: if all workers are busy and the queue is full.
+        """
+        if self._pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            logger.warning("Rejecting call to saturated {executor} executor. {active} {queued} {rejected}",
+                           fparams={"executor": self.name, "active": self.active, "queued": self.queued,
+                                    "rejected": self.rejected})
+            raise ExecutorSaturatedError(f'{self.name} executor is saturated, {self.queued} calls are already queued')
+
+        self._pending += 1
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(self._executor, self._call, func, args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._pending -= 1
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _call(self, func: Callable[..., Any], args) -> Any:
+        with self._active_lock:
+            self._active += 1
+        try:
+            return func(*args)
+        finally:
+            with self._active_lock:
+                self._active -= 1
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    """
+    Return the executor for the named backend, creating it on first use. Its size is read from the
+    `<NAME>_EXECUTOR_MAX_WORKERS` and `<NAME>_EXECUTOR_MAX_QUEUE` config values.
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        prefix = name.upper()
+        max_workers = int(config.get_config(f'{prefix}_EXECUTOR_MAX_WORKERS', default=str(_DEFAULT_MAX_WORKERS)))
+        max_queue = int(config.get_config(f'{prefix}_EXECUTOR_MAX_QUEUE', default=str(_DEFAULT_MAX_QUEUE)))
+        logger.info("Creating {executor} executor with {max_workers} {max_queue}",
+                    fparams={"executor": name, "max_workers": max_workers, "max_queue": max_queue})
+        executor = BoundedExecutor(name, max_workers, max_queue)
+        _executors[name] = executor
+    return executor
+
+
+def stats() -> Dict[str, dict]:
+    """The current metrics of every executor created so far, keyed by name."""
+    return {name: executor.stats() for name, executor in _executors.items()}
+
+
+def shutdown():
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
@@ -0,0 +1,85 @@
+"""Serialisation of response bodies to JSON, using the fastest encoder available."""
+import json
+from typing import Any, Callable, Dict, Optional, Union
+
+from utilities import config
+from utilities import integration_adaptors_logger as log
+from utilities.string_utilities import str2bool
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+AUTO = "auto"
+STDLIB = "stdlib"
+ORJSON = "orjson"
+
+# Serializes an object with the given indent, or as compactly as possible if the indent is None
+Serializer = Callable[[Any, Optional[int]], Union[str, bytes]]
+
+
+def _stdlib_dumps(obj: Any, indent: Optional[int]) -> str:
+    if indent is None:
+        return json.dumps(obj, separators=(',', ':'))
+    return json.dumps(obj, indent=indent)
+
+
+def _orjson_dumps(obj: Any, indent: Optional[int]) -> Union[str, bytes]:
+    if indent is None:
+        return orjson.dumps(obj)
+    if indent == 2:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    # orjson can only indent by two spaces
+    return _stdlib_dumps(obj, indent)
+
+
+SERIALIZERS: Dict[str, Serializer] = {STDLIB: _stdlib_dumps}
+if orjson is not None:
+    SERIALIZERS[ORJSON] = _orjson_dumps
+
+_serializer: Serializer = SERIALIZERS.get(ORJSON, _stdlib_dumps)
+_pretty_print = True
+
+
+def get_serializer(name: str) -> Serializer:
+    """
+    Return the serializer called `name`, or for `auto` the fastest one installed.
+
+    :raises ValueError: if there is no such serializer or it is not installed.
+    """
+    if name == AUTO:
+        return SERIALIZERS.get(ORJSON, _stdlib_dumps)
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown or unavailable JSON serializer '{name}'. Available serializers: {list(SERIALIZERS)}")
+    return SERIALIZERS[name]
+
+
+def configure():
+    """Select the serializer and whether responses are pretty printed from the `JSON_*` config values."""
+    global _serializer, _pretty_print
+    name = config.get_config('JSON_SERIALIZER', default=AUTO)
+    _serializer = get_serializer(name)
+    _pretty_print = str2bool(config.get_config('JSON_PRETTY_PRINT', default=str(True)))
+    logger.info("Serializing JSON responses with {serializer} {pretty_print}",
+                fparams={"serializer": name, "pretty_print": _pretty_print})
+
+
+def pretty_print_by_default() -> bool:
+    return _pretty_print
+
+
+def dumps(obj: Any, pretty: Optional[bool] = None, indent: int = 2) -> Union[str, bytes]:
+    """
+    Serialize `obj` to JSON with the configured serializer.
+
+    :param obj: The object to serialize.
+    :param pretty: Whether to indent the output, or None to use the configured default.
+    :param indent: The number of spaces to indent by when pretty printing.
+    :return: The JSON, as either a string or UTF-8 encoded bytes depending on the serializer.
+    """
+    if pretty is None:
+        pretty = _pretty_print
+    return _serializer(obj, indent if pretty else None)
@@ -0,0 +1,44 @@
+"""Collapses concurrent identical asynchronous calls into a single execution."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight(object):
+    """
+    Ensures only one call per key is in flight at a time. Callers arriving while a call for their key is still running
+    await that call instead of starting their own, and all of them receive its result (or exception).
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    @property
+    def in_flight(self) -> int:
+        """The number of distinct calls currently running."""
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await `func()`, or the already running call for `key` if there is one.
+
+        :param key: Identifies calls which are interchangeable with each other.
+        :param func: Starts the call. Only invoked if no call for `key` is in flight.
+        :return: The result of the call.
+        """
+        future = self._in_flight.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+
+        # shielded so that one caller being cancelled does not cancel the call for everybody else waiting on it
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from utilities import executors
+from utilities.executors import BoundedExecutor, ExecutorSaturatedError
+from utilities.test_utilities import async_test
+
+
+class TestBoundedExecutor(TestCase):
+
+    def test_should_raise_error_if_bounds_are_invalid(self):
+        for max_workers, max_queue in [(0, 1), (1, -1)]:
+            with self.subTest(f"max_workers={max_workers} max_queue={max_queue}"):
+                with self.assertRaises(ValueError):
+                    BoundedExecutor('test', max_workers, max_queue)
+
+    @async_test
+    async def test_runs_call_on_named_worker_thread(self):
+        executor = BoundedExecutor('test', 1, 0)
+
+        result = await executor.run(lambda x: (x * 2, threading.current_thread().name), 21)
+
+        self.assertEqual(result[0], 42)
+        self.assertTrue(result[1].startswith('test-executor'))
+        self.assertEqual(executor.stats()['completed'], 1)
+        executor.shutdown()
+
+    @async_test
+    async def test_rejects_calls_once_workers_and_queue_are_full(self):
+        executor = BoundedExecutor('test', 1, 1)
+        release = threading.Event()
+
+        running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(executor.active, 1)
+        self.assertEqual(executor.queued, 1)
+        with self.assertRaises(ExecutorSaturatedError):
+            await executor.run(release.wait)
+        self.assertEqual(executor.rejected, 1)
+
+        release.set()
+        await asyncio.gather(*running)
+
+        stats = executor.stats()
+        self.assertEqual(stats['active'], 0)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['completed'], 2)
+        executor.shutdown()
+
+    @async_test
+    async def test_exception_raised_by_call_is_propagated(self):
+        executor = BoundedExecutor('test', 1, 0)
+
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            await executor.run(fail)
+        self.assertEqual(executor.queued, 0)
+        self.assertEqual(executor.stats()['completed'], 0)
+        self.assertEqual(executor.stats()['failed'], 1)
+        executor.shutdown()
+
+
+class TestGetExecutor(TestCase):
+
+    def setUp(self):
+        executors.shutdown()
+
+    def tearDown(self):
+        executors.shutdown()
+
+    @patch('utilities.config.config', {'LDAP_EXECUTOR_MAX_WORKERS': '3', 'LDAP_EXECUTOR_MAX_QUEUE': '7'})
+    def test_executor_is_created_once_per_backend_and_sized_from_config(self):
+        ldap_executor = executors.get_executor(executors.LDAP)
+        cpm_executor = executors.get_executor('other')
+
+        self.assertIs(ldap_executor, executors.get_executor(executors.LDAP))
+        self.assertIsNot(ldap_executor, cpm_executor)
+        self.assertEqual((ldap_executor.max_workers, ldap_executor.max_queue), (3, 7))
+        self.assertEqual((cpm_executor.max_workers, cpm_executor.max_queue), (10, 100))
+        self.assertEqual(set(executors.stats()), {executors.LDAP, 'other'})
@@ -0,0 +1,59 @@
+import json
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+from utilities import json_serializer
+
+RESOURCE = {"resourceType": "Bundle", "entry": [{"fullUrl": "http://localhost/Endpoint/1", "total": 1}]}
+
+
+def _text(serialized):
+    return serialized.decode() if isinstance(serialized, bytes) else serialized
+
+
+class TestJsonSerializer(TestCase):
+
+    def tearDown(self):
+        json_serializer._serializer = json_serializer.get_serializer(json_serializer.AUTO)
+        json_serializer._pretty_print = True
+
+    def test_every_serializer_produces_equivalent_json(self):
+        for name, serializer in json_serializer.SERIALIZERS.items():
+            for indent in [None, 2, 4]:
+                with self.subTest(serializer=name, indent=indent):
+                    self.assertEqual(json.loads(serializer(RESOURCE, indent)), RESOURCE)
+
+    def test_stdlib_serializer_output(self):
+        serializer = json_serializer.get_serializer(json_serializer.STDLIB)
+
+        self.assertEqual(serializer(RESOURCE, None), json.dumps(RESOURCE, separators=(',', ':')))
+        self.assertEqual(serializer(RESOURCE, 2), json.dumps(RESOURCE, indent=2))
+
+    @skipIf(json_serializer.orjson is None, "orjson is not installed")
+    def test_orjson_serializer_output_matches_stdlib(self):
+        serializer = json_serializer.get_serializer(json_serializer.ORJSON)
+
+        for indent in [None, 2, 4]:
+            with self.subTest(indent=indent):
+                self.assertEqual(_text(serializer(RESOURCE, indent)), json_serializer._stdlib_dumps(RESOURCE, indent))
+
+    def test_unknown_serializer_raises_error(self):
+        with self.assertRaises(ValueError):
+            json_serializer.get_serializer("unknown")
+
+    def test_auto_selects_fastest_installed_serializer(self):
+        expected = json_serializer.ORJSON if json_serializer.orjson is not None else json_serializer.STDLIB
+
+        self.assertIs(json_serializer.get_serializer(json_serializer.AUTO), json_serializer.SERIALIZERS[expected])
+
+    def test_dumps_is_pretty_unless_configured_or_asked_otherwise(self):
+        self.assertIn("\n", _text(json_serializer.dumps(RESOURCE)))
+        self.assertNotIn("\n", _text(json_serializer.dumps(RESOURCE, pretty=False)))
+
+        config_values = {'JSON_SERIALIZER': json_serializer.STDLIB, 'JSON_PRETTY_PRINT': 'False'}
+        with patch('utilities.config.get_config', side_effect=lambda key, default=None: config_values[key]):
+            json_serializer.configure()
+
+        self.assertFalse(json_serializer.pretty_print_by_default())
+        self.assertEqual(json_serializer.dumps(RESOURCE), json.dumps(RESOURCE, separators=(',', ':')))
+        self.assertEqual(json_serializer.dumps(RESOURCE, pretty=True, indent=4), json.dumps(RESOURCE, indent=4))
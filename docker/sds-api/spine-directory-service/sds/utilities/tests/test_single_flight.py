@@ -0,0 +1,84 @@
+import asyncio
+from unittest import TestCase
+
+from utilities.single_flight import SingleFlight
+from utilities.test_utilities import async_test
+
+
+class TestSingleFlight(TestCase):
+
+    @async_test
+    async def test_concurrent_calls_for_same_key_share_one_execution(self):
+        single_flight = SingleFlight()
+        executions = []
+
+        async def call():
+            executions.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*[single_flight.do("key", call) for _ in range(5)])
+
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(single_flight.calls, 1)
+        self.assertEqual(single_flight.shared, 4)
+        self.assertEqual(single_flight.in_flight, 0)
+
+    @async_test
+    async def test_calls_for_different_keys_run_separately(self):
+        single_flight = SingleFlight()
+
+        async def call(value):
+            await asyncio.sleep(0)
+            return value
+
+        results = await asyncio.gather(single_flight.do("first", lambda: call(1)),
+                                       single_flight.do("second", lambda: call(2)))
+
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(single_flight.calls, 2)
+
+    @async_test
+    async def test_sequential_calls_are_not_shared(self):
+        single_flight = SingleFlight()
+
+        async def call():
+            return "result"
+
+        await single_flight.do("key", call)
+        await single_flight.do("key", call)
+
+        self.assertEqual(single_flight.calls, 2)
+        self.assertEqual(single_flight.shared, 0)
+
+    @async_test
+    async def test_exception_is_raised_to_every_caller(self):
+        single_flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0)
+            raise ValueError("some error")
+
+        results = await asyncio.gather(single_flight.do("key", call), single_flight.do("key", call),
+                                       return_exceptions=True)
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(single_flight.in_flight, 0)
+
+    @async_test
+    async def test_cancelled_caller_does_not_cancel_shared_call(self):
+        single_flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        cancelled = asyncio.ensure_future(single_flight.do("key", call))
+        remaining = asyncio.ensure_future(single_flight.do("key", call))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        self.assertEqual(await remaining, "result")
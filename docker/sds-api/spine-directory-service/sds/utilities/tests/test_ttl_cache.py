@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from utilities.ttl_cache import TTLCache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_get_returns_stored_value_until_it_expires(self):
+        cache = TTLCache(ttl=10, max_entries=5, clock=self.clock)
+        cache.put("key", "value")
+
+        self.clock.now = 9.9
+        self.assertEqual(cache.get("key"), "value")
+
+        self.clock.now = 10
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(cache.get("key", "default"), "default")
+
+    def test_least_recently_used_entry_is_evicted_when_full(self):
+        cache = TTLCache(ttl=10, max_entries=2, clock=self.clock)
+        cache.put("first", 1)
+        cache.put("second", 2)
+        cache.get("first")
+
+        cache.put("third", 3)
+
+        self.assertIn("first", cache)
+        self.assertNotIn("second", cache)
+        self.assertIn("third", cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_keys_are_ordered_from_least_to_most_recently_used(self):
+        cache = TTLCache(ttl=10, max_entries=3, clock=self.clock)
+        cache.put("first", 1)
+        cache.put("second", 2)
+        cache.get("first")
+
+        self.assertEqual(cache.keys(), ["second", "first"])
+
+    def test_hits_and_misses_are_counted(self):
+        cache = TTLCache(ttl=10, max_entries=2, clock=self.clock)
+        cache.get("key")
+        cache.put("key", "value")
+        cache.get("key")
+        cache.get("key")
+
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 2, "misses": 1, "evictions": 0})
+
+    def test_invalidate_and_clear(self):
+        cache = TTLCache(ttl=10, max_entries=2, clock=self.clock)
+        cache.put("first", 1)
+        cache.put("second", 2)
+
+        cache.invalidate("first")
+        self.assertNotIn("first", cache)
+        self.assertEqual(len(cache), 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_should_raise_error_if_limits_are_invalid(self):
+        with self.assertRaises(ValueError):
+            TTLCache(ttl=0, max_entries=1)
+        with self.assertRaises(ValueError):
+            TTLCache(ttl=1, max_entries=0)
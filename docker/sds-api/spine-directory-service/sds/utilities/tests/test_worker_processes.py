@@ -0,0 +1,115 @@
+import os
+import signal
+import tempfile
+import threading
+import time
+from typing import Callable, List
+from unittest import TestCase
+
+from utilities.worker_processes import WorkerProcesses
+
+
+class TestWorkerProcesses(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.starts_path = os.path.join(self.directory.name, "starts")
+
+    def _starts(self) -> List[str]:
+        if not os.path.exists(self.starts_path):
+            return []
+        with open(self.starts_path) as starts_file:
+            return starts_file.read().split()
+
+    def _run_workers(self, worker_processes: WorkerProcesses, worker: Callable[[int], int]):
+        """Start `worker_processes`, each worker recording its start then exiting with the status `worker` returns."""
+        task_id = worker_processes.start()
+        if task_id is not None:
+            status = 1
+            try:
+                with open(self.starts_path, "a") as starts_file:
+                    starts_file.write(f"{task_id}\n")
+                status = worker(task_id)
+            finally:
+                # a worker must never return into the test runner
+                os._exit(status)
+
+    def _signal_after_starts(self, *signals, to_sender: bool = False):
+        """
+        Send each (starts, signal) given to this process in turn, once workers have started that many times. If
+        `to_sender` the signals are delivered to the sending thread rather than left to the supervisor's thread.
+        """
+        def send():
+            if not to_sender:
+                # leave the signals to be handled by the supervisor's thread, as they would be in a real server
+                signal.pthread_sigmask(signal.SIG_BLOCK, [signum for _, signum in signals])
+            for starts, signum in signals:
+                deadline = time.monotonic() + 10
+                while len(self._starts()) < starts and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                if to_sender:
+                    signal.pthread_kill(threading.get_ident(), signum)
+                else:
+                    os.kill(os.getpid(), signum)
+        thread = threading.Thread(target=send)
+        thread.start()
+        return thread
+
+    def _wait_for_signal(self, task_id: int) -> int:
+        signal.pause()
+        return 0
+
+    def test_should_raise_error_if_processes_is_negative(self):
+        with self.assertRaises(ValueError):
+            WorkerProcesses(-1)
+
+    def test_workers_which_exit_unexpectedly_are_restarted(self):
+        worker_processes = WorkerProcesses(2, max_restarts=5)
+
+        # each worker fails the first time it runs
+        self._run_workers(worker_processes, lambda task_id: 1 if self._starts().count(str(task_id)) == 1 else 0)
+
+        self.assertEqual(sorted(self._starts()), ["0", "0", "1", "1"])
+        self.assertEqual(worker_processes.restarts, 2)
+
+    def test_gives_up_after_too_many_restarts(self):
+        worker_processes = WorkerProcesses(1, max_restarts=2)
+
+        with self.assertRaises(RuntimeError):
+            self._run_workers(worker_processes, lambda task_id: 1)
+
+        self.assertEqual(self._starts(), ["0", "0", "0"])
+
+    def test_sigterm_is_forwarded_to_workers_and_waited_for(self):
+        worker_processes = WorkerProcesses(3)
+        sender = self._signal_after_starts((3, signal.SIGTERM))
+        previous_handler = signal.getsignal(signal.SIGTERM)
+
+        self._run_workers(worker_processes, self._wait_for_signal)
+        sender.join()
+
+        self.assertEqual(sorted(self._starts()), ["0", "1", "2"])
+        self.assertEqual(worker_processes.restarts, 0)
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous_handler)
+
+    def test_sighup_restarts_workers_one_at_a_time(self):
+        worker_processes = WorkerProcesses(2)
+        sender = self._signal_after_starts((2, signal.SIGHUP), (4, signal.SIGTERM))
+
+        self._run_workers(worker_processes, self._wait_for_signal)
+        sender.join()
+
+        starts = self._starts()
+        self.assertEqual(sorted(starts[:2]), ["0", "1"])
+        self.assertEqual(sorted(starts[2:]), ["0", "1"])
+        self.assertEqual(worker_processes.restarts, 0)
+
+    def test_signals_delivered_to_another_thread_are_handled(self):
+        worker_processes = WorkerProcesses(2)
+        sender = self._signal_after_starts((2, signal.SIGHUP), (4, signal.SIGTERM), to_sender=True)
+
+        self._run_workers(worker_processes, self._wait_for_signal)
+        sender.join()
+
+        self.assertEqual(sorted(self._starts()), ["0", "0", "1", "1"])
@@ -0,0 +1,94 @@
+"""An in-process least recently used cache whose entries expire a fixed time after they were stored."""
+import collections
+import time
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+
+class TTLCache(object):
+    """
+    A bounded mapping which evicts the least recently used entry once `max_entries` is reached and treats entries older
+    than `ttl` seconds as absent. Hit, miss and eviction counts are kept so cache effectiveness can be reported.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        """
+        :param ttl: The number of seconds an entry is served for after it was stored.
+        :param max_entries: The maximum number of entries held before the least recently used one is evicted.
+        :param clock: A monotonic clock returning seconds, overridable for testing.
+        """
+        if ttl <= 0:
+            raise ValueError('ttl must be greater than 0')
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and self._is_fresh(entry)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """
+        Return the value stored against `key` if it has not expired, otherwise `default`.
+        """
+        entry = self._entries.get(key)
+        if entry is None or not self._is_fresh(entry):
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Return the value stored against `key` and its age in seconds, whether or not it has expired. Expired entries are
+        kept until they are overwritten or evicted, so this allows callers to fall back to a last known value. Peeking
+        does not count as a hit or miss and does not affect eviction order.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[0], self._clock() - entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Store `value` against `key`, evicting the least recently used entry if the cache is full.
+        """
+        self._entries[key] = (value, self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def keys(self) -> List[Hashable]:
+        """
+        Return the keys held, expired or not, from the least to the most recently used.
+        """
+        return list(self._entries)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _is_fresh(self, entry) -> bool:
+        return self._clock() - entry[1] < self.ttl
@@ -0,0 +1,187 @@
+"""Forks and supervises the worker processes of a multi-process server."""
+import os
+import select
+import signal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import tornado.process
+
+from utilities import integration_adaptors_logger as log
+
+logger = log.IntegrationAdaptorsLogger(__name__)
+
+# the signals the supervisor handles, which are blocked while forking so a worker never runs the supervisor's handlers
+_SUPERVISOR_SIGNALS = [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]
+_FORK_BLOCKED_SIGNALS = _SUPERVISOR_SIGNALS + [signal.SIGCHLD]
+
+
+class WorkerProcesses(object):
+    """
+    Forks a number of worker processes and supervises them from the parent process, which serves no requests itself.
+
+    * A worker which exits unexpectedly (with a non-zero status or killed by a signal) is restarted, up to
+      `max_restarts` times in total.
+    * SIGTERM or SIGINT is forwarded to every worker as SIGTERM, so they can finish the requests they are handling, and
+      the supervisor waits for them all to exit before it does.
+    * SIGHUP restarts the workers one at a time, each being stopped with SIGTERM and replaced once it has exited, so
+      the others carry on serving requests meanwhile.
+    """
+
+    def __init__(self, processes: int, max_restarts: int = 100):
+        """
+        :param processes: The number of worker processes, or 0 for one per CPU.
+        :param max_restarts: The number of times workers which exit unexpectedly are restarted before giving up.
+        """
+        if processes < 0:
+            raise ValueError('processes must not be negative')
+
+        self.processes = processes or tornado.process.cpu_count()
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self._children: Dict[int, int] = {}
+        self._stopping = False
+        self._rolling_restart: List[int] = []
+        self._wakeup_fds: Optional[Tuple[int, int]] = None
+
+    def start(self) -> Optional[int]:
+        """
+        Fork the worker processes. In each worker this returns its task id, from 0 to `processes - 1`. In the supervisor
+        it only returns, with None, once every worker has exited.
+
+        :raises RuntimeError: if workers have exited unexpectedly more than `max_restarts` times.
+        """
+        logger.info('Forking {processes} worker processes', fparams={'processes': self.processes})
+        previous_handlers = {signum: signal.signal(signum, self._handle_signal) for signum in _SUPERVISOR_SIGNALS}
+        try:
+            for task_id in range(self.processes):
+                if self._start_worker(task_id) is not None:
+                    return task_id
+            return self._supervise()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _supervise(self) -> Optional[int]:
+        # a signal sent to the process may be delivered to any of its threads, which would leave the supervisor
+        # blocked waiting for a child, so it instead waits on the wakeup fd every handled signal (SIGCHLD too) writes to
+        self._wakeup_fds = os.pipe()
+        for fd in self._wakeup_fds:
+            os.set_blocking(fd, False)
+        previous_wakeup_fd = signal.set_wakeup_fd(self._wakeup_fds[1])
+        previous_sigchld_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        try:
+            while True:
+                for pid, status in self._reap():
+                    task_id = self._handle_exit(pid, status)
+                    if task_id is not None:
+                        return task_id
+                if not self._children:
+                    break
+                select.select([self._wakeup_fds[0]], [], [])
+                self._drain_wakeup_fd()
+        finally:
+            self._close_wakeup_fds(previous_wakeup_fd, previous_sigchld_handler)
+
+        logger.info('Every worker process has exited')
+        return None
+
+    def _reap(self) -> Iterator[Tuple[int, int]]:
+        """Yield the pid and status of each worker which has exited, without waiting for any others."""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            yield pid, status
+
+    def _handle_exit(self, pid: int, status: int) -> Optional[int]:
+        """Act on a worker having exited, returning a task id if this is a worker forked to replace it."""
+        task_id = self._children.pop(pid, None)
+        if task_id is None:
+            return None
+
+        if self._stopping:
+            logger.info('Worker process {task_id} ({pid}) stopped', fparams={'task_id': task_id, 'pid': pid})
+        elif self._rolling_restart and self._rolling_restart[0] == task_id:
+            logger.info('Restarting worker process {task_id}', fparams={'task_id': task_id})
+            self._rolling_restart.pop(0)
+            if self._start_worker(task_id) is not None:
+                return task_id
+            self._stop_next_worker()
+        elif os.WIFSIGNALED(status) or os.WEXITSTATUS(status) != 0:
+            logger.warning('Worker process {task_id} ({pid}) exited unexpectedly with status {status}',
+                           fparams={'task_id': task_id, 'pid': pid, 'status': status})
+            self.restarts += 1
+            if self.restarts > self.max_restarts:
+                raise RuntimeError('Too many worker process restarts, giving up')
+            if self._start_worker(task_id) is not None:
+                return task_id
+        else:
+            logger.info('Worker process {task_id} ({pid}) exited', fparams={'task_id': task_id, 'pid': pid})
+        return None
+
+    def _drain_wakeup_fd(self):
+        try:
+            while os.read(self._wakeup_fds[0], 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _close_wakeup_fds(self, previous_wakeup_fd: int = -1, previous_sigchld_handler=signal.SIG_DFL):
+        if self._wakeup_fds is None:
+            return
+        signal.set_wakeup_fd(previous_wakeup_fd)
+        signal.signal(signal.SIGCHLD, previous_sigchld_handler)
+        for fd in self._wakeup_fds:
+            os.close(fd)
+        self._wakeup_fds = None
+
+    def _start_worker(self, task_id: int) -> Optional[int]:
+        """Fork a worker, returning its task id in the worker and None in the supervisor."""
+        blocked = signal.pthread_sigmask(signal.SIG_BLOCK, _FORK_BLOCKED_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                for signum in _SUPERVISOR_SIGNALS:
+                    signal.signal(signum, signal.SIG_DFL)
+                self._close_wakeup_fds()
+                self._children.clear()
+                return task_id
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+
+        logger.info('Started worker process {task_id} ({pid})', fparams={'task_id': task_id, 'pid': pid})
+        self._children[pid] = task_id
+        return None
+
+    def _handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            if not self._stopping and not self._rolling_restart:
+                logger.info('Restarting every worker process one at a time')
+                self._rolling_restart = sorted(self._children.values())
+                self._stop_next_worker()
+            return
+
+        logger.info('Stopping every worker process on signal {signum}', fparams={'signum': signum})
+        self._stopping = True
+        self._rolling_restart = []
+        for pid in self._children:
+            self._kill(pid)
+
+    def _stop_next_worker(self):
+        if self._rolling_restart:
+            task_id = self._rolling_restart[0]
+            for pid, child_task_id in self._children.items():
+                if child_task_id == task_id:
+                    self._kill(pid)
+
+    @staticmethod
+    def _kill(pid: int):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            # already exited, so it is about to be reaped
+            pass